@@ -2,9 +2,10 @@ import threading
 import time
 import logging
 from local_db_writer import LocalDatabaseWriter
-from firestore_writer import FirestoreDatabaseWriter
 from canbus_pipe_reader import CanbusPipeReader
 from shared_data import initialize_sqlite
+import metrics
+import profiler
 from threading import Event
 import os
 
@@ -17,6 +18,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+CLOUD_START_DELAY_SECS = 30  # Start the uploader anyway if no fix arrives this soon
+
 if __name__ == "__main__":
     db_name = "boat_tracker.db"
     
@@ -24,27 +27,67 @@ if __name__ == "__main__":
     initialize_sqlite(db_name)
 
     local_writer = LocalDatabaseWriter(db_name)
-    firestore_writer = FirestoreDatabaseWriter(db_name)
-    canbus_reader = CanbusPipeReader()
+    canbus_reader = CanbusPipeReader(db_name=db_name)
+    firestore_writer = None
 
     local_writer.start()
-    firestore_writer.start()
     canbus_reader.start()
 
+    metrics_server = None
+    if metrics.METRICS_PORT:
+        try:
+            metrics_server = metrics.MetricsServer()
+            metrics_server.start()
+        except OSError as e:
+            logging.error(f"Metrics endpoint unavailable: {e}")
+
+    # kill -USR1 toggles a sampling profile, kill -USR2 logs all thread stacks
+    profiler.install_signal_handlers()
+    control_server = None
+    if profiler.CONTROL_SOCKET:
+        try:
+            control_server = profiler.ControlServer()
+            control_server.start()
+        except OSError as e:
+            logging.error(f"Control socket unavailable: {e}")
+
     stop_event = Event()
+    started = time.monotonic()
 
     try:
-        while not stop_event.wait(5):  # Only wake up every 5 seconds
+        # The cloud stack (grpc, protobuf) loads only after the first fix is stored
+        while not local_writer.first_fix.wait(1) and time.monotonic() - started < CLOUD_START_DELAY_SECS:
             pass
+        from firestore_writer import FirestoreDatabaseWriter
+        firestore_writer = FirestoreDatabaseWriter(db_name)
+        firestore_writer.start()
+        logging.info(f"Uploader started {time.monotonic() - started:.1f} s after startup.")
+
+        write_stats = bool(metrics.STATS_FILE)
+        while not stop_event.wait(5):  # Only wake up every 5 seconds
+            if not write_stats:
+                continue
+            try:
+                metrics.write_stats_file()
+            except OSError as e:
+                logging.error(f"Failed to write {metrics.STATS_FILE}; stats file disabled: {e}")
+                write_stats = False
 
     except KeyboardInterrupt:
         logging.info("Stopping threads...")
-        local_writer.running = False
-        firestore_writer.running = False
-        canbus_reader.running = False
+        local_writer.stop()
+        canbus_reader.stop()
+        if firestore_writer is not None:
+            firestore_writer.stop()
 
         local_writer.join()
-        firestore_writer.join()
         canbus_reader.join()
+        if firestore_writer is not None:
+            firestore_writer.join()
+        if metrics_server is not None:
+            metrics_server.stop()
+        if control_server is not None:
+            control_server.stop()
+        profiler.stop_profile()  # Writes the reports of a profile still running
 
     logging.info("Stopped.")
@@ -0,0 +1,127 @@
+import time
+import logging
+
+CANBUS_SAMPLE_INTERVAL_SECS = 1.0  # Store at most one sample per PGN this often; 0 keeps all
+CANBUS_RETENTION_SECS = 2 * 24 * 3600  # Raw samples older than this are pruned once rolled up
+CANBUS_BUFFER_ROWS = 500
+CANBUS_MAX_UNFLUSHED_SECS = 10
+ROLLUP_SECS = 60  # Rollup bucket width
+ROLLUP_JOB = "canbus_rollup"
+
+INSERT_SAMPLE_QUERY = "INSERT INTO canbus_samples (pgn, tstamp, value) VALUES (?, ?, ?)"
+MAX_SAMPLE_ID_QUERY = "SELECT MAX(id) FROM canbus_samples"
+JOB_STATE_QUERY = "SELECT last_id FROM job_state WHERE name = ?"
+SET_JOB_STATE_QUERY = """
+    INSERT INTO job_state (name, last_id) VALUES (?, ?)
+    ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id
+"""
+# Folds samples with id in (?, ?] into their minute buckets. A bucket that
+# was already uploaded and gains samples goes back to pending.
+ROLLUP_QUERY = f"""
+    INSERT INTO canbus_rollups (pgn, minute, count, min_value, max_value, total)
+    SELECT pgn, CAST(tstamp / {ROLLUP_SECS} AS INTEGER) * {ROLLUP_SECS}, COUNT(*), MIN(value), MAX(value), SUM(value)
+    FROM canbus_samples WHERE id > ? AND id <= ?
+    GROUP BY 1, 2
+    ON CONFLICT(pgn, minute) DO UPDATE SET
+        count = count + excluded.count,
+        min_value = MIN(min_value, excluded.min_value),
+        max_value = MAX(max_value, excluded.max_value),
+        total = total + excluded.total,
+        uploaded = 0
+"""
+PRUNE_QUERY = "DELETE FROM canbus_samples WHERE tstamp < ? AND id <= ?"
+# AUTOINCREMENT: ids must stay above the rollup mark even after pruning empties the table
+CREATE_SAMPLES_AUTOINCREMENT_QUERY = """
+    CREATE TABLE canbus_samples_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        pgn TEXT NOT NULL,
+        tstamp REAL NOT NULL,
+        value REAL NOT NULL
+    )
+"""
+
+class SampleThinner:
+    """
+    Keeps at most one sample per PGN per `interval` seconds. Only kept
+    samples are stored, so rollups summarize the thinned stream.
+    """
+
+    def __init__(self, interval=CANBUS_SAMPLE_INTERVAL_SECS):
+        self.interval = interval
+        self.last_kept = {}
+
+    def filter(self, samples):
+        if self.interval <= 0:
+            return list(samples)
+        kept = []
+        for name, timestamp, value in samples:
+            last = self.last_kept.get(name)
+            if last is None or timestamp - last >= self.interval or timestamp < last:
+                self.last_kept[name] = timestamp
+                kept.append((name, timestamp, value))
+        return kept
+
+def get_job_state(conn, name):
+    row = conn.execute(JOB_STATE_QUERY, (name,)).fetchone()
+    return row[0] if row else 0
+
+def rollup_canbus_samples(conn):
+    """
+    Folds samples added since the last run into canbus_rollups.
+    Returns the number of new samples processed.
+
+    Rollups are built from stored samples, which SampleThinner has already
+    thinned to one per PGN per CANBUS_SAMPLE_INTERVAL_SECS: count is the
+    number of stored samples, and a spike between two kept samples does
+    not reach min or max.
+    """
+    last_id = get_job_state(conn, ROLLUP_JOB)
+    max_id = conn.execute(MAX_SAMPLE_ID_QUERY).fetchone()[0]
+    if max_id is None or max_id <= last_id:
+        return 0
+    with conn:
+        conn.execute(ROLLUP_QUERY, (last_id, max_id))
+        conn.execute(SET_JOB_STATE_QUERY, (ROLLUP_JOB, max_id))
+    return max_id - last_id
+
+def autoincrement_canbus_samples(conn):
+    """
+    Schema migration: rebuilds canbus_samples with AUTOINCREMENT ids. Plain
+    rowids restart below the rollup mark once pruning empties the table,
+    and those samples were never rolled up and later pruned. A database
+    already in that state has its mark moved back so they are rolled up.
+    """
+    last_id = get_job_state(conn, ROLLUP_JOB)
+    max_id = conn.execute(MAX_SAMPLE_ID_QUERY).fetchone()[0] or 0
+    if max_id < last_id:
+        # Every stored sample arrived after the ids restarted
+        conn.execute(SET_JOB_STATE_QUERY, (ROLLUP_JOB, 0))
+    conn.execute(CREATE_SAMPLES_AUTOINCREMENT_QUERY)
+    conn.execute("INSERT INTO canbus_samples_new (id, pgn, tstamp, value) SELECT id, pgn, tstamp, value FROM canbus_samples")
+    conn.execute("DROP TABLE canbus_samples")
+    conn.execute("ALTER TABLE canbus_samples_new RENAME TO canbus_samples")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_canbus_samples_tstamp ON canbus_samples (tstamp)")
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'canbus_samples'")
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('canbus_samples', ?)", (max(max_id, last_id),))
+
+def prune_canbus_samples(conn, retention_secs=CANBUS_RETENTION_SECS, now=None):
+    """Deletes raw samples past retention that have already been rolled up."""
+    now = time.time() if now is None else now
+    rolled_up = get_job_state(conn, ROLLUP_JOB)
+    with conn:
+        pruned = conn.execute(PRUNE_QUERY, (now - retention_secs, rolled_up)).rowcount
+    if pruned:
+        logging.info(f"Pruned {pruned} CAN bus samples older than {retention_secs} s.")
+    return pruned
+
+def rollup_document(rows):
+    """Maps (pgn, minute, count, min, max, total) rows to {minute: {pgn: stats}}."""
+    minutes = {}
+    for pgn, minute, count, min_value, max_value, total in rows:
+        minutes.setdefault(str(minute), {})[pgn] = {
+            "count": count,
+            "min": min_value,
+            "max": max_value,
+            "avg": total / count,
+        }
+    return minutes
@@ -2,42 +2,157 @@ import threading
 import json
 import time
 import os
+import io
+import selectors
 import logging
-from shared_data import latest_canbus_data, canbus_lock
+import mytime
+from shared_data import canbus_store, get_connection_manager, WriteBuffer
+from canbus_history import (SampleThinner, rollup_canbus_samples, prune_canbus_samples, INSERT_SAMPLE_QUERY,
+                            CANBUS_BUFFER_ROWS, CANBUS_MAX_UNFLUSHED_SECS, ROLLUP_SECS)
 
 PIPE_PATH = "/tmp/canbus_pipe"
+READ_BYTES = 64 * 1024  # Size of the reusable read buffer
+MAX_LINE_BYTES = 4096  # Partial lines longer than this are discarded
+SELECT_TIMEOUT_SECS = 1.0
+REOPEN_DELAY_SECS = 1  # Back-off before reopening the FIFO after an OSError; bad lines never wait
 
 class CanbusPipeReader(threading.Thread):
     """Reads messages from the named pipe and updates shared CAN bus data."""
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, pipe_path=PIPE_PATH, db_name=None):
+        super().__init__(name="canbus-reader")
+        self.pipe_path = pipe_path
+        self.db_name = db_name
+        self.sqlite = None
+        self.sample_buffer = None
+        if db_name is not None:
+            # Persist samples to canbus_samples and roll them up periodically
+            self.sqlite = get_connection_manager(db_name)
+            self.sample_buffer = WriteBuffer(self.sqlite, INSERT_SAMPLE_QUERY,
+                                             CANBUS_BUFFER_ROWS, CANBUS_MAX_UNFLUSHED_SECS)
+            self.thinner = SampleThinner()
+        self.next_rollup = time.monotonic() + ROLLUP_SECS
         self.running = True
+        self.stop_event = threading.Event()
+        self.chunk = bytearray(READ_BYTES)
+        self.messages = 0
+        self.malformed = 0
+        self.dropped = 0
+        self.batches = 0
 
     def run(self):
         """Continuously reads CAN bus messages and updates shared memory."""
-        if not os.path.exists(PIPE_PATH):
-            os.mkfifo(PIPE_PATH)
+        if not os.path.exists(self.pipe_path):
+            os.mkfifo(self.pipe_path)
 
-        while self.running:
+        try:
+            while self.running and not self.stop_event.is_set():
+                try:
+                    self.read_pipe()
+                except Exception as e:
+                    logging.error(f"Error reading from CAN bus pipe: {e}")
+                    # Intentional: only reached when the FIFO cannot be opened or read, e.g.
+                    # it was removed, and without it a lasting error would spin on the log
+                    self.stop_event.wait(REOPEN_DELAY_SECS)
+        finally:
+            if self.sqlite is not None:
+                self.sample_buffer.flush()
+                self.sqlite.close()
+
+    def read_pipe(self):
+        """Reads the FIFO with non-blocking reads until stopped."""
+        read_fd = os.open(self.pipe_path, os.O_RDONLY | os.O_NONBLOCK)
+        # Holding a write end open means the pipe never reports EOF when the
+        # producer restarts, so select() only wakes for real data.
+        keepalive_fd = os.open(self.pipe_path, os.O_WRONLY | os.O_NONBLOCK)
+        fifo = io.FileIO(read_fd, "r", closefd=False)
+        view = memoryview(self.chunk)
+        buffer = bytearray()
+
+        with selectors.DefaultSelector() as selector:
+            try:
+                selector.register(read_fd, selectors.EVENT_READ)
+                while self.running and not self.stop_event.is_set():
+                    ready = selector.select(timeout=SELECT_TIMEOUT_SECS)
+                    self.maintain()
+                    if not ready:
+                        continue
+                    # Drain everything the producer has written so far
+                    while True:
+                        count = fifo.readinto(view)
+                        if not count:
+                            break
+                        buffer += view[:count]
+                        if count < READ_BYTES:
+                            break
+                    self.handle_buffer(buffer)
+            finally:
+                os.close(keepalive_fd)
+                os.close(read_fd)
+
+    def handle_buffer(self, buffer):
+        """Parses every complete line in `buffer` as one batch and removes them."""
+        end = buffer.rfind(b"\n")
+        if end >= 0:
+            lines = bytes(buffer[:end]).split(b"\n")
+            del buffer[:end + 1]
+            self.apply_batch(self.parse_batch(lines))
+
+        if len(buffer) > MAX_LINE_BYTES:
+            logging.warning(f"Discarding {len(buffer)} bytes without a newline from CAN bus pipe.")
+            self.dropped += 1
+            buffer.clear()
+
+    def parse_batch(self, lines):
+        """Returns (name, timestamp, value) samples for the valid messages in `lines`."""
+        received = mytime.now()
+        samples = []
+        for line in lines:
+            if not line.strip():
+                continue
             try:
-                with open(PIPE_PATH, "r") as fifo:
-                    while self.running:
-                        line = fifo.readline().strip()
-                        if not line:
-                            time.sleep(0.1)
-                            continue
-
-                        message = json.loads(line)
-                        timestamp = message.get("timestamp", time.time())
-
-                        with canbus_lock:
-                            if "PGNname" in message:
-                                latest_canbus_data[message["PGNname"]] = {
-                                    "value": message["value"],
-                                    "timestamp": timestamp,
-                                }
-            except Exception as e:
-                logging.error(f"Error reading from CAN bus pipe: {e}")
-
-            time.sleep(1)
+                message = json.loads(line)
+                name = message.get("PGNname")
+                if name is None:
+                    self.dropped += 1
+                    continue
+                samples.append((name, float(message.get("timestamp", received)), float(message["value"])))
+                self.messages += 1
+            except (ValueError, TypeError, KeyError, AttributeError):
+                self.malformed += 1
+        return samples
+
+    def apply_batch(self, samples):
+        """Publishes one batch of samples under a single lock acquisition."""
+        if not samples:
+            return
+        canbus_store.extend(samples)
+        if self.sample_buffer is not None:
+            self.sample_buffer.extend(self.thinner.filter(samples))
+        self.batches += 1
+
+    def maintain(self):
+        """Flushes buffered samples when due and runs the rollup and pruning once a minute."""
+        if self.sample_buffer is None:
+            return
+        if self.sample_buffer.due():
+            self.sample_buffer.flush()
+        if time.monotonic() >= self.next_rollup:
+            self.next_rollup = time.monotonic() + ROLLUP_SECS
+            self.sample_buffer.flush()
+            conn = self.sqlite.connection()
+            rollup_canbus_samples(conn)
+            prune_canbus_samples(conn, now=mytime.now())
+
+    def stats(self):
+        return {
+            "messages": self.messages,
+            "malformed": self.malformed,
+            "dropped": self.dropped,
+            "batches": self.batches,
+        }
+
+    def stop(self):
+        """Signals the thread to stop gracefully."""
+        self.running = False
+        self.stop_event.set()
@@ -0,0 +1,185 @@
+import random
+import select
+import socket
+import time
+import logging
+import threading
+
+PROBE_HOST = "firestore.googleapis.com"
+PROBE_PORT = 443
+PROBE_TIMEOUT_SECS = 3
+BACKOFF_BASE_SECS = 30
+BACKOFF_MAX_SECS = 30 * 60  # Ceiling for the wait between probes while offline
+BACKOFF_JITTER = 0.5  # Each wait is shortened by up to this fraction
+WAIT_SLICE_SECS = 1.0  # How often a wait checks for shutdown and route changes
+ROUTES_PATH = "/proc/net/route"
+
+# rtnetlink multicast groups: link up/down, address and route changes
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+
+class TcpProbe:
+    """
+    Reachability check: a TCP connect to `host:port`, which also exercises
+    DNS. Any callable returning a bool can stand in for it, e.g.
+    `lambda: False` to simulate being offline.
+    """
+
+    def __init__(self, host=PROBE_HOST, port=PROBE_PORT, timeout=PROBE_TIMEOUT_SECS):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def __call__(self):
+        try:
+            with socket.create_connection((self.host, self.port), timeout=self.timeout):
+                return True
+        except OSError as e:
+            logging.debug(f"Connectivity probe to {self.host}:{self.port} failed: {e}")
+            return False
+
+def read_routes(path=ROUTES_PATH):
+    """Returns the kernel's IPv4 routing table text, or None where there isn't one."""
+    try:
+        with open(path) as routes:
+            return routes.read()
+    except OSError:
+        return None
+
+class NetworkWatcher:
+    """
+    Sleeps until a timeout or a network change. Uses an rtnetlink socket
+    where available (Linux), otherwise watches the routing table for changes.
+    """
+
+    def __init__(self):
+        self.sock = None
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_IFADDR))
+            sock.setblocking(False)
+            self.sock = sock
+        except (AttributeError, OSError) as e:
+            logging.info(f"Netlink unavailable ({e}); watching the routing table instead.")
+        self.routes = read_routes()
+
+    def wait(self, timeout, stop_event):
+        """Returns True as soon as the network changes, False on timeout or shutdown."""
+        deadline = time.monotonic() + timeout
+        while not stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            wait_secs = min(remaining, WAIT_SLICE_SECS)
+
+            if self.sock is not None:
+                readable, _, _ = select.select([self.sock], [], [], wait_secs)
+                if readable:
+                    self.drain()
+                    return True
+            else:
+                stop_event.wait(wait_secs)
+                routes = read_routes()
+                if routes != self.routes:
+                    self.routes = routes
+                    return True
+        return False
+
+    def drain(self):
+        """Discards queued netlink messages; any change is reason enough to re-probe."""
+        try:
+            while self.sock.recv(65536):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+class ConnectivityScheduler:
+    """
+    Decides when the uploader may try the network. While offline it probes
+    with exponential backoff and jitter, up to BACKOFF_MAX_SECS apart, and
+    re-probes at once when an interface or route changes. Failed uploads
+    count towards the same backoff, so a server that keeps failing while
+    the probe passes is not retried on every wake-up; only a successful
+    upload resets it.
+    """
+
+    def __init__(self, probe=None, watcher=None, base_secs=BACKOFF_BASE_SECS,
+                 max_secs=BACKOFF_MAX_SECS, jitter=BACKOFF_JITTER, rng=None):
+        self.probe = probe or TcpProbe()
+        self.watcher = watcher or NetworkWatcher()
+        self.base_secs = base_secs
+        self.max_secs = max_secs
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+        self.online = None  # Unknown until the first probe
+        self.failures = 0  # Failed probes and uploads since the last successful upload
+        self.retry_at = None  # Monotonic time before which a failed upload is not retried
+        self.probes = 0
+        self.lock = threading.Lock()  # Uploads report from several commit threads
+
+    def next_delay(self):
+        """Backoff before the next probe, given the failures so far."""
+        delay = min(self.max_secs, self.base_secs * 2 ** max(0, self.failures - 1))
+        return delay * (1 - self.jitter * self.rng.random())
+
+    def wait_until_online(self, stop_event):
+        """
+        Blocks until an upload may be tried: after the backoff of a failed
+        upload, once a probe succeeds. Returns False if stopped first.
+        """
+        if self.online:
+            return True
+        with self.lock:
+            retry_at, self.retry_at = self.retry_at, None
+        if retry_at is not None and retry_at > time.monotonic():
+            logging.debug(f"Upload failed; retrying in {retry_at - time.monotonic():.0f} s unless the network changes.")
+            self.watcher.wait(retry_at - time.monotonic(), stop_event)
+
+        unreachable = False
+        while not stop_event.is_set():
+            self.probes += 1
+            if self.probe():
+                if unreachable:
+                    logging.info("Network reachable again.")
+                self.online = True
+                return True
+
+            with self.lock:
+                self.failures += 1
+                delay = self.next_delay()
+            if not unreachable:
+                logging.warning("Network unreachable; backing off uploads.")
+            unreachable = True
+            self.online = False
+            logging.debug(f"Offline; next probe in {delay:.0f} s unless the network changes.")
+            if self.watcher.wait(delay, stop_event):
+                logging.info("Network change detected; probing now.")
+        return False
+
+    def report_success(self):
+        """Called after a successful upload; ends the backoff."""
+        with self.lock:
+            if self.failures:
+                logging.info(f"Upload succeeded after {self.failures} failed attempts.")
+            self.online = True
+            self.failures = 0
+            self.retry_at = None
+
+    def report_failure(self):
+        """
+        Called after a failed upload: the next one waits out the backoff,
+        then for a successful probe. Concurrent failures of one cycle count once.
+        """
+        with self.lock:
+            if self.online is False:
+                return
+            self.online = False
+            self.failures += 1
+            self.retry_at = time.monotonic() + self.next_delay()
@@ -1,95 +1,559 @@
+import os
+import socket
 import threading
 import time
-import sqlite3
 import logging
-from google.cloud import firestore
-from google.api_core.exceptions import GoogleAPICallError
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.exceptions import GoogleAPICallError, ServiceUnavailable, Unauthenticated, PermissionDenied
+from google.auth.exceptions import GoogleAuthError
+import mytime
+from shared_data import get_connection_manager, upload_notifier, document_key, UNQUEUE_REMOTE_DELETE_QUERY
+from connectivity import ConnectivityScheduler
+import metrics
+from metrics import LOOP_LOG_LEVEL
+from canbus_history import rollup_document
+from trips import trip_document, trip_key, TRIP_FIELDS, TRIP_COLLECTION
+from gps_archive import archive_uploaded_rows, ARCHIVE_CHUNK_ROWS
+from segment_codec import encode_segment, split_segments, window_start, SEGMENT_SECS, SEGMENT_ROW_COLUMNS
 
-BATCH_SIZE = 50  # Ensure this does not exceed Firestore's 500-limit
-UPLOAD_INTERVAL = 30  # Interval to check for new data
+MIN_BATCH_SIZE = 50
+MAX_BATCH_SIZE = 500  # Firestore's per-batch write limit
+TARGET_COMMIT_SECS = 2.0  # Grow batches while commits finish faster than this
+UPLOAD_WORKERS = 3  # Batches committed concurrently
+UPLOAD_INTERVAL = 30  # Fallback poll for new data; commits by LocalDatabaseWriter wake the uploader sooner
+UPLOAD_DEBOUNCE_SECS = 0.25  # After a wake-up, wait this long so closely spaced commits share a cycle
 MAX_RETRIES = 3  # Retry failed uploads
+UPLOAD_MODE = "rows"  # "rows": one document per gps_data row, "segments": packed time windows
+SEGMENT_COLLECTION = "gps_segments"
+SEGMENTS_PER_BATCH = 8  # Keeps a commit well under Firestore's 10 MiB request limit
+SYNC_CANBUS_ROLLUPS = True  # Upload per-minute CAN rollups; raw canbus_samples stay local
+ROLLUP_COLLECTION = "canbus_rollups"
+ROLLUP_DOC_SECS = 3600  # One rollup document per hour
+ROLLUPS_PER_CYCLE = 500
+SYNC_TRIPS = True  # Upload one summary document per trip
+TRIPS_PER_CYCLE = 100
+DELETES_PER_CYCLE = 500  # Queued in remote_deletes, e.g. trips a rebuild dropped
+SYNC_LIVE_POSITION = True  # Keep one document per boat at the newest fix, stored or not
+LIVE_COLLECTION = "live_positions"
+LIVE_ENGINE_ON_SECS = 30  # Shortest spacing of live position writes while the engine runs
+LIVE_ENGINE_OFF_SECS = 300
+LIVE_FIELDS = ("tz_offset", "utc_shifted_tstamp", "latitude", "longitude", "altitude",
+               "rpm", "engine_hours", "coolant_temp", "alternator_voltage")
+ARCHIVE_UPLOADED_ROWS = True  # Compact old uploaded rows into gps_archive while idle
+ARCHIVE_INTERVAL_SECS = 6 * 3600
+ARCHIVE_CHUNKS_PER_PASS = 16  # Bounds how long one idle pass holds the database
+CATCHUP_MIN_BACKLOG = 500  # Pending rows that trigger catch-up mode
+CATCHUP_OVERVIEW_POINTS = 200  # Thinned backlog points sent right after the latest fix
+# Columns of a row document, in row_document() index order
+UPLOAD_COLUMNS = ("id, tz_offset, utc_shifted_tstamp, latitude, longitude, altitude, "
+                  "rpm, engine_hours, coolant_temp, alternator_voltage")
+SELECT_PAGE_QUERY = f"SELECT {UPLOAD_COLUMNS} FROM gps_data WHERE uploaded = 0 AND id > ? ORDER BY id LIMIT ?"
+SELECT_LATEST_PENDING_QUERY = f"SELECT {UPLOAD_COLUMNS} FROM gps_data WHERE uploaded = 0 ORDER BY id DESC LIMIT 1"
+SELECT_OVERVIEW_QUERY = (
+    f"SELECT {UPLOAD_COLUMNS} FROM gps_data WHERE uploaded = 0 AND id % ? = 0 ORDER BY id DESC LIMIT ?"
+)
+COUNT_PENDING_QUERY = "SELECT COUNT(*) FROM gps_data WHERE uploaded = 0"
+HAS_PENDING_ROWS_QUERY = "SELECT EXISTS(SELECT 1 FROM gps_data WHERE uploaded = 0)"
+HAS_PENDING_ROLLUPS_QUERY = "SELECT EXISTS(SELECT 1 FROM canbus_rollups WHERE uploaded = 0)"
+HAS_PENDING_TRIPS_QUERY = "SELECT EXISTS(SELECT 1 FROM trips WHERE uploaded = 0)"
+HAS_PENDING_DELETES_QUERY = "SELECT EXISTS(SELECT 1 FROM remote_deletes)"
+SAVE_PROGRESS_QUERY = """
+    INSERT INTO upload_progress (name, value) VALUES (?, ?)
+    ON CONFLICT(name) DO UPDATE SET value = excluded.value
+"""
+MARK_UPLOADED_QUERY = "UPDATE gps_data SET uploaded = 1 WHERE id = ?"
+JOURNAL_PENDING_QUERY = "INSERT OR IGNORE INTO upload_journal (row_id) VALUES (?)"
+JOURNAL_COMMITTED_QUERY = "UPDATE upload_journal SET committed = 1 WHERE row_id = ?"
+JOURNAL_DELETE_QUERY = "DELETE FROM upload_journal WHERE row_id = ?"
+JOURNAL_RECOVER_QUERY = "UPDATE gps_data SET uploaded = 1 WHERE id IN (SELECT row_id FROM upload_journal WHERE committed = 1)"
+JOURNAL_CLEAR_QUERY = "DELETE FROM upload_journal WHERE committed = 1"
+SELECT_PENDING_ROLLUPS_QUERY = (
+    "SELECT pgn, minute, count, min_value, max_value, total FROM canbus_rollups "
+    "WHERE uploaded = 0 ORDER BY minute LIMIT ?"
+)
+# The count check skips buckets the rollup job grew while they were in flight
+MARK_ROLLUP_UPLOADED_QUERY = "UPDATE canbus_rollups SET uploaded = 1 WHERE pgn = ? AND minute = ? AND count = ?"
+SELECT_PENDING_TRIPS_QUERY = f"SELECT {', '.join(TRIP_FIELDS)} FROM trips WHERE uploaded = 0 ORDER BY id LIMIT ?"
+# The last_id and closed checks skip trips the writer extended or closed while they were in flight
+MARK_TRIP_UPLOADED_QUERY = "UPDATE trips SET uploaded = 1 WHERE id = ? AND last_id = ? AND closed = ?"
+SELECT_PENDING_DELETES_QUERY = "SELECT collection, doc_key FROM remote_deletes LIMIT ?"
+SELECT_WINDOW_QUERY = (
+    f"SELECT {', '.join(SEGMENT_ROW_COLUMNS)} FROM gps_data "
+    "WHERE utc_shifted_tstamp >= ? AND utc_shifted_tstamp < ? ORDER BY utc_shifted_tstamp, id"
+)
+
+# Prefix of every document ID, so several boats can share one collection
+DEVICE_ID = os.environ.get("BOAT_TRACKER_DEVICE_ID") or socket.gethostname()
+
+# One document write, and the gps_data rows it covers; a doc of None deletes the document
+UploadWrite = namedtuple("UploadWrite", ["collection", "doc_id", "doc", "row_ids", "merge"], defaults=(False,))
+
+# Errors after which the Firestore client is rebuilt rather than reused
+CLIENT_RESET_ERRORS = (GoogleAuthError, ServiceUnavailable, Unauthenticated, PermissionDenied)
+
+class AdaptiveBatchSizer:
+    """
+    Picks the next batch size from measured commit latency: doubles while
+    commits are well under TARGET_COMMIT_SECS, halves when they exceed it.
+    """
+
+    def __init__(self, min_size=MIN_BATCH_SIZE, max_size=MAX_BATCH_SIZE, target_secs=TARGET_COMMIT_SECS):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_secs = target_secs
+        self.size = min_size
+        self.lock = threading.Lock()
+
+    def record(self, rows, latency_secs):
+        """Adjusts the batch size after a successful commit of `rows` documents."""
+        with self.lock:
+            if latency_secs > self.target_secs:
+                self.size = max(self.min_size, self.size // 2)
+            elif latency_secs < self.target_secs / 2 and rows >= self.size:
+                self.size = min(self.max_size, self.size * 2)
+
+    def failed(self):
+        """Falls back to the smallest batch after a failed commit."""
+        with self.lock:
+            self.size = self.min_size
+
+def document_id(row_id, utc_shifted_tstamp, device_id=DEVICE_ID):
+    """
+    Stable Firestore document ID for a SQLite row. Re-sending a row
+    overwrites its document instead of creating a duplicate.
+    """
+    return f"{device_id}-{document_key(row_id, utc_shifted_tstamp)}"
+
+def segment_id(start, part, device_id=DEVICE_ID):
+    """Stable document ID for part `part` of the segment window starting at `start`."""
+    return f"{device_id}-{start}-{part}"
+
+def trip_id(first_id, device_id=DEVICE_ID):
+    """Stable document ID for the trip whose first gps_data row is `first_id`."""
+    return f"{device_id}-{trip_key(first_id)}"
+
+def row_document(row):
+    """Firestore document for one gps_data row selected with UPLOAD_COLUMNS."""
+    return {
+        "tz_offset": row[1],
+        "utc_shifted_tstamp": row[2],
+        "latitude": row[3],
+        "longitude": row[4],
+        "altitude": row[5],
+        "rpm": row[6],
+        "engine_hours": row[7],
+        "coolant_temp": row[8],
+        "alternator_voltage": row[9]
+    }
+
+def live_interval_secs(fix):
+    """Spacing of live position writes for the engine state of `fix`."""
+    engine_on = fix.rpm is not None and fix.rpm > 0
+    return LIVE_ENGINE_ON_SECS if engine_on else LIVE_ENGINE_OFF_SECS
+
+def default_client():
+    """Builds a Firestore client; grpc and protobuf load here, not at import."""
+    from google.cloud import firestore
+    return firestore.Client()
 
 class FirestoreDatabaseWriter(threading.Thread):
     """Uploads GPS data from SQLite to Firestore."""
 
-    def __init__(self, db_name):
-        super().__init__()
+    def __init__(self, db_name, client_factory=None, upload_mode=UPLOAD_MODE, sync_rollups=SYNC_CANBUS_ROLLUPS,
+                 scheduler=None, notifier=upload_notifier, sync_trips=SYNC_TRIPS, sync_live=SYNC_LIVE_POSITION):
+        super().__init__(name="firestore-writer")
         self.db_name = db_name
+        self.upload_mode = upload_mode
+        self.sync_rollups = sync_rollups
+        self.sync_trips = sync_trips
+        self.sync_live = sync_live and notifier is not None
+        self.sqlite = get_connection_manager(db_name)
+        self.client_factory = client_factory or default_client
+        self.client = None
+        self.client_lock = threading.Lock()
+        self.batch_sizer = AdaptiveBatchSizer()
+        self.scheduler = scheduler or ConnectivityScheduler()
+        self.notifier = notifier
+        self.cursor_id = 0  # Keyset position: highest pending id already handed out
+        self.phase = "idle"  # "idle", or "catchup" while filling in a backlog
+        self.backlog_start = 0
+        self.next_archive = time.monotonic()
+        self.live_tstamp = None  # Timestamp of the fix in the live position document
+        self.live_sent = None  # Monotonic time it was written
         self.running = True
         self.stop_event = threading.Event()
 
     def run(self):
         """Main loop to upload data to Firestore."""
+        try:
+            with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="firestore-commit") as pool:
+                self.upload_loop(pool)
+        finally:
+            self.sqlite.close()
+
+    def upload_loop(self, pool):
+        """
+        Uploads pending rows in batches until stopped, without pausing while
+        a backlog remains. The network is only touched when there is
+        something to send, and only once the scheduler has seen it reachable.
+        """
         while self.running and not self.stop_event.is_set():
+            backlog = False
             try:
-                # Open SQLite connection for each cycle
-                conn = sqlite3.connect(self.db_name, check_same_thread=False)
-                c = conn.cursor()
-
-                # Fetch batch of unuploaded records
-                c.execute("SELECT * FROM gps_data WHERE uploaded = 0 LIMIT ?", (BATCH_SIZE,))
-                rows = c.fetchall()
-
-                if not rows:
-                    logging.info("No new data to upload. Sleeping...")
-                    conn.close()
-                    time.sleep(UPLOAD_INTERVAL)
+                if not self.has_pending_work():
+                    logging.log(LOOP_LOG_LEVEL, "No new data to upload. Sleeping...")
+                    self.archive_when_due()
+                    self.wait_for_rows()
                     continue
+                if not self.scheduler.wait_until_online(self.stop_event):
+                    break  # Stopped while offline
+                self.publish_online()
+                if self.live_position_due():
+                    self.upload_live_position()
+                # Deletes go first, so a document written again after its delete was queued survives
+                backlog = self.upload_deletes()
+                backlog = self.upload_cycle(pool) or backlog
+                if self.sync_rollups:
+                    backlog = self.upload_canbus_rollups() or backlog
+                if self.sync_trips:
+                    backlog = self.upload_trips() or backlog
+            except Exception as e:
+                logging.error(f"Firestore upload loop error: {e}")
+                self.sqlite.connection().rollback()
 
-                logging.info(f"Found {len(rows)} records to upload.")
-                
-                # Initialize Firestore client inside loop to handle dropped connections
-                db = firestore.Client()
+            if not backlog:
+                self.wait_for_rows()
 
-                success = self.upload_to_firestore(db, rows)
+    def wait_for_rows(self):
+        """Sleeps until rows are committed locally, or UPLOAD_INTERVAL passes."""
+        if self.notifier is None:
+            self.stop_event.wait(UPLOAD_INTERVAL)
+            return
+        self.publish_online()
+        timeout = UPLOAD_INTERVAL
+        if self.sync_live and self.live_sent is not None:
+            # Come back when the next live position write is allowed
+            until_live = self.live_sent + live_interval_secs(self.notifier.latest) - time.monotonic()
+            timeout = min(timeout, max(UPLOAD_DEBOUNCE_SECS, until_live))
+        if self.notifier.wait(timeout):
+            self.stop_event.wait(UPLOAD_DEBOUNCE_SECS)
 
-                if success:
-                    # Only update SQLite if Firestore commit was successful
-                    row_ids = [(row[0],) for row in rows]
-                    c.executemany("UPDATE gps_data SET uploaded = 1 WHERE id = ?", row_ids)
-                    conn.commit()
-                    logging.info(f"Marked {len(rows)} records as uploaded in SQLite.")
+    def publish_online(self):
+        """
+        Lets LocalDatabaseWriter commit new rows at once while they can be
+        sent at once. Before the first probe that is assumed; the first
+        commit wakes the uploader, whose probe settles it.
+        """
+        if self.notifier is not None:
+            self.notifier.set_online(self.running and self.scheduler.online is not False)
 
-                conn.close()
+    def archive_when_due(self):
+        """Moves old uploaded rows into gps_archive, at most once per ARCHIVE_INTERVAL_SECS."""
+        if not ARCHIVE_UPLOADED_ROWS or time.monotonic() < self.next_archive:
+            return
+        conn = self.sqlite.connection()
+        archived = archive_uploaded_rows(conn, now=mytime.now(), max_chunks=ARCHIVE_CHUNKS_PER_PASS)
+        # A full pass may have left more behind; come back on the next idle cycle
+        full = archived >= ARCHIVE_CHUNKS_PER_PASS * ARCHIVE_CHUNK_ROWS
+        self.next_archive = time.monotonic() + (0 if full else ARCHIVE_INTERVAL_SECS)
 
-            except Exception as e:
-                logging.error(f"Firestore upload loop error: {e}")
+    def has_pending_work(self):
+        """Cheap check, served by the partial pending indexes, for anything to upload."""
+        if self.live_position_due():
+            return True
+        conn = self.sqlite.connection()
+        if conn.execute(HAS_PENDING_ROWS_QUERY).fetchone()[0]:
+            return True
+        if conn.execute(HAS_PENDING_DELETES_QUERY).fetchone()[0]:
+            return True
+        if self.sync_rollups and conn.execute(HAS_PENDING_ROLLUPS_QUERY).fetchone()[0]:
+            return True
+        return self.sync_trips and bool(conn.execute(HAS_PENDING_TRIPS_QUERY).fetchone()[0])
+
+    def upload_cycle(self, pool):
+        """
+        Uploads up to UPLOAD_WORKERS batches concurrently.
+        Returns True if every batch succeeded and more rows are waiting.
+
+        A backlog of CATCHUP_MIN_BACKLOG rows or more starts catch-up mode:
+        the latest fix and a thinned overview of the backlog go out first,
+        so the dashboard is current right away, then full detail fills in
+        oldest-first.
+        """
+        # Thread's long-lived WAL connection
+        conn = self.sqlite.connection()
+        self.recover_journal(conn)
+
+        with metrics.SQLITE_READ_SECONDS.time():
+            pending = conn.execute(COUNT_PENDING_QUERY).fetchone()[0]
+        metrics.UPLOAD_BACKLOG.set(pending)
+        if not pending:
+            if self.phase != "idle":
+                logging.info("Upload backlog drained.")
+            self.phase = "idle"
+            self.save_progress(conn, pending)
+            return False
+
+        batch_size = self.batch_sizer.size
+        next_phase = self.phase
+        if self.phase == "idle" and pending >= CATCHUP_MIN_BACKLOG:
+            logging.info(f"Catching up on {pending} records: latest fix and overview first.")
+            self.backlog_start = pending
+            rows = self.overview_rows(conn, pending)
+            next_phase = "catchup"
+        else:
+            rows = self.next_page(conn, batch_size * UPLOAD_WORKERS)
 
-            time.sleep(UPLOAD_INTERVAL)
+        logging.log(LOOP_LOG_LEVEL, f"Found {len(rows)} records to upload.")
+        client = self.get_client()
 
-    def upload_to_firestore(self, db, rows):
+        if self.upload_mode == "segments":
+            writes = self.segment_writes(conn, rows)
+            per_batch = SEGMENTS_PER_BATCH
+        else:
+            writes = [UploadWrite("gps_data", document_id(row[0], row[2]), row_document(row), [row[0]])
+                      for row in rows]
+            per_batch = batch_size
+
+        # Journal the rows before they leave, so a crash mid-upload is resumable
+        with conn:
+            conn.executemany(JOURNAL_PENDING_QUERY, [(row[0],) for row in rows])
+
+        batches = [writes[i:i + per_batch] for i in range(0, len(writes), per_batch)]
+        futures = [pool.submit(self.upload_to_firestore, client, batch) for batch in batches]
+
+        all_succeeded = True
+        uploaded = 0
+        for batch, future in zip(batches, futures):
+            if future.result():
+                # Only update SQLite if Firestore commit was successful
+                row_ids = [(row_id,) for write in batch for row_id in write.row_ids]
+                with conn:
+                    conn.executemany(JOURNAL_COMMITTED_QUERY, row_ids)
+                with conn:
+                    conn.executemany(MARK_UPLOADED_QUERY, row_ids)
+                    conn.executemany(JOURNAL_DELETE_QUERY, row_ids)
+                uploaded += len(row_ids)
+                logging.log(LOOP_LOG_LEVEL, f"Marked {len(row_ids)} records as uploaded in SQLite.")
+            else:
+                all_succeeded = False
+
+        if all_succeeded:
+            self.phase = next_phase
+        metrics.UPLOAD_BACKLOG.set(pending - uploaded)
+        self.save_progress(conn, pending - uploaded)
+        return all_succeeded and pending > uploaded
+
+    def next_page(self, conn, limit):
+        """
+        Returns the next `limit` pending rows oldest-first, paging by id from
+        the keyset cursor. Once the cursor runs off the end it wraps, which
+        picks up rows whose batches failed earlier.
+        """
+        with metrics.SQLITE_READ_SECONDS.time():
+            rows = conn.execute(SELECT_PAGE_QUERY, (self.cursor_id, limit)).fetchall()
+        if not rows and self.cursor_id:
+            self.cursor_id = 0
+            with metrics.SQLITE_READ_SECONDS.time():
+                rows = conn.execute(SELECT_PAGE_QUERY, (self.cursor_id, limit)).fetchall()
+        if rows:
+            self.cursor_id = rows[-1][0]
+        return rows
+
+    def overview_rows(self, conn, pending):
+        """The newest pending row, then about CATCHUP_OVERVIEW_POINTS evenly spaced ones."""
+        rows = conn.execute(SELECT_LATEST_PENDING_QUERY).fetchall()
+        if self.upload_mode == "segments":
+            return rows  # Windows are already compact; send the newest one first
+        stride = max(1, pending // CATCHUP_OVERVIEW_POINTS)
+        overview = conn.execute(SELECT_OVERVIEW_QUERY, (stride, CATCHUP_OVERVIEW_POINTS)).fetchall()
+        return rows + [row for row in overview if row[0] != rows[0][0]]
+
+    def save_progress(self, conn, remaining):
+        """Records upload progress for tools/upload_stats.py."""
+        progress = {
+            "phase": self.phase,
+            "remaining": remaining,
+            "backlog_start": self.backlog_start if self.phase == "catchup" else remaining,
+            "cursor_id": self.cursor_id,
+            "updated": time.time(),
+        }
+        with conn:
+            conn.executemany(SAVE_PROGRESS_QUERY, progress.items())
+
+    def segment_writes(self, conn, rows):
+        """
+        Rewrites the segment document of every time window that has pending
+        rows. Each document holds all rows of its window, uploaded or not,
+        so one write replaces the window's previous version.
+        """
+        windows = {}
+        for row in rows:
+            windows.setdefault(window_start(row[2]), set()).add(row[0])
+
+        writes = []
+        for start, pending_ids in sorted(windows.items()):
+            with metrics.SQLITE_READ_SECONDS.time():
+                cursor = conn.execute(SELECT_WINDOW_QUERY, (start, start + SEGMENT_SECS))
+                window_rows = [dict(zip(SEGMENT_ROW_COLUMNS, values)) for values in cursor]
+            for part, part_rows in enumerate(split_segments(window_rows)):
+                part_ids = [row["id"] for row in part_rows if row["id"] in pending_ids]
+                if part_ids:  # Parts without pending rows are already up to date
+                    writes.append(UploadWrite(SEGMENT_COLLECTION, segment_id(start, part),
+                                              encode_segment(part_rows), part_ids))
+        return writes
+
+    def upload_canbus_rollups(self):
+        """
+        Merges pending per-minute CAN rollups into hourly documents.
+        Returns True if more pending rollups may be waiting.
+        """
+        conn = self.sqlite.connection()
+        rows = conn.execute(SELECT_PENDING_ROLLUPS_QUERY, (ROLLUPS_PER_CYCLE,)).fetchall()
+        if not rows:
+            return False
+
+        hours = {}
+        for row in rows:
+            hours.setdefault(row[1] // ROLLUP_DOC_SECS * ROLLUP_DOC_SECS, []).append(row)
+        writes = [
+            UploadWrite(ROLLUP_COLLECTION, f"{DEVICE_ID}-{hour}",
+                        {"start": hour, "minutes": rollup_document(hour_rows)}, [], merge=True)
+            for hour, hour_rows in sorted(hours.items())
+        ]
+
+        if not self.upload_to_firestore(self.get_client(), writes):
+            return False
+        with conn:
+            conn.executemany(MARK_ROLLUP_UPLOADED_QUERY, [(pgn, minute, count) for pgn, minute, count, *_ in rows])
+        logging.info(f"Uploaded {len(rows)} CAN bus rollups in {len(writes)} documents.")
+        return len(rows) == ROLLUPS_PER_CYCLE
+
+    def upload_trips(self):
+        """
+        Sends summary documents for trips opened, extended or closed since
+        their last upload. Returns True if more pending trips may be waiting.
+        """
+        conn = self.sqlite.connection()
+        rows = conn.execute(SELECT_PENDING_TRIPS_QUERY, (TRIPS_PER_CYCLE,)).fetchall()
+        if not rows:
+            return False
+
+        trips = [dict(zip(TRIP_FIELDS, row)) for row in rows]
+        writes = [UploadWrite(TRIP_COLLECTION, trip_id(trip["first_id"]), trip_document(row), [])
+                  for trip, row in zip(trips, rows)]
+        if not self.upload_to_firestore(self.get_client(), writes):
+            return False
+        with conn:
+            conn.executemany(MARK_TRIP_UPLOADED_QUERY, [(trip["id"], trip["last_id"], trip["closed"]) for trip in trips])
+        logging.log(LOOP_LOG_LEVEL, f"Uploaded {len(rows)} trip summaries.")
+        return len(rows) == TRIPS_PER_CYCLE
+
+    def live_position_due(self):
+        """True when the writer has a newer fix and its live interval has passed."""
+        if not self.sync_live:
+            return False
+        fix = self.notifier.latest
+        if fix is None or fix.utc_shifted_tstamp == self.live_tstamp:
+            return False
+        return self.live_sent is None or time.monotonic() - self.live_sent >= live_interval_secs(fix)
+
+    def upload_live_position(self):
+        """Overwrites this boat's live position document with the writer's newest fix."""
+        fix = self.notifier.latest
+        doc = {field: getattr(fix, field) for field in LIVE_FIELDS}
+        if self.upload_to_firestore(self.get_client(), [UploadWrite(LIVE_COLLECTION, DEVICE_ID, doc, [])]):
+            self.live_tstamp = fix.utc_shifted_tstamp
+            self.live_sent = time.monotonic()
+
+    def upload_deletes(self):
+        """
+        Deletes the Firestore documents queued in remote_deletes.
+        Returns True if more deletes may be waiting.
+        """
+        conn = self.sqlite.connection()
+        rows = conn.execute(SELECT_PENDING_DELETES_QUERY, (DELETES_PER_CYCLE,)).fetchall()
+        if not rows:
+            return False
+        writes = [UploadWrite(collection, f"{DEVICE_ID}-{doc_key}", None, []) for collection, doc_key in rows]
+        if not self.upload_to_firestore(self.get_client(), writes):
+            return False
+        with conn:
+            conn.executemany(UNQUEUE_REMOTE_DELETE_QUERY, rows)
+        logging.info(f"Deleted {len(rows)} stale Firestore documents.")
+        return len(rows) == DELETES_PER_CYCLE
+
+    def recover_journal(self, conn):
+        """
+        Finishes uploads interrupted between the Firestore commit and the
+        SQLite update. Rows journaled as committed are marked uploaded
+        without re-sending; uncommitted ones are still pending and go out
+        first on the next select, overwriting any partial writes.
+        """
+        with conn:
+            recovered = conn.execute(JOURNAL_RECOVER_QUERY).rowcount
+            conn.execute(JOURNAL_CLEAR_QUERY)
+        if recovered:
+            logging.info(f"Recovered {recovered} committed records from the upload journal.")
+
+    def get_client(self):
+        """Returns the shared Firestore client, building it on first use or after a reset."""
+        with self.client_lock:
+            if self.client is None:
+                self.client = self.client_factory()
+            return self.client
+
+    def reset_client(self, client):
+        """Drops a client that hit an auth or transport error so the next cycle rebuilds it."""
+        with self.client_lock:
+            if self.client is client:
+                self.client = None
+
+    def upload_to_firestore(self, db, writes):
         """Uploads data to Firestore with error handling."""
         for attempt in range(MAX_RETRIES):
             try:
                 batch = db.batch()  # Start Firestore batch operation
 
-                for row in rows:
-                    doc = {
-                        "tz_offset": row[1],
-                        "utc_shifted_tstamp": row[2],
-                        "latitude": row[3],
-                        "longitude": row[4],
-                        "altitude": row[5],
-                        "rpm": row[6],
-                        "engine_hours": row[7],
-                        "coolant_temp": row[8],
-                        "alternator_voltage": row[9]
-                    }
-                    doc_ref = db.collection("gps_data").document()
-                    batch.set(doc_ref, doc)  # Add to batch
+                for write in writes:
+                    doc_ref = db.collection(write.collection).document(write.doc_id)
+                    if write.doc is None:
+                        batch.delete(doc_ref)
+                    else:
+                        batch.set(doc_ref, write.doc, merge=write.merge)  # Add to batch
 
+                start = time.monotonic()
                 batch.commit()  # Execute batch upload
-                logging.info(f"Uploaded {len(rows)} records to Firestore.")
+                elapsed = time.monotonic() - start
+                self.batch_sizer.record(len(writes), elapsed)
+                self.scheduler.report_success()
+                metrics.FIRESTORE_COMMIT_SECONDS.observe(elapsed)
+                metrics.FIRESTORE_DOCUMENTS.inc(len(writes))
+                logging.log(LOOP_LOG_LEVEL, f"Uploaded {len(writes)} documents to Firestore.")
                 return True
 
+            except CLIENT_RESET_ERRORS as e:
+                metrics.FIRESTORE_FAILURES.inc()
+                logging.error(f"Firestore connection failed, rebuilding client: {e}")
+                self.reset_client(db)
+                break
+
             except GoogleAPICallError as e:
+                metrics.FIRESTORE_FAILURES.inc()
                 logging.error(f"Firestore upload failed (Attempt {attempt+1}/{MAX_RETRIES}): {e}")
-                time.sleep(2**attempt)  # Exponential backoff
+                if self.stop_event.wait(2**attempt):  # Exponential backoff, cut short by stop()
+                    break
 
-        logging.error("Max retries reached. Skipping batch.")
+        self.batch_sizer.failed()
+        self.scheduler.report_failure()  # The next cycle backs off, then waits for a successful probe
+        logging.error("Upload failed. Skipping batch.")
         return False
 
     def stop(self):
         """Signal thread to stop gracefully."""
         self.running = False
         self.stop_event.set()
+        if self.notifier is not None:
+            self.notifier.set_online(False)
+            self.notifier.wake()
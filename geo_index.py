@@ -0,0 +1,84 @@
+"""
+H3 cell indexing of gps_data rows.
+
+Each row stores the H3 cell holding its fix at H3_RESOLUTIONS, as 64-bit
+integers in the h3_r* columns, each indexed together with
+utc_shifted_tstamp. Area questions ("when were we near this marina",
+"where do we anchor") then become index lookups on a set of cells
+instead of a scan with geodesic math. Archive chunks are indexed by
+their ARCHIVE_CELL_RESOLUTION cells in gps_archive_cells.
+"""
+import math
+import h3.api.basic_int as h3
+
+H3_RESOLUTIONS = (7, 9, 11)  # ~1.2 km, ~170 m and ~25 m hexagon edges
+H3_COLUMNS = tuple(f"h3_r{resolution}" for resolution in H3_RESOLUTIONS)
+ARCHIVE_CELL_RESOLUTION = 7
+BACKFILL_CHUNK_ROWS = 5000
+MAX_QUERY_CELLS = 400  # Coarsest resolution is used when finer ones need more cells than this
+
+SELECT_BACKFILL_QUERY = "SELECT id, latitude, longitude FROM gps_data WHERE id > ? ORDER BY id LIMIT ?"
+UPDATE_CELLS_QUERY = f"UPDATE gps_data SET {', '.join(f'{column} = ?' for column in H3_COLUMNS)} WHERE id = ?"
+
+def h3_cells(latitude, longitude):
+    """The fix's cells at H3_RESOLUTIONS, coarse to fine; Nones without a position."""
+    if latitude is None or longitude is None:
+        return (None,) * len(H3_RESOLUTIONS)
+    finest = h3.latlng_to_cell(latitude, longitude, H3_RESOLUTIONS[-1])
+    return tuple(h3.cell_to_parent(finest, resolution) for resolution in H3_RESOLUTIONS[:-1]) + (finest,)
+
+def backfill_h3(conn):
+    """Schema migration: fills the h3_r* columns of rows stored before they existed."""
+    last_id = 0
+    while True:
+        rows = conn.execute(SELECT_BACKFILL_QUERY, (last_id, BACKFILL_CHUNK_ROWS)).fetchall()
+        conn.executemany(UPDATE_CELLS_QUERY, [(*h3_cells(lat, lon), row_id) for row_id, lat, lon in rows])
+        if len(rows) < BACKFILL_CHUNK_ROWS:
+            return
+        last_id = rows[-1][0]
+
+def radius_cells(latitude, longitude, meters):
+    """
+    (column, cells) covering a circle, at the finest resolution that needs
+    at most MAX_QUERY_CELLS cells. Every fix within `meters` lies in one of
+    the cells; callers filter the candidates by exact distance.
+    """
+    for resolution, column in reversed(list(zip(H3_RESOLUTIONS, H3_COLUMNS))):
+        # k rings reach at least 1.5 * k edges out; a fix is within one edge of its
+        # cell's center; edges vary by up to ~10% around the average
+        edge = h3.average_hexagon_edge_length(resolution, "m")
+        rings = math.ceil((meters + 2 * edge) / (1.5 * edge * 0.9))
+        if 3 * rings * (rings + 1) + 1 <= MAX_QUERY_CELLS or resolution == H3_RESOLUTIONS[0]:
+            return column, h3.grid_disk(h3.latlng_to_cell(latitude, longitude, resolution), rings)
+
+def polygon_cells(points):
+    """(column, cells) covering a polygon of (lat, lon) points, cells along the edges included."""
+    polygon = h3.LatLngPoly(points)
+    for resolution, column in reversed(list(zip(H3_RESOLUTIONS, H3_COLUMNS))):
+        inside = h3.polygon_to_cells(polygon, resolution)
+        # Cells straddling the boundary may have their center outside
+        edges = [h3.latlng_to_cell(lat, lon, resolution) for lat, lon in densify(points, resolution)]
+        cells = set(inside).union(edges)
+        if len(cells) <= MAX_QUERY_CELLS or resolution == H3_RESOLUTIONS[0]:
+            return column, set().union(*(h3.grid_disk(cell, 1) for cell in cells))
+
+def densify(points, resolution):
+    """Points along the polygon's edges, spaced at most one cell edge apart."""
+    step = h3.average_hexagon_edge_length(resolution, "m")
+    for (lat1, lon1), (lat2, lon2) in zip(points, points[1:] + points[:1]):
+        steps = max(1, math.ceil(h3.great_circle_distance((lat1, lon1), (lat2, lon2), "m") / step))
+        for i in range(steps):
+            yield lat1 + (lat2 - lat1) * i / steps, lon1 + (lon2 - lon1) * i / steps
+
+def contains(points, latitude, longitude):
+    """Ray-casting point-in-polygon test on (lat, lon) vertices."""
+    inside = False
+    for (lat1, lon1), (lat2, lon2) in zip(points, points[1:] + points[:1]):
+        if (lat1 > latitude) != (lat2 > latitude):
+            if longitude < lon1 + (latitude - lat1) * (lon2 - lon1) / (lat2 - lat1):
+                inside = not inside
+    return inside
+
+def archive_cells(cells):
+    """ARCHIVE_CELL_RESOLUTION parents of query cells, for the gps_archive_cells lookup."""
+    return {h3.cell_to_parent(cell, ARCHIVE_CELL_RESOLUTION) for cell in cells}
@@ -0,0 +1,212 @@
+"""
+Compacts uploaded gps_data rows into compressed archive chunks.
+
+Rows older than ARCHIVE_RETENTION_SECS that Firestore already has are moved
+into gps_archive, ARCHIVE_CHUNK_ROWS at a time. A chunk stores each column
+as fixed-point integers (microdegrees, milliseconds, ...) delta-encoded
+from the previous row, with timezone offsets replaced by ids from the
+tz_offsets table, packed as 64-bit ints and zlib-compressed. Freed pages
+go back to the file system with incremental vacuum.
+
+iter_archived_rows() reads chunks back as rows shaped like gps_data's, so
+readers such as tools/export_track.py see one continuous table. Each
+chunk's H3 cells go into gps_archive_cells, so area queries decode only
+the chunks that passed nearby.
+"""
+import json
+import time
+import zlib
+import logging
+from array import array
+from segment_codec import delta_encode, delta_decode, window_start
+from geo_index import h3_cells, H3_COLUMNS, H3_RESOLUTIONS, ARCHIVE_CELL_RESOLUTION
+
+ARCHIVE_RETENTION_SECS = 30 * 24 * 3600  # Uploaded rows stay in gps_data this long
+ARCHIVE_CHUNK_ROWS = 4096
+ARCHIVE_VERSION = 2
+ARCHIVE_NULL = -2**63  # Stands in for NULL in the packed integer arrays
+# (gps_data column, scale to integer), in chunk order; "tz_id" is the tz_offsets id
+ARCHIVE_COLUMNS = [
+    ("id", 1),
+    ("utc_shifted_tstamp", 1000),  # milliseconds
+    ("latitude", 1_000_000),  # microdegrees, ~11 cm
+    ("longitude", 1_000_000),
+    ("altitude", 10),  # decimeters
+    ("rpm", 1),
+    ("engine_hours", 3600),  # whole seconds, so trip engine-hour totals survive archiving
+    ("coolant_temp", 10),
+    ("alternator_voltage", 100),
+    ("tz_id", 1),
+]
+# Scales older chunk versions used where they differ from ARCHIVE_COLUMNS
+ARCHIVE_OLD_SCALES = {1: {"engine_hours": 100}}  # 0.01 h, 36 s
+SELECT_ARCHIVABLE_QUERY = (
+    "SELECT id, utc_shifted_tstamp, latitude, longitude, altitude, rpm, engine_hours, coolant_temp, "
+    "alternator_voltage, tz_offset FROM gps_data WHERE uploaded = 1 AND utc_shifted_tstamp < ? "
+    "ORDER BY utc_shifted_tstamp, id LIMIT ?"
+)
+OLDEST_PENDING_QUERY = "SELECT utc_shifted_tstamp FROM gps_data WHERE uploaded = 0 ORDER BY id LIMIT 1"
+INSERT_TZ_QUERY = "INSERT OR IGNORE INTO tz_offsets (tz_offset) VALUES (?)"
+SELECT_TZ_QUERY = "SELECT id, tz_offset FROM tz_offsets"
+INSERT_CHUNK_QUERY = """
+    INSERT INTO gps_archive (first_id, last_id, start_tstamp, end_tstamp, count, version, data)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+INSERT_CHUNK_CELL_QUERY = "INSERT OR IGNORE INTO gps_archive_cells (cell, chunk_id) VALUES (?, ?)"
+DELETE_ROW_QUERY = "DELETE FROM gps_data WHERE id = ?"
+SELECT_CHUNK_QUERY = """
+    SELECT id, start_tstamp, count, version, data FROM gps_archive
+    WHERE end_tstamp >= ? AND start_tstamp < ? AND (start_tstamp, id) > (?, ?)
+    ORDER BY start_tstamp, id LIMIT 1
+"""
+# As SELECT_CHUNK_QUERY, limited to chunks with a fix in one of a JSON array of cells
+SELECT_CHUNK_IN_CELLS_QUERY = """
+    SELECT id, start_tstamp, count, version, data FROM gps_archive
+    WHERE end_tstamp >= ? AND start_tstamp < ? AND (start_tstamp, id) > (?, ?)
+    AND id IN (SELECT chunk_id FROM gps_archive_cells WHERE cell IN (SELECT value FROM json_each(?)))
+    ORDER BY start_tstamp, id LIMIT 1
+"""
+SELECT_ALL_CHUNKS_QUERY = "SELECT id, count, version, data FROM gps_archive WHERE id > ? ORDER BY id LIMIT 1"
+
+class ArchivedRow(tuple):
+    """A row decoded from a chunk, indexable by position or column name like sqlite3.Row."""
+
+    def __new__(cls, names, values):
+        row = super().__new__(cls, values)
+        row.names = names
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self.names.index(key)
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(self.names)
+
+def encode_chunk(rows):
+    """Packs rows (dicts keyed by ARCHIVE_COLUMNS names) into a compressed blob."""
+    packed = array("q")
+    for column, scale in ARCHIVE_COLUMNS:
+        deltas = delta_encode([row[column] for row in rows], scale)
+        packed.extend(ARCHIVE_NULL if delta is None else delta for delta in deltas)
+    return zlib.compress(packed.tobytes(), 9)
+
+def decode_chunk(data, count, version=ARCHIVE_VERSION):
+    """Inverse of encode_chunk: returns {column: values} for `count` rows of a `version` chunk."""
+    if not 1 <= version <= ARCHIVE_VERSION:
+        raise ValueError(f"Unsupported archive chunk version: {version}")
+    old_scales = ARCHIVE_OLD_SCALES.get(version, {})
+    packed = array("q")
+    packed.frombytes(zlib.decompress(data))
+    columns = {}
+    for i, (column, scale) in enumerate(ARCHIVE_COLUMNS):
+        deltas = [None if value == ARCHIVE_NULL else value for value in packed[i * count:(i + 1) * count]]
+        columns[column] = delta_decode(deltas, old_scales.get(column, scale))
+    return columns
+
+def tz_ids(conn, offsets):
+    """Maps tz_offset strings to tz_offsets ids, adding new ones."""
+    conn.executemany(INSERT_TZ_QUERY, [(offset,) for offset in set(offsets)])
+    return {offset: tz_id for tz_id, offset in conn.execute(SELECT_TZ_QUERY)}
+
+def archive_uploaded_rows(conn, retention_secs=ARCHIVE_RETENTION_SECS, now=None, max_chunks=None):
+    """
+    Moves uploaded rows older than `retention_secs` into archive chunks, one
+    transaction per chunk, then reclaims the freed pages. Rows in the same
+    segment window as the oldest pending row stay, so a segment upload can
+    still rewrite its window. Returns the number of rows archived.
+    """
+    now = time.time() if now is None else now
+    cutoff = now - retention_secs
+    oldest_pending = conn.execute(OLDEST_PENDING_QUERY).fetchone()
+    if oldest_pending is not None:
+        cutoff = min(cutoff, window_start(oldest_pending[0]))
+
+    archived = 0
+    chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        rows = conn.execute(SELECT_ARCHIVABLE_QUERY, (cutoff, ARCHIVE_CHUNK_ROWS)).fetchall()
+        if not rows:
+            break
+        with conn:
+            ids = tz_ids(conn, [row[9] for row in rows])
+            names = [column for column, _ in ARCHIVE_COLUMNS[:-1]]
+            records = [{**dict(zip(names, row[:9])), "tz_id": ids[row[9]]} for row in rows]
+            chunk_id = conn.execute(INSERT_CHUNK_QUERY, (rows[0][0], rows[-1][0], rows[0][1], rows[-1][1], len(rows),
+                                                         ARCHIVE_VERSION, encode_chunk(records))).lastrowid
+            index_chunk(conn, chunk_id, [row[2] for row in rows], [row[3] for row in rows])
+            conn.executemany(DELETE_ROW_QUERY, [(row[0],) for row in rows])
+        archived += len(rows)
+        chunks += 1
+        if len(rows) < ARCHIVE_CHUNK_ROWS:
+            break
+
+    if archived:
+        reclaim_space(conn)
+        logging.info(f"Archived {archived} uploaded records in {chunks} chunks.")
+    return archived
+
+def index_chunk(conn, chunk_id, latitudes, longitudes):
+    """Records the ARCHIVE_CELL_RESOLUTION cells a chunk's fixes fall in."""
+    position = H3_RESOLUTIONS.index(ARCHIVE_CELL_RESOLUTION)
+    cells = {h3_cells(lat, lon)[position] for lat, lon in zip(latitudes, longitudes)}
+    cells.discard(None)
+    conn.executemany(INSERT_CHUNK_CELL_QUERY, [(cell, chunk_id) for cell in cells])
+
+def index_archive_chunks(conn):
+    """Schema migration: fills gps_archive_cells for chunks archived before it existed."""
+    chunk_id = 0
+    while True:
+        chunk = conn.execute(SELECT_ALL_CHUNKS_QUERY, (chunk_id,)).fetchone()
+        if chunk is None:
+            return
+        chunk_id, count, version, data = chunk
+        columns = decode_chunk(data, count, version)
+        index_chunk(conn, chunk_id, columns["latitude"], columns["longitude"])
+
+def reclaim_space(conn):
+    """Runs incremental vacuum; databases created before auto_vacuum need tools/archive_gps.py --vacuum once."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        # executescript() steps the pragma to completion; execute() would free a single page
+        conn.executescript("PRAGMA incremental_vacuum")
+
+def iter_archived_rows(conn, names, start=None, end=None, cells=None):
+    """
+    Yields archived rows in time order as ArchivedRow with the columns in
+    `names`, decoding one chunk at a time. With `cells`, a set of
+    ARCHIVE_CELL_RESOLUTION cells, only chunks that have a fix in one of
+    them are read. H3 columns are recomputed; other columns the archive
+    does not keep read as None. Values come back at the ARCHIVE_COLUMNS
+    scales; engine_hours in version 1 chunks only to 0.01 h (36 s).
+    """
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'gps_archive'").fetchone():
+        return
+    start = float("-inf") if start is None else start
+    end = float("inf") if end is None else end
+    offsets = dict(conn.execute(SELECT_TZ_QUERY))
+    position = (float("-inf"), 0)
+    if cells is None:
+        query, extra = SELECT_CHUNK_QUERY, ()
+    else:
+        query, extra = SELECT_CHUNK_IN_CELLS_QUERY, (json.dumps(sorted(cells)),)
+
+    while True:
+        chunk = conn.execute(query, (start, end, *position, *extra)).fetchone()
+        if chunk is None:
+            return
+        chunk_id, chunk_start, count, version, data = chunk
+        position = (chunk_start, chunk_id)
+        columns = decode_chunk(data, count, version)
+        columns["tz_offset"] = [offsets.get(tz_id) for tz_id in columns["tz_id"]]
+        columns["uploaded"] = [1] * count
+        if any(column in names for column in H3_COLUMNS):
+            for column, values in zip(H3_COLUMNS, zip(*map(h3_cells, columns["latitude"], columns["longitude"]))):
+                columns[column] = list(values)
+        tstamp_idx, id_idx = names.index("utc_shifted_tstamp"), names.index("id")
+        rows = sorted(zip(*(columns.get(name, [None] * count) for name in names)),
+                      key=lambda values: (values[tstamp_idx], values[id_idx]))
+        for values in rows:
+            row = ArchivedRow(names, values)
+            if start <= row["utc_shifted_tstamp"] < end:
+                yield row
@@ -0,0 +1,172 @@
+import threading
+import socket
+import selectors
+import json
+import time
+import logging
+from collections import deque
+from datetime import datetime
+
+GPSD_HOST = "127.0.0.1"
+GPSD_PORT = 2947
+WATCH_COMMAND = b'?WATCH={"enable":true,"json":true}\n'
+RECONNECT_SECS = 5
+RECV_BYTES = 4096
+MAX_LINE_BYTES = 64 * 1024  # Partial lines longer than this are discarded; gpsd reports are a few KiB
+FIX_QUEUE_SIZE = 16  # Oldest fixes are dropped once this many are waiting
+
+class GpsFix:
+    """One TPV report, shaped like gpsd-py3's response (lat/lon/alt/mode)."""
+
+    __slots__ = ("lat", "lon", "alt", "mode", "time", "speed", "track", "received")
+
+    def __init__(self, lat, lon, alt, mode, time=None, speed=None, track=None, received=None):
+        self.lat = lat
+        self.lon = lon
+        self.alt = alt
+        self.mode = mode
+        self.time = time
+        self.speed = speed
+        self.track = track
+        self.received = received
+
+def parse_gpsd_time(value):
+    """Converts gpsd's ISO-8601 'time' field to a UTC epoch, or None."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+def parse_tpv(report, received=None):
+    """Returns a GpsFix for a decoded TPV report, or None for any other class."""
+    if report.get("class") != "TPV":
+        return None
+    return GpsFix(
+        lat=report.get("lat"),
+        lon=report.get("lon"),
+        # Mean sea level, as gpsd's deprecated "alt" and older gpsd-py3 rows; altHAE differs by the geoid height
+        alt=report.get("altMSL", report.get("alt")),
+        mode=report.get("mode", 0),
+        time=parse_gpsd_time(report.get("time")),
+        speed=report.get("speed"),
+        track=report.get("track"),
+        received=received,
+    )
+
+class FixQueue:
+    """
+    Bounded hand-off between the socket reader and the decision logic.
+    When the consumer falls behind, the oldest fixes are dropped.
+    """
+
+    def __init__(self, maxsize=FIX_QUEUE_SIZE):
+        self.fixes = deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.dropped = 0
+
+    def put(self, fix):
+        with self.condition:
+            if len(self.fixes) == self.fixes.maxlen:
+                self.dropped += 1
+            self.fixes.append(fix)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """Returns the oldest waiting fix, or None on timeout."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.fixes, timeout):
+                return None
+            return self.fixes.popleft()
+
+    def get_latest(self, timeout=None):
+        """Returns the newest waiting fix and discards older ones, or None on timeout."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.fixes, timeout):
+                return None
+            fix = self.fixes.pop()
+            self.dropped += len(self.fixes)
+            self.fixes.clear()
+            return fix
+
+    def __len__(self):
+        with self.condition:
+            return len(self.fixes)
+
+class GpsdStreamReader(threading.Thread):
+    """Streams TPV reports from gpsd's JSON WATCH protocol into a FixQueue."""
+
+    def __init__(self, fixes, host=GPSD_HOST, port=GPSD_PORT):
+        super().__init__(name="gpsd-reader", daemon=True)
+        self.fixes = fixes
+        self.host = host
+        self.port = port
+        self.running = True
+        self.stop_event = threading.Event()
+        self.connected = threading.Event()
+        self.reports = 0
+        self.malformed = 0
+
+    def run(self):
+        """Connects to gpsd and reads until stopped, reconnecting after errors."""
+        while self.running and not self.stop_event.is_set():
+            try:
+                self.stream()
+            except OSError as e:
+                logging.error(f"GPSD stream error: {e}")
+            self.connected.clear()
+            self.stop_event.wait(RECONNECT_SECS)
+
+    def stream(self):
+        """Reads one gpsd connection until it closes or the reader is stopped."""
+        with socket.create_connection((self.host, self.port), timeout=RECONNECT_SECS) as sock, \
+                selectors.DefaultSelector() as selector:
+            sock.sendall(WATCH_COMMAND)
+            sock.setblocking(False)
+            selector.register(sock, selectors.EVENT_READ)
+            self.connected.set()
+            logging.info(f"Streaming from GPSD at {self.host}:{self.port}.")
+
+            buffer = bytearray()
+            while self.running and not self.stop_event.is_set():
+                if not selector.select(timeout=1.0):
+                    continue
+                data = sock.recv(RECV_BYTES)
+                if not data:
+                    logging.warning("GPSD closed the connection.")
+                    return
+                buffer += data
+                self.handle_lines(buffer)
+
+    def handle_lines(self, buffer):
+        """Parses every complete line in `buffer` and removes it, discarding an overlong partial line."""
+        end = buffer.rfind(b"\n")
+        if end >= 0:
+            self.parse_lines(bytes(buffer[:end]))
+            del buffer[:end + 1]
+
+        if len(buffer) > MAX_LINE_BYTES:
+            logging.warning(f"Discarding {len(buffer)} bytes without a newline from GPSD.")
+            self.malformed += 1
+            buffer.clear()
+
+    def parse_lines(self, data):
+        """Queues a fix for every TPV report in `data`, newline-separated JSON."""
+        received = time.time()
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                fix = parse_tpv(json.loads(line), received)
+            except (ValueError, AttributeError):
+                self.malformed += 1
+                continue
+            if fix is not None:
+                self.reports += 1
+                self.fixes.put(fix)
+
+    def stop(self):
+        """Signals the thread to stop gracefully."""
+        self.running = False
+        self.stop_event.set()
@@ -1,20 +1,48 @@
 import threading
 import time
-import sqlite3
-import gpsd
 import logging
 import traceback
-from shared_data import latest_canbus_data, canbus_lock, initialize_sqlite, calculate_distance
+from collections import namedtuple
+from shared_data import canbus_store, get_connection_manager, exceeds_distance, WriteBuffer, upload_notifier
+from gpsd_stream import GpsdStreamReader, FixQueue, GPSD_HOST, GPSD_PORT
+from track_simplifier import TrackSimplifier, SIMPLIFY_TOLERANCE_METERS
+from trips import update_trips
+from geo_index import h3_cells, H3_COLUMNS
 import mytime
+import metrics
+from metrics import LOOP_LOG_LEVEL
 
 logger = logging.getLogger(__name__)
 
-MIN_MILES_DELTA = 0.10  # miles
+MIN_MILES_DELTA = 0.10  # miles, when SIMPLIFY_TOLERANCE_METERS is None
 ENGINE_OFF_HEARTBEAT_SECS = 60 #3600
 ENGINE_ON_HEARTBEAT_SECS = 30 #60
+# Stored-point heartbeats with the simplifier; the live position document keeps the dashboard current
+SIMPLIFY_ENGINE_OFF_HEARTBEAT_SECS = 3600
+SIMPLIFY_ENGINE_ON_HEARTBEAT_SECS = 600
 CANBUS_TIMEOUT = 10  # Stale data timeout
-READ_LOOP_SLEEP_SECS = 5
+CANBUS_SMOOTHING_SECS = 10  # Window averaged for smoothed values
+CANBUS_NAMES = ["Engine RPM", "Engine Hours", "Coolant Temperature", "Alternator Voltage"]
+READ_LOOP_SLEEP_SECS = 5  # Warn when gpsd sends nothing for this long
+PROCESS_INTERVAL_SECS = 1.0  # Minimum spacing between processed fixes; 0 processes every TPV
+ENGINE_ON_CAPTURE = False  # Store every processed fix while the engine runs (1 Hz by default)
+WRITE_BUFFER_ROWS = 60  # Group-commit once this many rows are buffered
+MAX_UNFLUSHED_SECS = 10  # Most data a power cut can lose; 0 commits every row
+ONLINE_UNFLUSHED_SECS = 0  # While the uploader is online, so new rows reach Firestore within a second
+TRACK_TRIPS = True  # Fold each group commit into the trips table
 LAST_UPLOADED_QUERY = "SELECT latitude, longitude, altitude, utc_shifted_tstamp FROM gps_data ORDER BY utc_shifted_tstamp DESC LIMIT 1"
+INSERT_QUERY = f"""
+    INSERT INTO gps_data
+    (tz_offset, utc_shifted_tstamp, latitude, longitude, altitude, rpm,
+    engine_hours, coolant_temp, alternator_voltage, {', '.join(H3_COLUMNS)})
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?{', ?' * len(H3_COLUMNS)})
+"""
+
+# One gps_data row, in INSERT_QUERY column order; the H3 cells are filled in by write_records()
+GpsRecord = namedtuple("GpsRecord", [
+    "tz_offset", "utc_shifted_tstamp", "latitude", "longitude", "altitude",
+    "rpm", "engine_hours", "coolant_temp", "alternator_voltage", *H3_COLUMNS,
+], defaults=(None,) * len(H3_COLUMNS))
 
 class MyGPSData:
     def __init__(self, lat, lon, alt):
@@ -25,125 +53,216 @@ class MyGPSData:
 class LocalDatabaseWriter(threading.Thread):
     """Writes GPS and CAN data to the SQLite database."""
 
-    def __init__(self, db_name):
-        super().__init__()
+    def __init__(self, db_name, gpsd_host=GPSD_HOST, gpsd_port=GPSD_PORT, process_interval=PROCESS_INTERVAL_SECS,
+                 simplify_tolerance=SIMPLIFY_TOLERANCE_METERS, max_unflushed_secs=MAX_UNFLUSHED_SECS,
+                 notifier=upload_notifier, online_unflushed_secs=ONLINE_UNFLUSHED_SECS):
+        super().__init__(name="local-db-writer")
         self.db_name = db_name
+        self.sqlite = get_connection_manager(db_name)
+        self.process_interval = process_interval
+        self.simplify_tolerance = simplify_tolerance
+        self.simplifier = None  # Built once the last stored fix is known
+        self.notifier = notifier
+        # Each group commit wakes the uploader, then updates trips in a transaction of its own
+        self.write_buffer = WriteBuffer(self.sqlite, INSERT_QUERY, WRITE_BUFFER_ROWS, max_unflushed_secs, notifier,
+                                        after_commit=update_trips if TRACK_TRIPS else None,
+                                        online_age_secs=online_unflushed_secs)
+        self.last_report = time.monotonic()
+        self.fixes = FixQueue()
+        self.gps_reader = GpsdStreamReader(self.fixes, gpsd_host, gpsd_port)
         self.running = True
         self.stop_event = threading.Event()
+        self.last_fix = None  # (lat, lon, alt, utc_shifted_tstamp) of the last row written
+        self.last_fix_loaded = False
+        self.first_fix = threading.Event()  # Set once the first fix has been processed
 
     def run(self):
         """Main loop that collects GPS and CAN data and writes it to SQLite."""
-        if not self.establish_gps_connection():
-            logging.critical("GPSD is unavailable. Exiting thread.")
-            return
+        self.gps_reader.start()
+        try:
+            self.load_last_fix()
+            if TRACK_TRIPS:
+                self.catch_up_trips()
+            self.read_loop()
+        finally:
+            self.gps_reader.stop()
+            if self.simplifier is not None:
+                self.write_records(self.simplifier.flush())
+            self.write_buffer.flush()
+            self.sqlite.close()
+
+    def catch_up_trips(self):
+        """Folds rows stored since trips were last updated, so the first group commit does not."""
+        conn = self.sqlite.connection()
+        try:
+            with conn:
+                update_trips(conn)
+        except Exception as e:
+            logging.error(f"Failed to update trips; retrying after the next commit: {e}")
 
+    def read_loop(self):
+        """Processes TPV reports from the gpsd stream as they arrive, until stopped."""
         while self.running and not self.stop_event.is_set():
             try:
-                gps_data = gpsd.get_current()
-                
-                if not gps_data or gps_data.mode < 2:
+                # Wake in time to flush buffered rows within MAX_UNFLUSHED_SECS
+                timeout = READ_LOOP_SLEEP_SECS
+                until_due = self.write_buffer.seconds_until_due()
+                if until_due is not None:
+                    timeout = min(timeout, until_due)
+
+                # When rate limited, fixes that arrived meanwhile collapse to the newest
+                if self.process_interval > 0:
+                    gps_data = self.fixes.get_latest(timeout=timeout)
+                else:
+                    gps_data = self.fixes.get(timeout=timeout)
+
+                if self.write_buffer.due():
+                    self.write_buffer.flush()
+
+                if gps_data is None:
+                    if time.monotonic() - self.last_report >= READ_LOOP_SLEEP_SECS:
+                        logging.warning("No GPS reports received.")
+                        self.last_report = time.monotonic()
+                    continue
+                self.last_report = time.monotonic()
+
+                if gps_data.mode < 2 or gps_data.lat is None or gps_data.lon is None:
                     logging.warning("No GPS fix. Skipping update.")
-                    self.stop_event.wait(READ_LOOP_SLEEP_SECS)
                     continue
 
+                started = time.monotonic()
                 self.process(gps_data)
-                self.stop_event.wait(READ_LOOP_SLEEP_SECS)  # Allows immediate shutdown
+                self.first_fix.set()
+                if self.process_interval > 0:
+                    # Allows immediate shutdown
+                    self.stop_event.wait(max(0.0, self.process_interval - (time.monotonic() - started)))
 
             except Exception as e:
                 logging.error(f"Error in main loop: {e}")
                 traceback.print_exc()
                 self.stop_event.wait(READ_LOOP_SLEEP_SECS)
 
-    def establish_gps_connection(self):
-        """Attempts to establish a connection to GPSD once at startup."""
-        try:
-            gpsd.connect()
-            logging.info("Connected to GPSD.")
-            return True
-        except Exception as e:
-            logging.error(f"Failed to connect to GPSD: {e}")
-            return False
-
     def process(self, gps_data):
         """Processes and writes GPS & CAN bus data to SQLite."""
+        metrics.FIXES_PROCESSED.inc()
         tz_offset = mytime.get_tz_offset_2(gps_data)
         if tz_offset == "Unknown":
             logging.warning("Skipping record due to unknown time zone.")
             return
 
-        rpm = self.get_latest_canbus("Engine RPM")
+        canbus = self.read_canbus()
         utc_shifted_tstamp = mytime.get_shifted_timestamp(mytime.get_timezone(tz_offset))
+        record = GpsRecord(
+            tz_offset, utc_shifted_tstamp, gps_data.lat, gps_data.lon, gps_data.alt,
+            canbus["Engine RPM"], canbus["Engine Hours"],
+            canbus["Coolant Temperature"], canbus["Alternator Voltage"],
+        )
+        if self.notifier is not None:
+            self.notifier.publish(record)
+
+        engine_on = record.rpm is not None and record.rpm > 0
+        if ENGINE_ON_CAPTURE and engine_on:
+            records = [record]
+            if self.simplify_tolerance is not None:
+                self.get_simplifier().store(record)
+        elif self.simplify_tolerance is None:
+            updateable = self.get_updateable(gps_data, utc_shifted_tstamp, record.rpm)
+            if updateable is None:
+                return
+            records = [record._replace(latitude=updateable.lat, longitude=updateable.lon, altitude=updateable.alt)]
+        else:
+            records = self.get_simplifier().add(record, self.simplify_heartbeat_secs(record.rpm))
 
-        gps_data = self.get_updateable(gps_data, utc_shifted_tstamp, rpm)
-        if gps_data is None:
+        self.write_records(records)
+
+    def write_records(self, records):
+        """
+        Queues records for the next group commit, with the H3 cells of their
+        final positions, and remembers the newest as the last fix.
+        """
+        if not records:
             return
 
-        engine_hours = self.get_latest_canbus("Engine Hours")
-        coolant_temp = self.get_latest_canbus("Coolant Temperature")
-        alternator_voltage = self.get_latest_canbus("Alternator Voltage")
+        records = [record._replace(**dict(zip(H3_COLUMNS, h3_cells(record.latitude, record.longitude))))
+                   for record in records]
+        self.write_buffer.extend(records)
 
-        latitude, longitude, altitude = gps_data.lat, gps_data.lon, gps_data.alt
+        last = records[-1]
+        self.last_fix = (last.latitude, last.longitude, last.altitude, last.utc_shifted_tstamp)
+        for record in records:
+            logging.log(LOOP_LOG_LEVEL, f"Local DB Write: lat:{record.latitude}, lon:{record.longitude}, alt:{record.altitude}, "
+                         f"rpm:{record.rpm}, engine_hours:{record.engine_hours}, coolant_temp:{record.coolant_temp}, "
+                         f"alternator_voltage:{record.alternator_voltage}")
 
-        # Open SQLite connection per transaction
-        conn = sqlite3.connect(self.db_name, check_same_thread=False)
-        try:
-            c = conn.cursor()
-            c.execute(
-                """
-                INSERT INTO gps_data
-                (tz_offset, utc_shifted_tstamp, latitude, longitude, altitude, rpm,
-                engine_hours, coolant_temp, alternator_voltage)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (tz_offset, utc_shifted_tstamp, latitude, longitude, altitude, rpm,
-                 engine_hours, coolant_temp, alternator_voltage),
-            )
-            conn.commit()
-            logging.info(f"Local DB Write: lat:{latitude}, lon:{longitude}, alt:{altitude}, "
-                         f"rpm:{rpm}, engine_hours:{engine_hours}, coolant_temp:{coolant_temp}, "
-                         f"alternator_voltage:{alternator_voltage}")
-        finally:
-            conn.close()  # Ensure DB connection is closed properly
+    def get_simplifier(self):
+        """Returns the track simplifier, anchored at the last stored fix."""
+        if self.simplifier is None:
+            if not self.last_fix_loaded:
+                self.load_last_fix()
+            anchor = None
+            if self.last_fix is not None:
+                lat, lon, alt, tstamp = self.last_fix
+                anchor = GpsRecord(None, tstamp, lat, lon, alt, None, None, None, None)
+            self.simplifier = TrackSimplifier(self.simplify_tolerance, anchor=anchor)
+        return self.simplifier
+
+    def heartbeat_secs(self, rpm):
+        """Longest gap between stored points for the current engine state."""
+        engine_on = rpm is not None and rpm > 0
+        return ENGINE_ON_HEARTBEAT_SECS if engine_on else ENGINE_OFF_HEARTBEAT_SECS
+
+    def simplify_heartbeat_secs(self, rpm):
+        """Longest gap between points the simplifier stores; freshness comes from the live position."""
+        engine_on = rpm is not None and rpm > 0
+        return SIMPLIFY_ENGINE_ON_HEARTBEAT_SECS if engine_on else SIMPLIFY_ENGINE_OFF_HEARTBEAT_SECS
 
     def get_updateable(self, gps_data, utc_shifted_tstamp, rpm):
         """Determines if new GPS data should be stored based on distance and time threshold."""
-        engine_on = rpm is not None and rpm > 0
-        heartbeat_secs = ENGINE_ON_HEARTBEAT_SECS if engine_on else ENGINE_OFF_HEARTBEAT_SECS
+        heartbeat_secs = self.heartbeat_secs(rpm)
 
-        conn = sqlite3.connect(self.db_name, check_same_thread=False)
-        try:
-            c = conn.cursor()
-            c.execute(LAST_UPLOADED_QUERY)
-            last_record = c.fetchone()
+        if not self.last_fix_loaded:
+            self.load_last_fix()
+        last_record = self.last_fix
 
-            if last_record is None:
-                logging.info('UPDATE: Because no last record.')
-                return gps_data
+        if last_record is None:
+            logging.log(LOOP_LOG_LEVEL, 'UPDATE: Because no last record.')
+            return gps_data
 
-            last_lat, last_lon, last_alt, last_utc_shifted_tstamp = last_record
-            distance = calculate_distance(gps_data.lat, gps_data.lon, last_lat, last_lon)
-            time_diff_secs = utc_shifted_tstamp - last_utc_shifted_tstamp
+        last_lat, last_lon, last_alt, last_utc_shifted_tstamp = last_record
+        moved, distance = exceeds_distance(gps_data.lat, gps_data.lon, last_lat, last_lon, MIN_MILES_DELTA)
+        time_diff_secs = utc_shifted_tstamp - last_utc_shifted_tstamp
 
-            if distance > MIN_MILES_DELTA:
-                logging.info(f'UPDATE: Distance threshold exceeded ({distance} miles).')
-                return gps_data
+        if moved:
+            logging.log(LOOP_LOG_LEVEL, f'UPDATE: Distance threshold exceeded ({distance} miles).')
+            return gps_data
 
-            if time_diff_secs > heartbeat_secs:
-                logging.info(f'UPDATE: Heartbeat threshold exceeded ({time_diff_secs} sec).')
-                return MyGPSData(last_lat, last_lon, last_alt)
+        if time_diff_secs > heartbeat_secs:
+            logging.log(LOOP_LOG_LEVEL, f'UPDATE: Heartbeat threshold exceeded ({time_diff_secs} sec).')
+            return MyGPSData(last_lat, last_lon, last_alt)
 
-            logging.info(f'no_update: time_diff:{time_diff_secs} distance_delta_miles:{distance}')
-            return None  # No update needed
-        finally:
-            conn.close()
-
-    def get_latest_canbus(self, name):
-        """Returns the most recent CAN bus value or None if stale."""
-        with canbus_lock:
-            data = latest_canbus_data.get(name)
-            if data and (time.time() - data["timestamp"] <= CANBUS_TIMEOUT):
-                return float(data["value"])
-            return None  # Mark as unknown
+        logging.log(LOOP_LOG_LEVEL, f'no_update: time_diff:{time_diff_secs} distance_delta_miles:{distance}')
+        return None  # No update needed
+
+    def load_last_fix(self):
+        """Loads the most recent row from SQLite; afterwards it is tracked in memory."""
+        conn = self.sqlite.connection()
+        self.last_fix = conn.execute(LAST_UPLOADED_QUERY).fetchone()
+        self.last_fix_loaded = True
+
+    def read_canbus(self):
+        """
+        Returns the CAN values for one record from a single snapshot. RPM and
+        voltage are averaged over CANBUS_SMOOTHING_SECS; stale values are None.
+        """
+        snapshot = canbus_store.snapshot(CANBUS_NAMES, CANBUS_TIMEOUT, CANBUS_SMOOTHING_SECS, now=mytime.now())
+        smoothed = {"Engine RPM", "Alternator Voltage"}
+        values = {}
+        for name, reading in snapshot.items():
+            if reading is None:
+                values[name] = None  # Mark as unknown
+            else:
+                values[name] = reading.mean if name in smoothed else reading.latest
+        return values
 
     def stop(self):
         """Signals the thread to stop gracefully."""
@@ -0,0 +1,207 @@
+"""
+Lightweight process metrics: counters, gauges and latency histograms.
+
+Metrics are module-level objects updated from any thread. They are exposed
+in the Prometheus text format by MetricsServer and as JSON by
+write_stats_file(), which tools/upload_stats.py displays.
+"""
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108  # 0 disables the HTTP endpoint
+# On tmpfs (RuntimeDirectory= in boat-tracker.service), as rewriting it every 5 s would wear the SD card; "" disables it
+STATS_FILE = os.environ.get("BOAT_TRACKER_STATS_FILE", "/run/boat-tracker/boat_tracker_stats.json")
+# Upper bounds in seconds, from 10 microseconds to 10 seconds
+LATENCY_BUCKETS = (1e-5, 3e-5, 1e-4, 3e-4, 1e-3, 3e-3, 0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0)
+# Per-fix and per-cycle log lines go out at this level; BOAT_TRACKER_LOOP_LOGS=info restores them
+LOOP_LOG_LEVEL = logging.INFO if os.environ.get("BOAT_TRACKER_LOOP_LOGS", "").lower() == "info" else logging.DEBUG
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self.lock = threading.Lock()
+        _register(self)
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [(f"{self.name}_total", self.value)]
+
+    def snapshot(self):
+        return self.value
+
+class Gauge:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        _register(self)
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        return [(self.name, self.value)]
+
+    def snapshot(self):
+        return self.value
+
+class Histogram:
+    """Latency histogram with fixed buckets; observe() costs a bisect and a lock."""
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+        _register(self)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding quantile `q`, or None when empty."""
+        with self.lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        with self.lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            samples.append((f'{self.name}_bucket{{le="{le}"}}', cumulative))
+        samples.append((f"{self.name}_sum", total))
+        samples.append((f"{self.name}_count", count))
+        return samples
+
+    def snapshot(self):
+        with self.lock:
+            count, total = self.count, self.sum
+        return {
+            "count": count,
+            "mean": total / count if count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+TZ_LOOKUP_SECONDS = Histogram("boat_tz_lookup_seconds", "Time zone offset lookups")
+DISTANCE_SECONDS = Histogram("boat_distance_seconds", "Distance threshold checks")
+SQLITE_READ_SECONDS = Histogram("boat_sqlite_read_seconds", "SQLite queries reading rows to upload")
+SQLITE_WRITE_SECONDS = Histogram("boat_sqlite_write_seconds", "SQLite group commits")
+SQLITE_ROWS_WRITTEN = Counter("boat_sqlite_rows_written", "Rows written by group commits")
+CANBUS_LOCK_WAIT_SECONDS = Histogram("boat_canbus_lock_wait_seconds", "Waits for the CAN bus store lock")
+FIRESTORE_COMMIT_SECONDS = Histogram("boat_firestore_commit_seconds", "Firestore batch commits")
+FIRESTORE_DOCUMENTS = Counter("boat_firestore_documents", "Documents committed to Firestore")
+FIRESTORE_FAILURES = Counter("boat_firestore_failures", "Failed Firestore commits")
+UPLOAD_BACKLOG = Gauge("boat_upload_backlog", "gps_data rows waiting to upload")
+FIXES_PROCESSED = Counter("boat_fixes_processed", "GPS fixes processed")
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        kind = type(metric).__name__.lower()
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {kind}")
+        lines.extend(f"{name} {value}" for name, value in metric.samples())
+    return "\n".join(lines) + "\n"
+
+def snapshot():
+    """All metrics as a JSON-serializable dict."""
+    with _registry_lock:
+        metrics = list(_registry)
+    return {metric.name: metric.snapshot() for metric in metrics}
+
+def write_stats_file(path=STATS_FILE):
+    """Atomically replaces `path` with the current snapshot."""
+    stats = {"updated": time.time(), "metrics": snapshot()}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(stats, f)
+    os.replace(tmp_path, path)
+
+def _handler_class():
+    # http.server is imported here so importing metrics stays cheap
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would otherwise log a line each
+
+    return MetricsHandler
+
+class MetricsServer(threading.Thread):
+    """Serves /metrics on a local port for Prometheus or curl."""
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT):
+        from http.server import ThreadingHTTPServer
+        super().__init__(name="metrics-server", daemon=True)
+        self.server = ThreadingHTTPServer((host, port), _handler_class())
+        self.host, self.port = self.server.server_address[:2]
+
+    def run(self):
+        logging.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
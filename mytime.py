@@ -1,15 +1,43 @@
 import time
-import pytz
 import re
 import os
+import bisect
 import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
-from timezonefinder import TimezoneFinder
+import h3
+import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-tf = TimezoneFinder()
+TZ_FINDER_IN_MEMORY = False  # Read polygon data from the package files on demand instead of loading it into RAM
+TZ_CACHE_H3_RESOLUTION = 6  # ~3.7 km hexagon edge
+TZ_CACHE_MAX_CELLS = 256
+
+_finder = None
+_finder_lock = threading.Lock()
+
+def get_finder():
+    """Builds the shared TimezoneFinder on first use; importing it costs seconds on a Pi Zero."""
+    global _finder
+    with _finder_lock:
+        if _finder is None:
+            from timezonefinder import TimezoneFinder
+            _finder = TimezoneFinder(in_memory=TZ_FINDER_IN_MEMORY)
+        return _finder
+
+clock = time.time  # Source of "now" for records; replaced by set_clock() when replaying
+
+def now() -> float:
+    """Current UTC epoch seconds from the active clock."""
+    return clock()
+
+def set_clock(new_clock=None):
+    """Replaces the clock with a callable returning epoch seconds; None restores time.time."""
+    global clock
+    clock = new_clock or time.time
 
 def get_timezone(tz_offset: str) -> timezone:
     # Regex to parse timezone offset
@@ -40,8 +68,7 @@ def unshift_timestamp(shifted_timestamp: float, origin_tz: timezone) -> float:
     return shifted_timestamp - delta_secs
 
 def get_shifted_timestamp(origin_tz: timezone) -> float:
-    timestamp = datetime.now(tz=timezone.utc).timestamp()
-    return shift_timestamp(timestamp, origin_tz)
+    return shift_timestamp(now(), origin_tz)
 
 def get_tz_offset_1(tz: timezone) -> str:
     return tz.tzname(None)
@@ -51,7 +78,145 @@ def get_tz_offset_2(gps_data) -> str:
     longitude = gps_data.lon
     return get_tz_offset(latitude, longitude)
 
+def format_utc_offset(offset_seconds: float) -> str:
+    """Formats an offset in seconds as 'UTC±HH:MM'."""
+    hours, remainder = divmod(abs(offset_seconds), 3600)
+    minutes = remainder // 60
+    sign = '+' if offset_seconds >= 0 else '-'
+    return f"UTC{sign}{int(hours):02d}:{int(minutes):02d}"
+
+def next_transition(tz, now: float) -> float:
+    """
+    Returns the UTC epoch of the zone's next offset change after `now`,
+    or infinity for zones without transitions (e.g. 'Etc/GMT+5', 'UTC').
+    """
+    transitions = getattr(tz, "_utc_transition_times", None)
+    if not transitions:
+        return float("inf")
+    now_dt = datetime.fromtimestamp(now, tz=timezone.utc).replace(tzinfo=None)
+    idx = bisect.bisect_right(transitions, now_dt)
+    if idx >= len(transitions):
+        return float("inf")
+    return transitions[idx].replace(tzinfo=timezone.utc).timestamp()
+
+def zone_offset(time_zone_name: str, now: float):
+    """Returns (offset string, expiry epoch) for a zone name at time `now`."""
+    import pytz
+    tz = pytz.timezone(time_zone_name)
+    local_time = datetime.fromtimestamp(now, tz)
+    offset_seconds = local_time.utcoffset().total_seconds()
+    return format_utc_offset(offset_seconds), next_transition(tz, now)
+
+class TimezoneCache:
+    """
+    LRU cache of UTC offsets keyed by H3 cell.
+
+    A cell is only trusted when its center and all of its vertices resolve
+    to the same zone. Cells straddling a zone boundary are still cached, but
+    every lookup in them re-runs the polygon search for the exact point.
+    Entries expire at the zone's next DST transition.
+    """
+
+    def __init__(self, resolution=TZ_CACHE_H3_RESOLUTION, max_cells=TZ_CACHE_MAX_CELLS, finder=None):
+        self.resolution = resolution
+        self.max_cells = max_cells
+        self._finder = finder
+        self.cells = OrderedDict()  # cell -> [zone name, offset, expires_at, boundary]
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.boundary_rechecks = 0
+        self.expirations = 0
+
+    @property
+    def finder(self):
+        return self._finder or get_finder()
+
+    def lookup(self, latitude: float, longitude: float, now: float = None) -> str:
+        """Returns the 'UTC±HH:MM' offset for a location, or 'Unknown'."""
+        now = clock() if now is None else now
+        cell = h3.latlng_to_cell(latitude, longitude, self.resolution)
+
+        with self.lock:
+            entry = self.cells.get(cell)
+            if entry is not None:
+                self.cells.move_to_end(cell)
+
+        if entry is None:
+            with self.lock:
+                self.misses += 1
+            return self._fill(cell, latitude, longitude, now)
+
+        zone_name, offset, expires_at, boundary = entry
+        if boundary:
+            with self.lock:
+                self.boundary_rechecks += 1
+            zone_name = self.finder.timezone_at(lat=latitude, lng=longitude)
+            if not zone_name:
+                return "Unknown"
+            if zone_name != entry[0]:
+                return zone_offset(zone_name, now)[0]
+
+        if now >= expires_at:
+            with self.lock:
+                self.expirations += 1
+            offset, expires_at = zone_offset(zone_name, now)
+            with self.lock:
+                entry[1], entry[2] = offset, expires_at
+            return offset
+
+        with self.lock:
+            self.hits += 1
+        return offset
+
+    def _fill(self, cell, latitude, longitude, now):
+        zone_name = self.finder.timezone_at(lat=latitude, lng=longitude)
+        if not zone_name:
+            return "Unknown"
+
+        probes = [h3.cell_to_latlng(cell)] + list(h3.cell_to_boundary(cell))
+        boundary = any(self.finder.timezone_at(lat=lat, lng=lng) != zone_name for lat, lng in probes)
+
+        offset, expires_at = zone_offset(zone_name, now)
+        with self.lock:
+            self.cells[cell] = [zone_name, offset, expires_at, boundary]
+            self.cells.move_to_end(cell)
+            while len(self.cells) > self.max_cells:
+                self.cells.popitem(last=False)
+        return offset
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "boundary_rechecks": self.boundary_rechecks,
+                "expirations": self.expirations,
+                "cells": len(self.cells),
+            }
+
+    def clear(self):
+        with self.lock:
+            self.cells.clear()
+
+tz_cache = TimezoneCache()
+
 def get_tz_offset(latitude: float, longitude: float) -> str:
+    """
+    Determine the UTC offset (in 'UTC±HH:MM' format) based on latitude and longitude,
+    answered from the H3 cell cache where possible.
+
+    Returns:
+        UTC offset string in the format 'UTC±HH:MM' or 'Unknown' if it cannot be determined.
+    """
+    try:
+        with metrics.TZ_LOOKUP_SECONDS.time():
+            return tz_cache.lookup(latitude, longitude)
+    except Exception as e:
+        logging.error(f"Failed to determine UTC offset: {e}")
+        return "Unknown"
+
+def get_tz_offset_uncached(latitude: float, longitude: float) -> str:
     """
     Determine the UTC offset (in 'UTC±HH:MM' format) based on latitude and longitude.
 
@@ -64,22 +229,19 @@ def get_tz_offset(latitude: float, longitude: float) -> str:
     """
     try:
         # Determine the timezone
-        time_zone_name = tf.timezone_at(lat=latitude, lng=longitude)
+        time_zone_name = get_finder().timezone_at(lat=latitude, lng=longitude)
         
         if not time_zone_name:
             return "Unknown"
 
         # Get the current time in the identified timezone
+        import pytz
         timezone = pytz.timezone(time_zone_name)
-        local_time = datetime.now(timezone)
+        local_time = datetime.fromtimestamp(now(), timezone)
 
         # Calculate UTC offset
         offset_seconds = local_time.utcoffset().total_seconds()
-        hours, remainder = divmod(abs(offset_seconds), 3600)
-        minutes = remainder // 60
-        sign = '+' if offset_seconds >= 0 else '-'
-
-        return f"UTC{sign}{int(hours):02d}:{int(minutes):02d}"
+        return format_utc_offset(offset_seconds)
     except Exception as e:
         logging.error(f"Failed to determine UTC offset: {e}")
         return "Unknown"
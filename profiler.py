@@ -0,0 +1,247 @@
+"""
+Built-in sampling profiler and thread stack dumps.
+
+While a profile runs, a SamplingProfiler thread reads every other thread's
+current frame from sys._current_frames() each PROFILE_INTERVAL_SECS, so
+the profiled code runs unmodified (no sys.setprofile hooks). Stopping it
+writes two files to PROFILE_DIR:
+
+    profile-<time>.folded  collapsed stacks, "thread;outer;...;inner count",
+                           for flamegraph.pl, speedscope or inferno
+    profile-<time>.txt     the PROFILE_TOP_N hottest functions by self and
+                           total samples, and samples per thread
+
+Samples are wall-clock: a thread blocked in wait() or select() is counted
+there, which shows where the writers spend their time, not just their CPU.
+
+Profiles are toggled by SIGUSR1 or a "profile" command on the local
+control socket; SIGUSR2 or "stacks" logs every thread's stack, e.g. to see
+where a stuck writer is waiting.
+
+    kill -USR1 <pid>; sleep 60; kill -USR1 <pid>
+    tools/profile_ctl.py stacks
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import threading
+import traceback
+from collections import Counter
+
+PROFILE_INTERVAL_SECS = 0.01  # ~100 samples a second per thread
+PROFILE_MAX_SECS = 15 * 60  # A forgotten profile stops itself after this long
+PROFILE_TOP_N = 30
+PROFILE_DIR = "profiles"
+MAX_STACK_DEPTH = 64  # Deeper stacks are cut at the outermost frames
+CONTROL_SOCKET = "boat_tracker.sock"  # Unix socket next to the database; "" disables it
+
+def thread_names():
+    """{thread ident: name} for live threads."""
+    return {thread.ident: thread.name for thread in threading.enumerate()}
+
+class SamplingProfiler(threading.Thread):
+    """Samples all other threads' stacks until stopped, then writes its reports."""
+
+    def __init__(self, interval=PROFILE_INTERVAL_SECS, max_secs=PROFILE_MAX_SECS, out_dir=PROFILE_DIR):
+        super().__init__(name="profiler", daemon=True)
+        self.interval = interval
+        self.max_secs = max_secs
+        self.out_dir = out_dir
+        self.running = True
+        self.stop_event = threading.Event()
+        self.stacks = Counter()  # (thread name, frame labels outermost first) -> samples
+        self.labels = {}  # code object -> "function (file:line)"
+        self.samples = 0
+        self.elapsed = 0.0
+        self.cpu_secs = 0.0  # Sampler CPU time, the profile's direct overhead
+        self.paths = None
+
+    def run(self):
+        logging.info(f"Profiling every {self.interval * 1000:.0f} ms.")
+        started, started_cpu = time.monotonic(), time.thread_time()
+        deadline = started + self.max_secs
+        own_ident = threading.get_ident()
+        names = thread_names()
+        while self.running and not self.stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            if frames.keys() - names.keys():
+                names = thread_names()  # Only when a thread has started since the last lookup
+            for ident, frame in frames.items():
+                if ident != own_ident:
+                    self.stacks[names.get(ident, f"thread-{ident}"), self.stack(frame)] += 1
+            frames = frame = None  # Holding frames would keep their locals alive
+            self.samples += 1
+            if time.monotonic() > deadline:
+                logging.warning(f"Profile stopped after {self.max_secs} s.")
+                break
+        self.elapsed = time.monotonic() - started
+        self.cpu_secs = time.thread_time() - started_cpu
+        try:
+            self.paths = self.write_reports()
+        except OSError as e:
+            logging.error(f"Failed to write profile: {e}")
+
+    def stack(self, frame):
+        """Frame labels from the outermost call in, at most MAX_STACK_DEPTH of them."""
+        labels = []
+        while frame is not None and len(labels) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            label = self.labels.get(code)
+            if label is None:
+                label = self.labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            labels.append(label)
+            frame = frame.f_back
+        labels.reverse()
+        return tuple(labels)
+
+    def write_reports(self):
+        """Writes the collapsed stacks and the hot function report; returns their paths."""
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}")
+        with open(f"{base}.folded", "w") as out:
+            for (name, labels), count in sorted(self.stacks.items()):
+                # ';' separates frames in the collapsed format
+                out.write(";".join(label.replace(";", ":") for label in (name, *labels)) + f" {count}\n")
+        with open(f"{base}.txt", "w") as out:
+            out.write(self.report())
+        logging.info(f"Profile of {self.samples} samples in {self.elapsed:.1f} s written to {base}.folded and .txt")
+        return f"{base}.folded", f"{base}.txt"
+
+    def report(self, top_n=PROFILE_TOP_N):
+        """Hottest functions by self samples (innermost frame) and total samples (anywhere on the stack)."""
+        own, total, per_thread = Counter(), Counter(), Counter()
+        for (name, labels), count in self.stacks.items():
+            per_thread[name] += count
+            if labels:
+                own[labels[-1]] += count
+            for label in set(labels):  # Recursion counts once per sample
+                total[label] += count
+        thread_samples = sum(per_thread.values()) or 1
+        lines = [f"{self.samples} samples over {self.elapsed:.1f} s, every {self.interval * 1000:.0f} ms",
+                 f"Sampler CPU {self.cpu_secs:.3f} s ({100 * self.cpu_secs / (self.elapsed or 1):.2f}% of wall time)", "",
+                 f"Top {top_n} functions by self samples:", "   Self%  Total%  Function"]
+        for label, count in own.most_common(top_n):
+            lines.append(f"  {100 * count / thread_samples:6.2f}  {100 * total[label] / thread_samples:6.2f}  {label}")
+        lines += ["", f"Top {top_n} functions by total samples:", "  Total%   Self%  Function"]
+        for label, count in total.most_common(top_n):
+            lines.append(f"  {100 * count / thread_samples:6.2f}  {100 * own[label] / thread_samples:6.2f}  {label}")
+        lines += ["", "Samples per thread:"]
+        for name, count in per_thread.most_common():
+            lines.append(f"  {count:8d}  {name}")
+        return "\n".join(lines) + "\n"
+
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+def start_profile():
+    """Starts a profile unless one is running. Returns a status line."""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is not None and _profiler.is_alive():
+            return "Profile already running."
+        _profiler = SamplingProfiler()
+        _profiler.start()
+        return "Profile started."
+
+def stop_profile():
+    """Stops the running profile and waits for its reports. Returns a status line."""
+    global _profiler
+    with _profiler_lock:
+        profiler, _profiler = _profiler, None
+    if profiler is None:
+        return "No profile running."
+    profiler.stop()
+    profiler.join()
+    if profiler.paths is None:
+        return "Profile stopped; its reports could not be written."
+    return f"Profile stopped: {' '.join(profiler.paths)}"
+
+def toggle_profile():
+    with _profiler_lock:
+        running = _profiler is not None and _profiler.is_alive()
+    return stop_profile() if running else start_profile()
+
+def format_stacks():
+    """Every thread's stack, innermost call last, as from a traceback."""
+    names = thread_names()
+    sections = []
+    for ident, frame in sys._current_frames().items():
+        sections.append(f"Thread {names.get(ident, ident)} ({ident}):\n" + "".join(traceback.format_stack(frame)))
+    return "\n".join(sections)
+
+def dump_stacks():
+    logging.warning(f"Thread stacks:\n{format_stacks()}")
+
+def install_signal_handlers():
+    """SIGUSR1 toggles a profile, SIGUSR2 logs all thread stacks. Call from the main thread."""
+    # Handlers run on the main thread between bytecodes; stopping a profile
+    # joins the sampler, so it is done off the main thread
+    signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(
+        target=lambda: logging.info(toggle_profile()), name="profile-toggle", daemon=True).start())
+    signal.signal(signal.SIGUSR2, lambda signum, frame: dump_stacks())
+
+class ControlServer(threading.Thread):
+    """
+    Answers one-line commands on a Unix socket only this user can open:
+    "profile" toggles a profile, "profile start"/"profile stop", "stacks"
+    returns all thread stacks.
+    """
+
+    def __init__(self, path=CONTROL_SOCKET):
+        super().__init__(name="control-server", daemon=True)
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)  # Left over from a process that did not shut down cleanly
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            self.server.bind(path)
+        finally:
+            os.umask(old_umask)
+        self.server.listen(2)
+        self.running = True
+
+    def run(self):
+        logging.info(f"Control socket listening on {self.path}")
+        while self.running:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                break  # Closed by stop()
+            with client:
+                try:
+                    client.settimeout(5)
+                    command = client.makefile("r").readline().strip()
+                    client.sendall((self.handle(command) + "\n").encode())
+                except OSError as e:
+                    logging.warning(f"Control socket client failed: {e}")
+
+    def handle(self, command):
+        if command == "profile":
+            return toggle_profile()
+        if command == "profile start":
+            return start_profile()
+        if command == "profile stop":
+            return stop_profile()
+        if command == "stacks":
+            return format_stacks()
+        return f"Unknown command {command!r}; expected profile [start|stop] or stacks."
+
+    def stop(self):
+        self.running = False
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)  # Wakes the blocked accept()
+        except OSError:
+            pass
+        self.server.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
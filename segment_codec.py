@@ -0,0 +1,139 @@
+"""
+Packs consecutive gps_data rows into one Firestore "segment" document.
+
+Every numeric column is scaled to an integer and stored as an array of
+deltas from the previous non-null value, so a slowly changing track turns
+into small integers. Firestore does not allow nested arrays, so everything
+is a flat array: missing CAN values stay null in place, and the timezone
+offset is run-length encoded as parallel `tz_index`/`tz_offset` arrays.
+
+Document layout:
+    {
+        "version": 1, "count": N, "first_id": ..., "last_id": ...,
+        "start": first utc_shifted_tstamp, "end": last utc_shifted_tstamp,
+        "id": [...], "t": [...], "lat": [...], "lon": [...], "alt": [...],
+        "rpm": [...], "hours": [...], "coolant": [...], "volts": [...],
+        "tz_index": [...], "tz_offset": [...],
+    }
+"""
+
+SEGMENT_VERSION = 1
+SEGMENT_MAX_BYTES = 512 * 1024  # Half of Firestore's 1 MiB document limit
+SEGMENT_SECS = 30 * 60  # Rows are grouped into fixed windows of shifted time
+SEGMENT_HEADER_BYTES = 1024  # Document name, scalar fields and array names
+
+# (document field, gps_data column, scale to integer)
+SEGMENT_COLUMNS = [
+    ("id", "id", 1),
+    ("t", "utc_shifted_tstamp", 1000),  # milliseconds
+    ("lat", "latitude", 10_000_000),  # ~1 cm
+    ("lon", "longitude", 10_000_000),
+    ("alt", "altitude", 10),  # decimeters
+    ("rpm", "rpm", 1),
+    ("hours", "engine_hours", 100),  # 36 seconds
+    ("coolant", "coolant_temp", 10),
+    ("volts", "alternator_voltage", 100),
+]
+# Upper bound per row: every numeric field at 8 bytes, plus a timezone change
+SEGMENT_ROW_BYTES = 8 * len(SEGMENT_COLUMNS) + 32
+SEGMENT_ROW_COLUMNS = [column for _, column, _ in SEGMENT_COLUMNS] + ["tz_offset"]
+
+def delta_encode(values, scale):
+    """Scales values to integers and returns deltas from the previous non-null value."""
+    encoded = []
+    previous = 0
+    for value in values:
+        if value is None:
+            encoded.append(None)
+            continue
+        quantized = int(round(value * scale))
+        encoded.append(quantized - previous)
+        previous = quantized
+    return encoded
+
+def delta_decode(deltas, scale):
+    """Inverse of delta_encode."""
+    decoded = []
+    previous = 0
+    for delta in deltas:
+        if delta is None:
+            decoded.append(None)
+            continue
+        previous += delta
+        decoded.append(previous / scale if scale != 1 else previous)
+    return decoded
+
+def encode_segment(rows):
+    """
+    Encodes rows (dicts keyed by gps_data column, in time order) into one
+    segment document.
+    """
+    doc = {
+        "version": SEGMENT_VERSION,
+        "count": len(rows),
+        "first_id": rows[0]["id"],
+        "last_id": rows[-1]["id"],
+        "start": rows[0]["utc_shifted_tstamp"],
+        "end": rows[-1]["utc_shifted_tstamp"],
+    }
+    for field, column, scale in SEGMENT_COLUMNS:
+        doc[field] = delta_encode([row[column] for row in rows], scale)
+
+    tz_index, tz_offset = [], []
+    for i, row in enumerate(rows):
+        if not tz_offset or row["tz_offset"] != tz_offset[-1]:
+            tz_index.append(i)
+            tz_offset.append(row["tz_offset"])
+    doc["tz_index"] = tz_index
+    doc["tz_offset"] = tz_offset
+    return doc
+
+def decode_segment(doc):
+    """Returns the rows of a segment document as dicts keyed by gps_data column."""
+    if doc.get("version") != SEGMENT_VERSION:
+        raise ValueError(f"Unsupported segment version: {doc.get('version')}")
+
+    count = doc["count"]
+    columns = {column: delta_decode(doc[field], scale) for field, column, scale in SEGMENT_COLUMNS}
+
+    offsets = [None] * count
+    boundaries = doc["tz_index"] + [count]
+    for start, end, offset in zip(boundaries, boundaries[1:], doc["tz_offset"]):
+        offsets[start:end] = [offset] * (end - start)
+
+    return [
+        {**{column: values[i] for column, values in columns.items()}, "tz_offset": offsets[i]}
+        for i in range(count)
+    ]
+
+def estimate_document_size(value, name=None):
+    """
+    Firestore storage size of a value, per its documented size rules; with
+    `name`, includes the document name and per-document overhead.
+    """
+    if name is not None:
+        return len(name.encode()) + 1 + 16 + estimate_document_size(value) + 32
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode()) + 1
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_document_size(v) for v in value)
+    if isinstance(value, dict):
+        return sum(len(k.encode()) + 1 + estimate_document_size(v) for k, v in value.items())
+    raise TypeError(f"Unsupported Firestore value: {type(value).__name__}")
+
+def split_segments(rows, max_bytes=SEGMENT_MAX_BYTES):
+    """
+    Splits rows into consecutive runs whose encoded documents fit `max_bytes`.
+    Earlier runs stay the same when rows are appended, so rewriting a
+    growing window only changes its last part.
+    """
+    rows_per_part = max(1, (max_bytes - SEGMENT_HEADER_BYTES) // SEGMENT_ROW_BYTES)
+    return [rows[i:i + rows_per_part] for i in range(0, len(rows), rows_per_part)]
+
+def window_start(utc_shifted_tstamp, window_secs=SEGMENT_SECS):
+    """Start of the fixed time window a row belongs to."""
+    return int(utc_shifted_tstamp // window_secs * window_secs)
@@ -1,14 +1,311 @@
+import math
+import time
 import sqlite3
+import logging
 import threading
-from geopy.distance import geodesic
+from array import array
+from collections import namedtuple
+import metrics
+from geo_index import backfill_h3, H3_COLUMNS
+from gps_archive import index_archive_chunks
+from canbus_history import autoincrement_canbus_samples
 
-# Shared dictionary for CAN bus data
-latest_canbus_data = {}
-canbus_lock = threading.Lock()
+CANBUS_RING_SIZE = 1024  # Samples kept per PGN
+
+CanbusReading = namedtuple("CanbusReading", ["latest", "mean", "min", "max", "count", "timestamp"])
+
+class CanbusRing:
+    """Fixed-size, array-backed ring of (timestamp, value) samples for one PGN."""
+
+    __slots__ = ("times", "values", "size", "head", "count")
+
+    def __init__(self, size=CANBUS_RING_SIZE):
+        self.times = array("d", bytes(8 * size))
+        self.values = array("d", bytes(8 * size))
+        self.size = size
+        self.head = 0  # Next slot to write
+        self.count = 0
+
+    def append(self, timestamp, value):
+        self.times[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def reading(self, since):
+        """Aggregates samples newer than `since`; the latest sample is always included."""
+        last = (self.head - 1) % self.size
+        latest_time = self.times[last]
+        latest = total = low = high = self.values[last]
+        count = 1
+        idx = last
+        for _ in range(self.count - 1):
+            idx = (idx - 1) % self.size
+            if self.times[idx] < since:
+                break
+            value = self.values[idx]
+            total += value
+            low = min(low, value)
+            high = max(high, value)
+            count += 1
+        return CanbusReading(latest, total / count, low, high, count, latest_time)
+
+class CanbusStore:
+    """
+    Recent CAN bus samples per PGN name, shared between the pipe reader and
+    the writer. All reads and writes take the lock once per call.
+    """
+
+    def __init__(self, ring_size=CANBUS_RING_SIZE):
+        self.ring_size = ring_size
+        self.rings = {}
+        self.lock = threading.Lock()
+
+    def extend(self, samples):
+        """Appends an iterable of (name, timestamp, value) samples."""
+        start = time.perf_counter()
+        with self.lock:
+            metrics.CANBUS_LOCK_WAIT_SECONDS.observe(time.perf_counter() - start)
+            for name, timestamp, value in samples:
+                ring = self.rings.get(name)
+                if ring is None:
+                    ring = self.rings[name] = CanbusRing(self.ring_size)
+                ring.append(timestamp, value)
+
+    def snapshot(self, names, max_age, window=0.0, now=None):
+        """
+        Returns {name: CanbusReading or None} for `names`, taken atomically.
+
+        A PGN whose latest sample is older than `max_age` seconds reads as
+        None. mean/min/max cover the samples from the last `window` seconds.
+        """
+        now = time.time() if now is None else now
+        result = {}
+        start = time.perf_counter()
+        with self.lock:
+            metrics.CANBUS_LOCK_WAIT_SECONDS.observe(time.perf_counter() - start)
+            for name in names:
+                ring = self.rings.get(name)
+                if ring is None or ring.count == 0:
+                    result[name] = None
+                    continue
+                reading = ring.reading(now - window)
+                result[name] = reading if now - reading.timestamp <= max_age else None
+        return result
+
+    def names(self):
+        with self.lock:
+            return list(self.rings)
+
+# Shared CAN bus samples, filled by CanbusPipeReader
+canbus_store = CanbusStore()
+
+SQLITE_BUSY_TIMEOUT_SECS = 10
+SQLITE_CACHED_STATEMENTS = 64  # Prepared statements kept per connection
+
+class SqliteConnectionManager:
+    """
+    Hands out one long-lived SQLite connection per thread.
+
+    Connections run in WAL mode with synchronous=NORMAL, so the uploader's
+    UPDATE no longer blocks the writer's INSERT and each commit costs a WAL
+    append instead of a journal fsync. sqlite3 keeps prepared statements per
+    connection, keyed by SQL text, so callers should reuse constant queries.
+    """
+
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def connection(self):
+        """Returns the calling thread's connection, opening it on first use."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_name,
+                timeout=SQLITE_BUSY_TIMEOUT_SECS,
+                cached_statements=SQLITE_CACHED_STATEMENTS,
+            )
+            # Only takes effect on a new database, and must precede the switch to WAL
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def close(self):
+        """Closes the calling thread's connection."""
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            self.local.conn = None
+            with self.lock:
+                self.connections.remove(conn)
+            conn.close()
+
+# Applied in order; PRAGMA user_version records how many have run. An entry is
+# SQL or a function of the connection, run inside the migration's transaction.
+SCHEMA_MIGRATIONS = [
+    # 1: latest-fix lookups and time-ordered scans
+    "CREATE INDEX IF NOT EXISTS idx_gps_data_tstamp ON gps_data (utc_shifted_tstamp)",
+    # 2: the uploader's pending-row scans and backlog counts
+    "CREATE INDEX IF NOT EXISTS idx_gps_data_pending ON gps_data (id) WHERE uploaded = 0",
+    # 3: rows handed to Firestore whose uploaded flag is not yet set
+    """
+    CREATE TABLE IF NOT EXISTS upload_journal (
+        row_id INTEGER PRIMARY KEY,
+        committed INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    # 4: raw CAN bus samples, kept for CANBUS_RETENTION_SECS
+    """
+    CREATE TABLE IF NOT EXISTS canbus_samples (
+        id INTEGER PRIMARY KEY,
+        pgn TEXT NOT NULL,
+        tstamp REAL NOT NULL,
+        value REAL NOT NULL
+    )
+    """,
+    # 5: retention pruning of raw samples
+    "CREATE INDEX IF NOT EXISTS idx_canbus_samples_tstamp ON canbus_samples (tstamp)",
+    # 6: per-PGN, per-minute CAN bus summaries
+    """
+    CREATE TABLE IF NOT EXISTS canbus_rollups (
+        pgn TEXT NOT NULL,
+        minute INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        min_value REAL NOT NULL,
+        max_value REAL NOT NULL,
+        total REAL NOT NULL,
+        uploaded INTEGER DEFAULT 0,
+        PRIMARY KEY (pgn, minute)
+    )
+    """,
+    # 7: the uploader's pending-rollup scans
+    "CREATE INDEX IF NOT EXISTS idx_canbus_rollups_pending ON canbus_rollups (minute) WHERE uploaded = 0",
+    # 8: high-water marks of incremental jobs
+    """
+    CREATE TABLE IF NOT EXISTS job_state (
+        name TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL
+    )
+    """,
+    # 9: uploader phase and backlog progress, shown by tools/upload_stats.py
+    """
+    CREATE TABLE IF NOT EXISTS upload_progress (
+        name TEXT PRIMARY KEY,
+        value
+    )
+    """,
+    # 10: distinct tz_offset strings, referenced by id from archive chunks
+    """
+    CREATE TABLE IF NOT EXISTS tz_offsets (
+        id INTEGER PRIMARY KEY,
+        tz_offset TEXT UNIQUE
+    )
+    """,
+    # 11: compressed chunks of uploaded gps_data rows, see gps_archive.py
+    """
+    CREATE TABLE IF NOT EXISTS gps_archive (
+        id INTEGER PRIMARY KEY,
+        first_id INTEGER NOT NULL,
+        last_id INTEGER NOT NULL,
+        start_tstamp REAL NOT NULL,
+        end_tstamp REAL NOT NULL,
+        count INTEGER NOT NULL,
+        version INTEGER NOT NULL,
+        data BLOB NOT NULL
+    )
+    """,
+    # 12: time-range reads of archive chunks
+    "CREATE INDEX IF NOT EXISTS idx_gps_archive_tstamp ON gps_archive (start_tstamp)",
+    # 13: per-trip totals, maintained incrementally by trips.update_trips()
+    """
+    CREATE TABLE IF NOT EXISTS trips (
+        id INTEGER PRIMARY KEY,
+        start_tstamp REAL NOT NULL,
+        end_tstamp REAL NOT NULL,
+        tz_offset TEXT,
+        first_id INTEGER NOT NULL,
+        last_id INTEGER NOT NULL,
+        start_latitude REAL,
+        start_longitude REAL,
+        end_latitude REAL,
+        end_longitude REAL,
+        distance_miles REAL NOT NULL,
+        points INTEGER NOT NULL,
+        start_engine_hours REAL,
+        end_engine_hours REAL,
+        max_coolant_temp REAL,
+        min_alternator_voltage REAL,
+        closed INTEGER NOT NULL DEFAULT 0,
+        uploaded INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    # 14: trip listings by date
+    "CREATE INDEX IF NOT EXISTS idx_trips_start ON trips (start_tstamp)",
+    # 15: the uploader's pending-trip scans
+    "CREATE INDEX IF NOT EXISTS idx_trips_pending ON trips (id) WHERE uploaded = 0",
+    # 16-18: H3 cells of each fix, see geo_index.py
+    *(f"ALTER TABLE gps_data ADD COLUMN {column} INTEGER" for column in H3_COLUMNS),
+    # 19: cells of rows stored before 16-18
+    backfill_h3,
+    # 20-22: area lookups, in time order within each cell
+    *(f"CREATE INDEX IF NOT EXISTS idx_gps_data_{column} ON gps_data ({column}, utc_shifted_tstamp)"
+      for column in H3_COLUMNS),
+    # 23: archive chunks by the cells their fixes fall in
+    """
+    CREATE TABLE IF NOT EXISTS gps_archive_cells (
+        cell INTEGER NOT NULL,
+        chunk_id INTEGER NOT NULL,
+        PRIMARY KEY (cell, chunk_id)
+    ) WITHOUT ROWID
+    """,
+    # 24: cells of chunks archived before 23
+    index_archive_chunks,
+    # 25: canbus_samples ids that never drop below the rollup mark
+    autoincrement_canbus_samples,
+    # 26: Firestore documents to delete, keyed without the DEVICE_ID prefix
+    """
+    CREATE TABLE IF NOT EXISTS remote_deletes (
+        collection TEXT NOT NULL,
+        doc_key TEXT NOT NULL,
+        PRIMARY KEY (collection, doc_key)
+    ) WITHOUT ROWID
+    """,
+    # 27-28: trip documents move from start-time keys to first_id keys, see trips.trip_key()
+    "INSERT OR IGNORE INTO remote_deletes (collection, doc_key) "
+    "SELECT 'trips', 'trip-' || CAST(start_tstamp AS INTEGER) FROM trips",
+    "UPDATE trips SET uploaded = 0",
+]
+QUEUE_REMOTE_DELETE_QUERY = "INSERT OR IGNORE INTO remote_deletes (collection, doc_key) VALUES (?, ?)"
+# For documents written again, so a delete still queued cannot remove the new version
+UNQUEUE_REMOTE_DELETE_QUERY = "DELETE FROM remote_deletes WHERE collection = ? AND doc_key = ?"
+
+def document_key(row_id, utc_shifted_tstamp):
+    """Key of a gps_data row's Firestore document, without the DEVICE_ID prefix."""
+    return f"{row_id}-{int(round(utc_shifted_tstamp * 1000))}"
+
+_connection_managers = {}
+_connection_managers_lock = threading.Lock()
+
+def get_connection_manager(db_name):
+    """Returns the process-wide connection manager for a database file."""
+    with _connection_managers_lock:
+        manager = _connection_managers.get(db_name)
+        if manager is None:
+            manager = SqliteConnectionManager(db_name)
+            _connection_managers[db_name] = manager
+        return manager
 
 def initialize_sqlite(db_name):
-    """Initializes the SQLite database with required tables."""
-    conn = sqlite3.connect(db_name)
+    """Initializes the SQLite database with required tables and WAL journaling."""
+    manager = get_connection_manager(db_name)
+    conn = manager.connection()
     c = conn.cursor()
     c.execute("""
         CREATE TABLE IF NOT EXISTS gps_data (
@@ -26,8 +323,197 @@ def initialize_sqlite(db_name):
         )
     """)
     conn.commit()
-    conn.close()
+    migrate_sqlite(conn)
+    manager.close()
+    return manager
+
+def migrate_sqlite(conn):
+    """Applies any schema migrations the database has not seen yet."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, statement in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        with conn:
+            if callable(statement):
+                statement(conn)
+            else:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {number}")
+
+EARTH_RADIUS_MILES = 3958.7613  # IUGG mean radius
+# Haversine on the mean-radius sphere is within 0.57% of the WGS-84 geodesic
+# everywhere (worst case: north-south legs near the equator or the poles).
+HAVERSINE_MAX_REL_ERROR = 0.0057
+
+class RowNotifier:
+    """
+    Tells the uploader that rows were committed to SQLite, so it can send
+    them without waiting for its next poll. Only a count is passed: SQLite
+    stays the source of truth, and a missed notification costs at most one
+    poll interval. The uploader also publishes whether it is online, so
+    writers can commit new rows at once while they would be sent at once,
+    and the writer publishes its newest fix, stored or not, for the
+    uploader's live position document.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.rows = 0  # Committed since the last wait() returned
+        self.woken = False
+        self.notifications = 0
+        self.online = False  # Set by the uploader; False while offline or not running
+        self.latest = None  # Newest processed fix, set by the writer; never stored from here
+
+    def notify(self, rows):
+        with self.condition:
+            self.rows += rows
+            self.notifications += 1
+            self.condition.notify_all()
+
+    def set_online(self, online):
+        self.online = bool(online)
+
+    def publish(self, fix):
+        """Offers the newest fix for the live position without waking the uploader."""
+        self.latest = fix
+
+    def wake(self):
+        """Ends a wait() without rows, e.g. at shutdown."""
+        with self.condition:
+            self.woken = True
+            self.condition.notify_all()
+
+    def wait(self, timeout):
+        """Waits up to `timeout` for committed rows; returns how many were notified."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.rows or self.woken, timeout)
+            rows = self.rows
+            self.rows = 0
+            self.woken = False
+            return rows
+
+upload_notifier = RowNotifier()
+
+class WriteBuffer:
+    """
+    Group-commit buffer for one INSERT statement, owned by a single thread.
+
+    Rows accumulate in memory and are written with one executemany() in one
+    transaction once `max_rows` are waiting or the oldest has waited
+    `max_age_secs`, which bounds what a power cut can lose. A `notifier`
+    is told about every commit; while it reports the uploader online, the
+    age threshold drops to `online_age_secs` so rows are not held back
+    from an uploader that would send them right away. `after_commit(conn)`,
+    when given, runs in its own transaction once the rows are committed;
+    if it fails, the rows stay stored and the error is logged.
+    """
+
+    def __init__(self, manager, query, max_rows, max_age_secs, notifier=None, after_commit=None, online_age_secs=None):
+        self.manager = manager
+        self.query = query
+        self.max_rows = max_rows
+        self.max_age_secs = max_age_secs
+        self.online_age_secs = max_age_secs if online_age_secs is None else min(online_age_secs, max_age_secs)
+        self.notifier = notifier
+        self.after_commit = after_commit
+        self.rows = []
+        self.oldest = None  # Monotonic time the oldest buffered row arrived
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    def extend(self, rows):
+        """Buffers rows, flushing if a threshold is reached. Returns rows flushed."""
+        if rows:
+            if not self.rows:
+                self.oldest = time.monotonic()
+            self.rows.extend(rows)
+        return self.flush() if self.due() else 0
+
+    def max_age(self):
+        """The age threshold, shorter while the uploader is online."""
+        if self.notifier is not None and self.notifier.online:
+            return self.online_age_secs
+        return self.max_age_secs
+
+    def due(self):
+        """True once a size or age threshold is reached."""
+        if not self.rows:
+            return False
+        return len(self.rows) >= self.max_rows or time.monotonic() - self.oldest >= self.max_age()
+
+    def seconds_until_due(self):
+        """Time until the age threshold, or None when empty."""
+        if not self.rows:
+            return None
+        return max(0.0, self.max_age() - (time.monotonic() - self.oldest))
+
+    def flush(self):
+        """Writes every buffered row in one transaction. Returns rows flushed."""
+        if not self.rows:
+            return 0
+        conn = self.manager.connection()
+        with metrics.SQLITE_WRITE_SECONDS.time():
+            with conn:
+                conn.executemany(self.query, self.rows)
+        flushed = len(self.rows)
+        metrics.SQLITE_ROWS_WRITTEN.inc(flushed)
+        self.rows = []
+        self.oldest = None
+        self.flushes += 1
+        self.flushed_rows += flushed
+        if self.notifier is not None:
+            self.notifier.notify(flushed)
+        if self.after_commit is not None:
+            try:
+                with conn:
+                    self.after_commit(conn)
+            except Exception as e:
+                logging.error(f"Post-commit step failed; {flushed} rows are stored: {e}")
+        return flushed
 
 def calculate_distance(lat1, lon1, lat2, lon2):
     """Calculate the distance between two lat/lon points in miles."""
+    from geopy.distance import geodesic  # Deferred: only needed near the threshold
     return geodesic((lat1, lon1), (lat2, lon2)).miles
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Great-circle distance in miles; see HAVERSINE_MAX_REL_ERROR for its accuracy."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+def exceeds_distance(lat1, lon1, lat2, lon2, threshold_miles):
+    """
+    Returns (exceeded, distance_miles) for a threshold test.
+
+    The haversine estimate decides the test unless it lands within its error
+    bound of the threshold; only then is the exact geodesic computed.
+    """
+    with metrics.DISTANCE_SECONDS.time():
+        distance = haversine_distance(lat1, lon1, lat2, lon2)
+        if abs(distance - threshold_miles) <= threshold_miles * HAVERSINE_MAX_REL_ERROR:
+            distance = calculate_distance(lat1, lon1, lat2, lon2)
+    return distance > threshold_miles, distance
+
+def haversine_distances(lat1, lon1, lat2, lon2):
+    """Element-wise haversine distances in miles over NumPy arrays (or scalars)."""
+    import numpy as np
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.subtract(lon2, lon1))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+def track_distances(latitudes, longitudes):
+    """
+    Distances in miles between consecutive fixes of a track.
+
+    Returns an array one shorter than the input; its cumulative sum is the
+    distance travelled along the track.
+    """
+    import numpy as np
+    lats = np.asarray(latitudes, dtype=np.float64)
+    lons = np.asarray(longitudes, dtype=np.float64)
+    return haversine_distances(lats[:-1], lons[:-1], lats[1:], lons[1:])
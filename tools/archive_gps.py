@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Moves old uploaded gps_data rows into compressed gps_archive chunks and
+reports the database size before and after.
+
+The uploader does this on its own while idle; this script runs it on
+demand, e.g. with a shorter retention. --vacuum converts a database created
+before incremental auto_vacuum with a one-time VACUUM, so freed pages are
+returned to the file system from then on.
+
+    tools/archive_gps.py boat_tracker.db [--days 30] [--vacuum]
+"""
+import os
+import sys
+import sqlite3
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared_data import migrate_sqlite
+from gps_archive import archive_uploaded_rows, ARCHIVE_RETENTION_SECS
+
+def database_size(conn, db_file):
+    """(bytes on disk including the WAL, free pages)."""
+    size = sum(os.path.getsize(path) for path in (db_file, f"{db_file}-wal") if os.path.exists(path))
+    return size, conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("db_file")
+    parser.add_argument("--days", type=float, default=ARCHIVE_RETENTION_SECS / 86400,
+                        help="keep uploaded rows this many days before archiving")
+    parser.add_argument("--vacuum", action="store_true", help="switch to incremental auto_vacuum and VACUUM once")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_file)
+    migrate_sqlite(conn)
+    before, _ = database_size(conn, args.db_file)
+    archived = archive_uploaded_rows(conn, retention_secs=args.days * 86400)
+    if args.vacuum:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    after, free_pages = database_size(conn, args.db_file)
+    rows, chunks = conn.execute("SELECT COALESCE(SUM(count), 0), COUNT(*) FROM gps_archive").fetchone()
+    conn.close()
+
+    print(f"Archived now:\t\t{archived} rows")
+    print(f"Archive total:\t\t{rows} rows in {chunks} chunks")
+    print(f"Database size:\t\t{before / 2**20:.2f} MiB -> {after / 2**20:.2f} MiB ({free_pages} free pages)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from canbus_pipe_reader import CanbusPipeReader
+from shared_data import canbus_store
+
+NUM_MESSAGES = 200000
+MALFORMED_EVERY = 1000  # Every Nth line is garbage
+PGN_NAMES = ["Engine RPM", "Engine Hours", "Coolant Temperature", "Alternator Voltage",
+             "Fuel Rate", "Oil Pressure", "Water Depth", "Speed Through Water"]
+
+def synthetic_writer(pipe_path, num_messages):
+    """Writes NMEA 2000-style JSON lines into the FIFO as fast as it will take them."""
+    with open(pipe_path, "w") as fifo:
+        for i in range(num_messages):
+            if i % MALFORMED_EVERY == MALFORMED_EVERY - 1:
+                fifo.write("{not json\n")
+                continue
+            name = PGN_NAMES[i % len(PGN_NAMES)]
+            fifo.write(json.dumps({"PGNname": name, "value": i, "timestamp": time.time()}) + "\n")
+
+def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_MESSAGES
+    logging.getLogger().setLevel(logging.WARNING)
+    expected_malformed = num_messages // MALFORMED_EVERY
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pipe_path = os.path.join(tmp, "canbus_pipe")
+        os.mkfifo(pipe_path)
+        reader = CanbusPipeReader(pipe_path)
+        reader.start()
+        time.sleep(0.2)  # Let the reader open the FIFO
+
+        writer = multiprocessing.Process(target=synthetic_writer, args=(pipe_path, num_messages))
+        start = time.monotonic()
+        writer.start()
+        while reader.messages + reader.malformed < num_messages and time.monotonic() - start < 60:
+            time.sleep(0.01)
+        elapsed = time.monotonic() - start
+        writer.join()
+        reader.stop()
+        reader.join()
+
+    stats = reader.stats()
+    print(f"Messages:\t{stats['messages']} in {elapsed:.2f} s ({stats['messages'] / elapsed:.0f} msg/s)")
+    print(f"Batches:\t{stats['batches']} ({stats['messages'] / max(stats['batches'], 1):.0f} msg/lock)")
+    print(f"Malformed:\t{stats['malformed']} (expected {expected_malformed})")
+    print(f"Dropped:\t{stats['dropped']}")
+    print(f"PGNs seen:\t{len(canbus_store.names())}")
+
+    if stats["messages"] + stats["malformed"] != num_messages or stats["malformed"] != expected_malformed:
+        print("FAIL")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
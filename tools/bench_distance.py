@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+from shared_data import (calculate_distance, haversine_distance, exceeds_distance,
+                         haversine_distances, track_distances, HAVERSINE_MAX_REL_ERROR)
+
+THRESHOLD_MILES = 0.10
+NUM_PAIRS = 20000
+
+def make_pairs(num_pairs: int):
+    """Random fix pairs anywhere on earth, up to ~0.3 miles apart."""
+    rng = random.Random(7)
+    pairs = []
+    for _ in range(num_pairs):
+        lat = rng.uniform(-85, 85)
+        lon = rng.uniform(-180, 180)
+        pairs.append((lat, lon, lat + rng.uniform(-0.004, 0.004), lon + rng.uniform(-0.004, 0.004)))
+    return pairs
+
+def bench(label, fn, pairs):
+    start = time.perf_counter()
+    for pair in pairs:
+        fn(*pair)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12}\t{elapsed:8.3f} s\t{elapsed / len(pairs) * 1e6:8.2f} us/pair")
+    return elapsed
+
+def main():
+    num_pairs = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_PAIRS
+    pairs = make_pairs(num_pairs)
+
+    geodesic_secs = bench("geodesic", calculate_distance, pairs)
+    bench("haversine", haversine_distance, pairs)
+    threshold_secs = bench("threshold", lambda *p: exceeds_distance(*p, THRESHOLD_MILES), pairs)
+
+    lat1, lon1, lat2, lon2 = (np.array(col) for col in zip(*pairs))
+    start = time.perf_counter()
+    haversine_distances(lat1, lon1, lat2, lon2)
+    batch_secs = time.perf_counter() - start
+    print(f"{'batch':<12}\t{batch_secs:8.3f} s\t{batch_secs / len(pairs) * 1e6:8.2f} us/pair")
+
+    start = time.perf_counter()
+    track_distances(lat1, lon1)
+    print(f"{'track':<12}\t{time.perf_counter() - start:8.3f} s")
+
+    exact = np.array([calculate_distance(*p) for p in pairs])
+    fast = haversine_distances(lat1, lon1, lat2, lon2)
+    nonzero = exact > 0
+    max_rel_error = np.max(np.abs(fast[nonzero] - exact[nonzero]) / exact[nonzero])
+    disagreements = sum(exceeds_distance(*p, THRESHOLD_MILES)[0] != (d > THRESHOLD_MILES)
+                        for p, d in zip(pairs, exact))
+
+    print(f"Threshold speedup:\t{geodesic_secs / threshold_secs:.1f}x")
+    print(f"Max relative error:\t{max_rel_error:.5f} (bound {HAVERSINE_MAX_REL_ERROR})")
+    print(f"Threshold disagreements:\t{disagreements}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+import io
+import os
+import sys
+import json
+import time
+import tempfile
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared_data import initialize_sqlite, get_connection_manager
+from local_db_writer import INSERT_QUERY, GpsRecord
+from export_track import export, FORMATS, TRIP_GAP_SECS
+
+NUM_ROWS = 300000  # About a season at one stored row a minute
+TRIP_ROWS = 10000  # Rows between gaps that start a new trip
+PEAK_BUDGET_MIB = 16  # Python heap allocated while exporting
+
+class NullWriter(io.TextIOBase):
+    """Counts characters instead of keeping them, so only the exporter's own memory is traced."""
+
+    def __init__(self):
+        self.chars = 0
+
+    def write(self, text):
+        self.chars += len(text)
+        return len(text)
+
+def fill(db_name, num_rows):
+    conn = get_connection_manager(db_name).connection()
+    tstamp = 1.75e9
+    batch = []
+    for i in range(num_rows):
+        tstamp += TRIP_GAP_SECS * 2 if i and i % TRIP_ROWS == 0 else 60
+        batch.append(GpsRecord("UTC-07:00", tstamp, 47.6 + (i % 1000) * 1e-4, -122.4, 1.0, 1500, 100.0 + i / 60, 80.0, 14.2))
+        if len(batch) == 10000:
+            with conn:
+                conn.executemany(INSERT_QUERY, batch)
+            batch = []
+    with conn:
+        conn.executemany(INSERT_QUERY, batch)
+        conn.execute("UPDATE gps_data SET uploaded = 1 WHERE id <= ?", (num_rows // 2,))
+
+def check_small(db_name):
+    """Parses each format for a short time range and checks the trip split."""
+    conn = get_connection_manager(db_name).connection()
+    end = 1.75e9 + (TRIP_ROWS * 2.5) * 60 + TRIP_GAP_SECS * 4
+    outputs = {}
+    for fmt in FORMATS:
+        out = io.StringIO()
+        outputs[fmt] = (export(conn, out, fmt, end=end), out.getvalue())
+    gpx = ET.fromstring(outputs["gpx"][1])
+    tracks = gpx.findall("{http://www.topografix.com/GPX/1/1}trk")
+    features = json.loads(outputs["geojson"][1])["features"]
+    csv_lines = outputs["csv"][1].count("\n") - 1
+    counts = {fmt: count for fmt, (count, _) in outputs.items()}
+    print(f"Range export:\t{counts}, {len(tracks)} GPX tracks, {len(features)} GeoJSON features")
+    return len(tracks) == len(features) == 3 and csv_lines == counts["csv"] and len(set(counts.values())) == 1
+
+def check_trips(db_name):
+    """
+    Splits the first gap-separated run into two trips: exports follow the
+    trips table, and the gap rule still splits the rows no trip covers.
+    """
+    conn = get_connection_manager(db_name).connection()
+    half = TRIP_ROWS // 2
+    with conn:
+        conn.executemany(
+            "INSERT INTO trips (start_tstamp, end_tstamp, first_id, last_id, distance_miles, points, closed) "
+            "VALUES (0, 0, ?, ?, 0, 0, 1)", [(1, half), (half + 1, TRIP_ROWS)])
+    end = 1.75e9 + (TRIP_ROWS * 2.5) * 60 + TRIP_GAP_SECS * 4
+    out = io.StringIO()
+    export(conn, out, "geojson", end=end)
+    trip_ids = [feature["properties"]["trip_id"] for feature in json.loads(out.getvalue())["features"]]
+    with conn:
+        conn.execute("DELETE FROM trips")
+    print(f"Trip export:\ttrip_id of each feature {trip_ids}")
+    return trip_ids == [1, 2, None, None]
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_ROWS
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "export.db")
+        initialize_sqlite(db_name)
+        fill(db_name, num_rows)
+        ok = check_small(db_name) and check_trips(db_name)
+
+        for fmt in FORMATS:
+            for uploaded in (None, 0):
+                conn = get_connection_manager(db_name).connection()
+                out = NullWriter()
+                tracemalloc.start()
+                start = time.monotonic()
+                count = export(conn, out, fmt, uploaded=uploaded)
+                elapsed = time.monotonic() - start
+                peak = tracemalloc.get_traced_memory()[1] / 2**20
+                tracemalloc.stop()
+                expected = num_rows if uploaded is None else num_rows - num_rows // 2
+                label = fmt if uploaded is None else f"{fmt}, pending"
+                print(f"{label:<16}{count:>8} rows  {count / elapsed:>9.0f} rows/s  "
+                      f"{out.chars / 2**20:>6.1f} MiB out  peak heap {peak:.1f} MiB")
+                ok = ok and count == expected and peak < PEAK_BUDGET_MIB
+
+    if not ok:
+        print("FAIL")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
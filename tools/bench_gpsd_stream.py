@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gpsd_stream import GpsdStreamReader, FixQueue
+from shared_data import initialize_sqlite, get_connection_manager
+from local_db_writer import LocalDatabaseWriter
+from fake_gpsd import FakeGpsdServer, circle_track
+
+NUM_REPORTS = 50000
+WRITER_RATE_HZ = 10
+WRITER_SECS = 5
+
+def bench_reader(num_reports):
+    """Streams `num_reports` TPVs as fast as possible and drains them from the queue."""
+    server = FakeGpsdServer(circle_track(num_reports), rate_hz=0, repeat=False)
+    server.start()
+    fixes = FixQueue(maxsize=num_reports)
+    reader = GpsdStreamReader(fixes, server.host, server.port)
+
+    start = time.monotonic()
+    reader.start()
+    while reader.reports < num_reports and time.monotonic() - start < 60:
+        time.sleep(0.01)
+    elapsed = time.monotonic() - start
+    reader.stop()
+    server.stop()
+
+    print(f"Reader:\t{reader.reports} TPV in {elapsed:.2f} s ({reader.reports / elapsed:.0f}/s), "
+          f"malformed {reader.malformed}, dropped {fixes.dropped}")
+    return reader.reports == num_reports
+
+def bench_writer(rate_hz, secs):
+    """Runs the real LocalDatabaseWriter against the fake server."""
+    server = FakeGpsdServer(circle_track(360), rate_hz=rate_hz)
+    server.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "bench.db")
+        initialize_sqlite(db_name)
+        writer = LocalDatabaseWriter(db_name, server.host, server.port, process_interval=0)
+        writer.start()
+        time.sleep(secs)
+        writer.stop()
+        writer.join()
+        server.stop()
+        rows = get_connection_manager(db_name).connection().execute("SELECT COUNT(*) FROM gps_data").fetchone()[0]
+
+    print(f"Writer:\t{writer.gps_reader.reports} TPV at {rate_hz} Hz over {secs} s, "
+          f"{rows} rows written, dropped {writer.fixes.dropped}")
+    return writer.gps_reader.reports > 0 and rows > 0
+
+def main():
+    logging.getLogger().setLevel(logging.WARNING)
+    ok = bench_reader(NUM_REPORTS)
+    ok = bench_writer(WRITER_RATE_HZ, WRITER_SECS) and ok
+    if not ok:
+        print("FAIL")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Measures fix-to-Firestore latency: the real LocalDatabaseWriter reads a
+fake gpsd and stores every fix, the real FirestoreDatabaseWriter uploads
+to the fake Firestore, and each document's commit time is compared with
+the time its TPV report arrived.
+
+    tools/bench_handoff.py [seconds] [event|poll]
+"""
+import os
+import sys
+import time
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import local_db_writer
+from shared_data import initialize_sqlite, RowNotifier
+from local_db_writer import LocalDatabaseWriter
+from firestore_writer import FirestoreDatabaseWriter
+from connectivity import ConnectivityScheduler
+from fake_gpsd import FakeGpsdServer, circle_track
+from fake_firestore import FakeFirestoreClient
+
+BENCH_SECS = 20
+RATE_HZ = 2
+COMMIT_LATENCY = 0.05
+# Offline group-commit ages to compare; while the uploader is online rows are
+# committed within ONLINE_UNFLUSHED_SECS whatever the age, so all meet the budget
+MAX_UNFLUSHED_SECS = (0, 2, local_db_writer.MAX_UNFLUSHED_SECS)
+EVENT_P95_BUDGET_SECS = 1.0
+
+class TimedWriter(LocalDatabaseWriter):
+    """Remembers when the TPV report behind each stored row arrived."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.received = []
+
+    def process(self, gps_data):
+        self.fix_received = gps_data.received
+        super().process(gps_data)
+
+    def write_records(self, records):
+        self.received.extend(self.fix_received for _ in records)
+        super().write_records(records)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def run(secs, mode, max_unflushed_secs):
+    """Returns the fix-to-Firestore latencies of every uploaded row."""
+    server = FakeGpsdServer(circle_track(360), rate_hz=RATE_HZ)
+    server.start()
+    client = FakeFirestoreClient(COMMIT_LATENCY)
+    # Poll mode gives the uploader a channel nobody notifies
+    notifier = RowNotifier()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "handoff.db")
+        initialize_sqlite(db_name)
+        local = TimedWriter(db_name, server.host, server.port, process_interval=0, simplify_tolerance=None,
+                            max_unflushed_secs=max_unflushed_secs, notifier=notifier)
+        uploader = FirestoreDatabaseWriter(db_name, client_factory=lambda: client,
+                                           scheduler=ConnectivityScheduler(probe=lambda: True),
+                                           notifier=notifier if mode == "event" else None)
+        uploader.start()
+        local.start()
+        time.sleep(secs)
+        local.stop()
+        local.join()
+        time.sleep(0.5)
+        uploader.stop()
+        uploader.join()
+        server.stop()
+
+    latencies = []
+    for (collection, doc_id), committed in client.committed_at.items():
+        if collection != "gps_data":
+            continue  # Trip and rollup summaries are not per-fix documents
+        row_id = int(doc_id.split("-")[-2])
+        latencies.append(committed - local.received[row_id - 1])
+    return latencies
+
+def main():
+    secs = float(sys.argv[1]) if len(sys.argv) > 1 else BENCH_SECS
+    mode = sys.argv[2] if len(sys.argv) > 2 else "event"
+    logging.getLogger().setLevel(logging.WARNING)
+    local_db_writer.MIN_MILES_DELTA = 0.0  # Store every fix
+
+    ok = True
+    for max_unflushed_secs in MAX_UNFLUSHED_SECS:
+        latencies = run(secs, mode, max_unflushed_secs)
+        if not latencies:
+            print(f"FAIL: nothing uploaded with MAX_UNFLUSHED_SECS={max_unflushed_secs}")
+            sys.exit(1)
+        p95 = percentile(latencies, 0.95)
+        print(f"{mode}, flush every {max_unflushed_secs:>2} s:\t{len(latencies)} rows, "
+              f"latency p50 {percentile(latencies, 0.5):.2f} s, p95 {p95:.2f} s, max {max(latencies):.2f} s")
+        if mode == "event" and p95 > EVENT_P95_BUDGET_SECS:
+            ok = False
+    if not ok:
+        print(f"FAIL: p95 over {EVENT_P95_BUDGET_SECS} s")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
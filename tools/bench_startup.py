@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Startup budget check: launches a fresh interpreter that starts the
+LocalDatabaseWriter against a fake gpsd, and measures the time from launch
+to the first processed fix, the RSS at that point, and the RSS once the
+cloud stack is imported. Exits 1 when a budget is exceeded or a deferred
+module was loaded before the first fix.
+
+    tools/bench_startup.py [first_fix_secs] [rss_mib]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIRST_FIX_BUDGET_SECS = 3.0  # Generous on a desktop; pass a larger budget on a Pi Zero
+RSS_BUDGET_MIB = 60
+# Must not be imported before the first fix is stored (numpy comes in with timezonefinder)
+DEFERRED_MODULES = ("google.cloud.firestore", "grpc", "google.api_core", "geopy")
+
+def rss_mib():
+    """Resident set size from /proc, in MiB."""
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def child(db_name):
+    """Runs in the fresh interpreter; prints one JSON line of measurements."""
+    import logging
+    from fake_gpsd import FakeGpsdServer, circle_track
+    server = FakeGpsdServer(circle_track(360), rate_hz=10)
+    server.start()
+    baseline = rss_mib()
+
+    from shared_data import initialize_sqlite
+    from local_db_writer import LocalDatabaseWriter
+    from canbus_pipe_reader import CanbusPipeReader
+    logging.getLogger().setLevel(logging.WARNING)
+    initialize_sqlite(db_name)
+    writer = LocalDatabaseWriter(db_name, server.host, server.port)
+    writer.start()
+    writer.first_fix.wait(60)
+    first_fix = time.time()
+    result = {
+        "first_fix": first_fix if writer.first_fix.is_set() else None,
+        "baseline_rss": baseline,
+        "first_fix_rss": rss_mib(),
+        "loaded": [name for name in DEFERRED_MODULES if name in sys.modules],
+    }
+
+    import firestore_writer
+    from google.cloud import firestore
+    result["cloud_rss"] = rss_mib()
+    result["cloud_import_secs"] = time.time() - first_fix
+    writer.stop()
+    writer.join()
+    server.stop()
+    print(json.dumps(result))
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(sys.argv[2])
+        return
+
+    first_fix_budget = float(sys.argv[1]) if len(sys.argv) > 1 else FIRST_FIX_BUDGET_SECS
+    rss_budget = float(sys.argv[2]) if len(sys.argv) > 2 else RSS_BUDGET_MIB
+    with tempfile.TemporaryDirectory() as tmp:
+        launched = time.time()
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", os.path.join(tmp, "startup.db")],
+                                capture_output=True, text=True, timeout=120, cwd=tmp)
+    if output.returncode:
+        print(output.stderr)
+        sys.exit(1)
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+
+    first_fix_secs = result["first_fix"] - launched if result["first_fix"] else float("inf")
+    print(f"Launch to first fix:\t{first_fix_secs:.2f} s (budget {first_fix_budget:.2f} s)")
+    print(f"RSS at first fix:\t{result['first_fix_rss']:.1f} MiB (budget {rss_budget:.0f} MiB, "
+          f"bare interpreter and fake gpsd {result['baseline_rss']:.1f} MiB)")
+    print(f"RSS with cloud stack:\t{result['cloud_rss']:.1f} MiB, "
+          f"importing it took {result['cloud_import_secs']:.2f} s")
+    print(f"Deferred modules loaded early:\t{', '.join(result['loaded']) or 'none'}")
+
+    if first_fix_secs > first_fix_budget or result["first_fix_rss"] > rss_budget or result["loaded"]:
+        print("FAIL: startup budget exceeded")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
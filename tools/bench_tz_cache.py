@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mytime
+
+# A slow drift across Puget Sound, the way the boat moves most days
+START_LAT, START_LON = 47.60, -122.40
+NUM_FIXES = 2000
+
+def make_track(num_fixes: int):
+    """Returns a random-walk track of (lat, lon) fixes, roughly 20 m apart."""
+    rng = random.Random(42)
+    lat, lon = START_LAT, START_LON
+    track = []
+    for _ in range(num_fixes):
+        lat += rng.uniform(-0.0002, 0.0002)
+        lon += rng.uniform(-0.0002, 0.0002)
+        track.append((lat, lon))
+    return track
+
+def bench(label, fn, track):
+    start = time.perf_counter()
+    for lat, lon in track:
+        fn(lat, lon)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10}\t{elapsed:8.3f} s\t{elapsed / len(track) * 1e6:10.1f} us/fix")
+    return elapsed
+
+def main():
+    num_fixes = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_FIXES
+    track = make_track(num_fixes)
+
+    # Warm up the polygon data so both paths pay the same one-time cost
+    mytime.get_tz_offset_uncached(*track[0])
+    mytime.tz_cache.clear()
+
+    uncached = bench("uncached", mytime.get_tz_offset_uncached, track)
+    cached = bench("cached", mytime.get_tz_offset, track)
+
+    mismatches = sum(
+        mytime.get_tz_offset(lat, lon) != mytime.get_tz_offset_uncached(lat, lon)
+        for lat, lon in track
+    )
+    print(f"Speedup:\t{uncached / cached:.1f}x")
+    print(f"Mismatches:\t{mismatches}")
+    print(f"Cache stats:\t{mytime.tz_cache.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared_data import initialize_sqlite, get_connection_manager
+import firestore_writer
+from firestore_writer import FirestoreDatabaseWriter
+from local_db_writer import INSERT_QUERY, GpsRecord
+from fake_firestore import FakeFirestoreClient
+from connectivity import ConnectivityScheduler
+from segment_codec import decode_segment
+
+NUM_ROWS = 20000  # About a week offline at one row a minute
+COMMIT_LATENCY = 0.05
+PER_WRITE_LATENCY = 0.0005
+TIMEOUT_SECS = 120
+RETRY_INTERVAL = 1  # Replaces UPLOAD_INTERVAL so the injected failure doesn't dominate
+
+def fill_backlog(db_name, num_rows):
+    """Writes `num_rows` pending fixes along a straight line."""
+    conn = get_connection_manager(db_name).connection()
+    rows = [GpsRecord("UTC-07:00", 1.7e9 + i * 60, 47.6 + i * 1e-5, -122.4, 0.0, None, None, None, None)
+            for i in range(num_rows)]
+    with conn:
+        conn.executemany(INSERT_QUERY, rows)
+
+def pending(db_name):
+    conn = get_connection_manager(db_name).connection()
+    return conn.execute("SELECT COUNT(*) FROM gps_data WHERE uploaded = 0").fetchone()[0]
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_ROWS
+    upload_mode = sys.argv[2] if len(sys.argv) > 2 else "rows"
+    logging.getLogger().setLevel(logging.WARNING)
+    firestore_writer.UPLOAD_INTERVAL = RETRY_INTERVAL
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "bench.db")
+        initialize_sqlite(db_name)
+        fill_backlog(db_name, num_rows)
+
+        clients = []
+        def client_factory():
+            # The first client fails once, forcing a rebuild
+            client = FakeFirestoreClient(COMMIT_LATENCY, PER_WRITE_LATENCY, fail_commits=0 if clients else 1)
+            clients.append(client)
+            return client
+
+        # The fake backend is always reachable; probe it instead of the network
+        scheduler = ConnectivityScheduler(probe=lambda: True, base_secs=RETRY_INTERVAL)
+        writer = FirestoreDatabaseWriter(db_name, client_factory=client_factory, upload_mode=upload_mode,
+                                         scheduler=scheduler)
+        start = time.monotonic()
+        writer.start()
+        while pending(db_name) and time.monotonic() - start < TIMEOUT_SECS:
+            time.sleep(0.05)
+        elapsed = time.monotonic() - start
+        writer.stop()
+        writer.join()
+
+        remaining = pending(db_name)
+        documents = sum(len(c.collection_documents("gps_data")) for c in clients)
+        commit_sizes = [size for c in clients for size in c.commit_sizes]
+        segments = {}
+        for c in clients:
+            segments.update(c.collection_documents(firestore_writer.SEGMENT_COLLECTION))
+        segment_rows = {row["id"] for doc in segments.values() for row in decode_segment(doc)}
+
+        print(f"Rows:\t\t{num_rows}")
+        print(f"Drain time:\t{elapsed:.2f} s ({(num_rows - remaining) / elapsed:.0f} rows/s)")
+        print(f"Commits:\t{len(commit_sizes)} (largest batch {max(commit_sizes, default=0)})")
+        print(f"Clients built:\t{len(clients)}")
+        print(f"Writes:\t\t{sum(commit_sizes)}")
+        print(f"Documents:\t{documents} rows, {len(segments)} segments holding {len(segment_rows)} rows")
+
+        delivered = documents if upload_mode == "rows" else len(segment_rows)
+        if remaining or delivered != num_rows:
+            print(f"FAIL: {remaining} rows pending, {delivered} rows delivered of {num_rows}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
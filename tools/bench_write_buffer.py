@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared_data import initialize_sqlite, WriteBuffer
+from local_db_writer import INSERT_QUERY, WRITE_BUFFER_ROWS, MAX_UNFLUSHED_SECS, GpsRecord
+from geo_index import h3_cells
+
+NUM_ROWS = 5000
+
+def write_syscalls():
+    """Write syscalls made by this process so far (Linux only, else 0)."""
+    try:
+        with open("/proc/self/io") as io:
+            return next(int(line.split()[1]) for line in io if line.startswith("syscw"))
+    except (OSError, StopIteration):
+        return 0
+
+def bench(label, synchronous, max_rows, max_age_secs, num_rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "bench.db")
+        manager = initialize_sqlite(db_name)
+        manager.connection().execute(f"PRAGMA synchronous={synchronous}")
+        buffer = WriteBuffer(manager, INSERT_QUERY, max_rows, max_age_secs)
+
+        rows = [GpsRecord("UTC-07:00", 1.7e9 + i, 47.6 + i * 1e-6, -122.4, 0.0, 2000.0, 100.0, 80.0, 13.8,
+                          *h3_cells(47.6 + i * 1e-6, -122.4))
+                for i in range(num_rows)]
+        syscalls = write_syscalls()
+        start = time.perf_counter()
+        for row in rows:
+            buffer.extend([row])
+        buffer.flush()
+        elapsed = time.perf_counter() - start
+        syscalls = write_syscalls() - syscalls
+        manager.close()
+
+    # With synchronous=FULL every commit fsyncs the WAL; with NORMAL only checkpoints do
+    print(f"{label:<26}\t{synchronous:<6}\t{num_rows / elapsed:10.0f} rows/s\t"
+          f"{buffer.flushes / num_rows:6.3f} commits/row\t{syscalls / num_rows:6.2f} writes/row")
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_ROWS
+    print(f"{'mode':<26}\tsync  \t{'throughput':>15}\t{'commits (FULL: fsyncs)':>22}\twrite syscalls")
+    for synchronous in ("FULL", "NORMAL"):
+        bench("commit per row", synchronous, 1, 0, num_rows)
+        bench(f"buffered {WRITE_BUFFER_ROWS} rows/{MAX_UNFLUSHED_SECS} s", synchronous,
+              WRITE_BUFFER_ROWS, MAX_UNFLUSHED_SECS, num_rows)
+
+if __name__ == "__main__":
+    main()
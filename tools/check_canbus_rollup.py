@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Checks that CAN bus samples are rolled up before they are pruned, including
+after pruning has emptied canbus_samples (the bus was silent longer than
+the retention period) and on a database from before migration 25 whose
+ids had already restarted below the rollup mark. Exits 1 on a failure.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared_data import initialize_sqlite, migrate_sqlite, SCHEMA_MIGRATIONS
+from canbus_history import (rollup_canbus_samples, prune_canbus_samples, autoincrement_canbus_samples,
+                            INSERT_SAMPLE_QUERY, SET_JOB_STATE_QUERY, CANBUS_RETENTION_SECS, ROLLUP_JOB)
+
+START_TSTAMP = 1.75e9
+OLD_SAMPLES_QUERY = """
+    CREATE TABLE canbus_samples (
+        id INTEGER PRIMARY KEY,
+        pgn TEXT NOT NULL,
+        tstamp REAL NOT NULL,
+        value REAL NOT NULL
+    )
+"""
+
+def insert_samples(conn, tstamp, count):
+    with conn:
+        conn.executemany(INSERT_SAMPLE_QUERY, [("rpm", tstamp + i * 0.1, 1000.0 + i) for i in range(count)])
+
+def rollup_count(conn, tstamp):
+    row = conn.execute("SELECT count FROM canbus_rollups WHERE pgn = 'rpm' AND minute = ?",
+                       (int(tstamp // 60) * 60,)).fetchone()
+    return row[0] if row else 0
+
+def check(label, passed):
+    print(f"{'ok  ' if passed else 'FAIL'}  {label}")
+    return passed
+
+def silent_bus(conn):
+    """Samples after a silence longer than retention are rolled up before they are pruned."""
+    insert_samples(conn, START_TSTAMP, 100)
+    rollup_canbus_samples(conn)
+    prune_canbus_samples(conn, now=START_TSTAMP + CANBUS_RETENTION_SECS + 60)
+    results = [check("pruning emptied canbus_samples", conn.execute("SELECT COUNT(*) FROM canbus_samples").fetchone()[0] == 0)]
+
+    later = START_TSTAMP + CANBUS_RETENTION_SECS + 3600
+    insert_samples(conn, later, 50)
+    results.append(check("new sample ids are above the rollup mark",
+                         conn.execute("SELECT MIN(id) FROM canbus_samples").fetchone()[0] > 100))
+    results.append(check("samples after the silence are rolled up", rollup_canbus_samples(conn) == 50))
+    results.append(check("their minute has a rollup of 50", rollup_count(conn, later) == 50))
+    return results
+
+def restarted_ids(conn):
+    """A database whose ids restarted before migration 25 has the stranded samples rolled up."""
+    with conn:
+        conn.execute("DROP TABLE canbus_samples")
+        conn.execute(OLD_SAMPLES_QUERY)
+        conn.execute(SET_JOB_STATE_QUERY, (ROLLUP_JOB, 100))
+        # Back to just before migration 25; the later ones are idempotent
+        conn.execute(f"PRAGMA user_version = {SCHEMA_MIGRATIONS.index(autoincrement_canbus_samples)}")
+    insert_samples(conn, START_TSTAMP, 50)  # ids 1-50, below the mark
+    migrate_sqlite(conn)
+    return [check("migration rolls up samples stranded below the mark", rollup_canbus_samples(conn) == 50),
+            check("their minute has a rollup of 50", rollup_count(conn, START_TSTAMP) == 50)]
+
+def main():
+    results = []
+    for scenario in (silent_bus, restarted_ids):
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = initialize_sqlite(os.path.join(tmp, "check.db"))
+            results += scenario(manager.connection())
+            manager.close()
+    sys.exit(0 if all(results) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Exercises the upload scheduler offline.
+
+    tools/check_connectivity.py            # scripted outage against the fake Firestore
+    tools/check_connectivity.py HOST PORT  # probe a real host, waiting for network changes
+"""
+import os
+import sys
+import time
+import random
+import logging
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from connectivity import ConnectivityScheduler, NetworkWatcher, TcpProbe
+from shared_data import initialize_sqlite
+import firestore_writer
+from firestore_writer import FirestoreDatabaseWriter
+from fake_firestore import FakeFirestoreClient
+from bench_upload import fill_backlog, pending
+
+OUTAGE_PROBES = 4  # Failed probes before the stand-in network comes back
+BASE_SECS = 0.1
+MAX_SECS = 0.4
+TIMEOUT_SECS = 30
+SERVER_FAILURES = 3  # Commits the fake Firestore fails while the probe passes
+
+class ScriptedProbe:
+    """Stand-in probe that is offline until `failures` probes have been made."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.calls > self.failures
+
+class ManualWatcher:
+    """Stand-in NetworkWatcher whose network changes are triggered by hand."""
+
+    def __init__(self):
+        self.changed = threading.Event()
+        self.waits = []
+
+    def wait(self, timeout, stop_event):
+        self.waits.append(timeout)
+        if self.changed.wait(timeout):
+            self.changed.clear()
+            return True
+        return False
+
+def check_backoff():
+    """Delays double per failure, stay under the ceiling and keep their jitter."""
+    scheduler = ConnectivityScheduler(probe=ScriptedProbe(OUTAGE_PROBES), watcher=ManualWatcher(),
+                                      base_secs=BASE_SECS, max_secs=MAX_SECS, rng=random.Random(1))
+    assert scheduler.wait_until_online(threading.Event())
+    waits = scheduler.watcher.waits
+    print(f"Backoff waits:\t{', '.join(f'{w:.3f}' for w in waits)} s")
+    for failures, wait in enumerate(waits, start=1):
+        ceiling = min(MAX_SECS, BASE_SECS * 2 ** (failures - 1))
+        assert ceiling * (1 - scheduler.jitter) <= wait <= ceiling, (failures, wait)
+    # Only a successful upload ends the backoff, not a successful probe
+    assert len(waits) == OUTAGE_PROBES and scheduler.failures == OUTAGE_PROBES and scheduler.online
+    scheduler.report_success()
+    assert scheduler.failures == 0
+
+def check_network_change():
+    """A network change cuts a long backoff short."""
+    watcher = ManualWatcher()
+    scheduler = ConnectivityScheduler(probe=ScriptedProbe(1), watcher=watcher, base_secs=60, max_secs=60)
+    threading.Timer(0.2, watcher.changed.set).start()
+    start = time.monotonic()
+    assert scheduler.wait_until_online(threading.Event())
+    elapsed = time.monotonic() - start
+    print(f"Woken by change:\t{elapsed:.2f} s into a 30-60 s backoff")
+    assert elapsed < 5
+
+def check_uploader():
+    """The uploader builds no client and makes no commits until the probe succeeds."""
+    logging.getLogger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "connectivity.db")
+        initialize_sqlite(db_name)
+        fill_backlog(db_name, 100)
+
+        client = FakeFirestoreClient()
+        clients = []
+        def client_factory():
+            clients.append(client)
+            return client
+
+        probe = ScriptedProbe(OUTAGE_PROBES)
+        scheduler = ConnectivityScheduler(probe=probe, watcher=ManualWatcher(), base_secs=BASE_SECS,
+                                          max_secs=MAX_SECS)
+        writer = FirestoreDatabaseWriter(db_name, client_factory=client_factory, scheduler=scheduler)
+        writer.start()
+        start = time.monotonic()
+        while probe.calls <= OUTAGE_PROBES and time.monotonic() - start < TIMEOUT_SECS:
+            assert not clients, "client built while offline"
+            time.sleep(0.01)
+        while pending(db_name) and time.monotonic() - start < TIMEOUT_SECS:
+            time.sleep(0.05)
+        writer.stop()
+        writer.join()
+
+        print(f"Uploader:\t{probe.calls} probes, {client.commits} commits, {pending(db_name)} rows pending")
+        assert not pending(db_name) and probe.calls == OUTAGE_PROBES + 1
+
+def check_server_errors():
+    """Uploads failing while the probe passes back off like failed probes, and a success resets them."""
+    logging.getLogger().setLevel(logging.CRITICAL)  # Each failed commit logs errors
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "server_errors.db")
+        initialize_sqlite(db_name)
+        fill_backlog(db_name, 10)
+
+        # Wake-ups come far sooner than the backoff; without it every one would retry
+        firestore_writer.UPLOAD_INTERVAL = BASE_SECS / 10
+        client = FakeFirestoreClient(fail_commits=SERVER_FAILURES)
+        scheduler = ConnectivityScheduler(probe=lambda: True, watcher=ManualWatcher(), base_secs=BASE_SECS,
+                                          max_secs=MAX_SECS, rng=random.Random(1))
+        writer = FirestoreDatabaseWriter(db_name, client_factory=lambda: client, scheduler=scheduler)
+        writer.start()
+        start = time.monotonic()
+        while pending(db_name) and time.monotonic() - start < TIMEOUT_SECS:
+            time.sleep(0.05)
+        writer.stop()
+        writer.join()
+        logging.getLogger().setLevel(logging.WARNING)
+
+        waits = scheduler.watcher.waits
+        print(f"Server errors:	{SERVER_FAILURES} failed commits, waits {', '.join(f'{w:.3f}' for w in waits)} s")
+        assert len(waits) == SERVER_FAILURES, waits
+        for failures, wait in enumerate(waits, start=1):
+            ceiling = min(MAX_SECS, BASE_SECS * 2 ** (failures - 1))
+            assert ceiling * (1 - scheduler.jitter) <= wait <= ceiling, (failures, wait)
+        assert not pending(db_name) and scheduler.failures == 0
+
+def watch(host, port):
+    """Probes a real host until it answers, logging every backoff and network change."""
+    logging.getLogger().setLevel(logging.DEBUG)
+    scheduler = ConnectivityScheduler(probe=TcpProbe(host, port), watcher=NetworkWatcher())
+    try:
+        scheduler.wait_until_online(threading.Event())
+        print(f"{host}:{port} reachable after {scheduler.probes} probes")
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    if len(sys.argv) > 1:
+        watch(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 443)
+        return
+    try:
+        check_backoff()
+        check_network_change()
+        check_uploader()
+        check_server_errors()
+    except AssertionError as e:
+        print(f"FAIL: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""
+Streams gps_data out of a boat_tracker database as TSV, CSV, GPX or GeoJSON.
+
+Rows are read in keyset-paged chunks along the utc_shifted_tstamp index,
+so memory stays flat however large the table is and the database is never
+held in one long read transaction. Rows already moved into gps_archive
+are decoded and merged back in, so exports cover the whole history. GPX and GeoJSON output has one track
+(feature) per trip in the trips table, as tools/list_trips.py and the
+Firestore trip documents show them. Rows no trip covers, e.g. at anchor
+or not yet folded into trips, are split at gaps of more than TRIP_GAP_SECS.
+
+    tools/export_track.py boat_tracker.db --format gpx --start 2025-06-01 --end 2025-07-01 > june.gpx
+"""
+import os
+import sys
+import csv
+import json
+import heapq
+import bisect
+import sqlite3
+import argparse
+import itertools
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mytime import get_timezone, unshift_timestamp
+from gps_archive import iter_archived_rows
+
+CHUNK_ROWS = 5000
+TRIP_GAP_SECS = 30 * 60  # A longer gap between rows no trip covers starts a new track
+SELECT_TRIPS_QUERY = "SELECT id, first_id, last_id FROM trips ORDER BY first_id"
+FORMATS = ("tsv", "csv", "gpx", "geojson")
+
+def build_query(columns, start=None, end=None, uploaded=None, by_id=False):
+    """
+    Returns (sql, params) for one chunk; the chunk's keyset position is
+    appended to params by iter_rows(). Ordering follows idx_gps_data_tstamp,
+    or idx_gps_data_pending (by id) for pending rows without a time range.
+    """
+    conditions, params = [], []
+    if start is not None:
+        conditions.append("utc_shifted_tstamp >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("utc_shifted_tstamp < ?")
+        params.append(end)
+    if uploaded is not None:
+        conditions.append("uploaded = ?")
+        params.append(uploaded)
+    if by_id:
+        conditions.append("id > ?")
+        order = "id"
+    else:
+        conditions.append("(utc_shifted_tstamp, id) > (?, ?)")
+        order = "utc_shifted_tstamp, id"
+    sql = f"SELECT {columns} FROM gps_data WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT ?"
+    return sql, params
+
+def iter_rows(conn, columns="*", start=None, end=None, uploaded=None, chunk_rows=CHUNK_ROWS):
+    """
+    Yields gps_data rows in time order, live rows as sqlite3.Row merged with
+    archived ones. `start`/`end` bound utc_shifted_tstamp; `uploaded` is 0,
+    1 or None. Archived rows are always uploaded, so uploaded=0 skips them.
+    """
+    if columns == "*":
+        names = [info[1] for info in conn.execute("PRAGMA table_info(gps_data)")]
+    else:
+        names = list(dict.fromkeys(["id", "utc_shifted_tstamp"] + list(columns)))
+    live = iter_live_rows(conn, ", ".join(names), start, end, uploaded, chunk_rows)
+    if uploaded == 0:
+        return live
+    archived = iter_archived_rows(conn, names, start, end)
+    return heapq.merge(archived, live, key=lambda row: (row["utc_shifted_tstamp"], row["id"]))
+
+def iter_live_rows(conn, columns, start=None, end=None, uploaded=None, chunk_rows=CHUNK_ROWS):
+    """Yields rows still in gps_data as sqlite3.Row, one chunk query at a time."""
+    by_id = uploaded == 0 and start is None and end is None
+    sql, params = build_query(columns, start, end, uploaded, by_id)
+    conn.row_factory = sqlite3.Row
+    position = (0,) if by_id else (float("-inf"), 0)
+
+    while True:
+        rows = conn.execute(sql, (*params, *position, chunk_rows)).fetchall()
+        yield from rows
+        if len(rows) < chunk_rows:
+            return
+        last = rows[-1]
+        position = (last["id"],) if by_id else (last["utc_shifted_tstamp"], last["id"])
+
+class TripSplitter:
+    """groupby() key that starts a new trip number after a gap of more than `gap_secs`."""
+
+    def __init__(self, gap_secs=TRIP_GAP_SECS):
+        self.gap_secs = gap_secs
+        self.trip = 0
+        self.previous = None
+
+    def __call__(self, row):
+        tstamp = row["utc_shifted_tstamp"]
+        if self.previous is not None and tstamp - self.previous > self.gap_secs:
+            self.trip += 1
+        self.previous = tstamp
+        return self.trip
+
+def iter_trips(rows, gap_secs=TRIP_GAP_SECS):
+    """Groups a time-ordered row stream into trips; yields one row iterator per trip."""
+    return (trip for _, trip in itertools.groupby(rows, TripSplitter(gap_secs)))
+
+def load_trips(conn):
+    """(id, first_id, last_id) of every trip, by first_id; empty for a database without trips."""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'trips'").fetchone():
+        return []
+    return [tuple(trip) for trip in conn.execute(SELECT_TRIPS_QUERY)]
+
+class TripRangeSplitter(TripSplitter):
+    """
+    groupby() key from the trips table: rows from a trip's first_id to its
+    last_id share the key (trip id, None). Other rows fall back to gap
+    splitting, with keys (None, number).
+    """
+
+    def __init__(self, trips, gap_secs=TRIP_GAP_SECS):
+        super().__init__(gap_secs)
+        self.trips = trips
+        self.first_ids = [first_id for _, first_id, _ in trips]
+
+    def __call__(self, row):
+        idx = bisect.bisect_right(self.first_ids, row["id"]) - 1
+        if idx >= 0 and row["id"] <= self.trips[idx][2]:
+            self.previous = None  # Uncovered rows after the trip start a new track
+            return self.trips[idx][0], None
+        return None, super().__call__(row)
+
+def iter_trip_tracks(rows, trips, gap_secs=TRIP_GAP_SECS):
+    """Groups a time-ordered row stream by trip; yields (trips id or None, row iterator) per track."""
+    return ((trip_id, track) for (trip_id, _), track in itertools.groupby(rows, TripRangeSplitter(trips, gap_secs)))
+
+class ShiftedTimeFormatter:
+    """Formats shifted timestamps as 'YYYY-MM-DD HH:MM:SS' local time, building each date string once."""
+
+    def __init__(self):
+        self.day = None
+        self.prefix = ""
+
+    def __call__(self, tstamp):
+        day, secs = divmod(int(tstamp), 86400)
+        if day != self.day:
+            self.day = day
+            self.prefix = datetime.fromtimestamp(day * 86400, timezone.utc).strftime("%Y-%m-%d ")
+        hours, secs = divmod(secs, 3600)
+        return f"{self.prefix}{hours:02d}:{secs // 60:02d}:{secs % 60:02d}"
+
+class UtcTimeFormatter:
+    """ISO 8601 UTC time of a row, undoing the tz_offset shift."""
+
+    def __init__(self):
+        self.zones = {}
+
+    def __call__(self, tstamp, tz_offset):
+        zone = self.zones.get(tz_offset)
+        if zone is None:
+            try:
+                zone = self.zones[tz_offset] = get_timezone(tz_offset)
+            except ValueError:
+                zone = self.zones[tz_offset] = timezone.utc  # 'Unknown' rows were never shifted
+        utc = unshift_timestamp(tstamp, zone)
+        return datetime.fromtimestamp(utc, timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+def write_delimited(rows, out, delimiter="\t"):
+    """TSV or CSV with a header row; utc_shifted_tstamp is shown as local time. Returns rows written."""
+    writer = csv.writer(out, delimiter=delimiter, lineterminator="\n") if delimiter == "," else None
+    format_time = ShiftedTimeFormatter()
+    count = 0
+    time_idx = None
+    for row in rows:
+        if time_idx is None:
+            names = row.keys()
+            time_idx = names.index("utc_shifted_tstamp")
+            if writer:
+                writer.writerow(names)
+            else:
+                out.write("\t".join(names) + "\n")
+        values = list(row)
+        values[time_idx] = format_time(values[time_idx])
+        if writer:
+            writer.writerow(values)
+        else:
+            out.write("\t".join(map(str, values)) + "\n")
+        count += 1
+    return count
+
+def write_gpx(rows, out, trips=()):
+    """GPX 1.1 with one <trk> per trip, see iter_trip_tracks(). Returns rows written."""
+    format_time = UtcTimeFormatter()
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<gpx version="1.1" creator="boat_tracker" xmlns="http://www.topografix.com/GPX/1/1">\n')
+    count = 0
+    for number, (trip_id, trip) in enumerate(iter_trip_tracks(rows, trips), start=1):
+        desc = f"<desc>trips.id {trip_id}</desc>" if trip_id is not None else ""
+        out.write(f"  <trk><name>{escape(f'Trip {number}')}</name>{desc}<trkseg>\n")
+        for row in trip:
+            elevation = f"<ele>{row['altitude']}</ele>" if row["altitude"] is not None else ""
+            out.write(f'    <trkpt lat="{row["latitude"]}" lon="{row["longitude"]}">{elevation}'
+                      f'<time>{format_time(row["utc_shifted_tstamp"], row["tz_offset"])}</time></trkpt>\n')
+            count += 1
+        out.write("  </trkseg></trk>\n")
+    out.write("</gpx>\n")
+    return count
+
+def write_geojson(rows, out, trips=()):
+    """A FeatureCollection with one LineString per trip, written as it streams. Returns rows written."""
+    format_time = UtcTimeFormatter()
+    out.write('{"type": "FeatureCollection", "features": [\n')
+    count = 0
+    for number, (trip_id, trip) in enumerate(iter_trip_tracks(rows, trips), start=1):
+        out.write(",\n" if number > 1 else "")
+        out.write('{"type": "Feature", "geometry": {"type": "LineString", "coordinates": [')
+        first = last = None
+        points = 0
+        for row in trip:
+            out.write(", " if points else "")
+            out.write(f"[{row['longitude']}, {row['latitude']}]")
+            if first is None:
+                first = row
+            last = row
+            points += 1
+        properties = {
+            "trip": number,
+            "trip_id": trip_id,  # trips.id, or None for rows no trip covers
+            "start": format_time(first["utc_shifted_tstamp"], first["tz_offset"]),
+            "end": format_time(last["utc_shifted_tstamp"], last["tz_offset"]),
+            "points": points,
+        }
+        out.write(f"]}}, \"properties\": {json.dumps(properties)}}}")
+        count += points
+    out.write("\n]}\n")
+    return count
+
+def export(conn, out, fmt="tsv", start=None, end=None, uploaded=None, chunk_rows=CHUNK_ROWS):
+    """Writes the selected rows to `out` in `fmt`. Returns rows written."""
+    if fmt in ("gpx", "geojson"):
+        trips = load_trips(conn)
+        rows = iter_rows(conn, ("latitude", "longitude", "altitude", "tz_offset"), start, end, uploaded, chunk_rows)
+        return write_gpx(rows, out, trips) if fmt == "gpx" else write_geojson(rows, out, trips)
+    rows = iter_rows(conn, "*", start, end, uploaded, chunk_rows)
+    return write_delimited(rows, out, "," if fmt == "csv" else "\t")
+
+def parse_time(value):
+    """A local date or date-time (as stored, shifted) to a utc_shifted_tstamp."""
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("db_file")
+    parser.add_argument("--format", choices=FORMATS, default="tsv")
+    parser.add_argument("--start", type=parse_time, help="local date/time, e.g. 2025-06-01 or 2025-06-01T08:00")
+    parser.add_argument("--end", type=parse_time, help="exclusive, same form as --start")
+    parser.add_argument("--uploaded", type=int, choices=(0, 1))
+    parser.add_argument("--output", "-o", help="file to write instead of stdout")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_file)
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        count = export(conn, out, args.format, args.start, args.end, args.uploaded)
+    finally:
+        if args.output:
+            out.close()
+        conn.close()
+    print(f"Exported {count} rows.", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
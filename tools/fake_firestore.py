@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+In-process stand-in for google.cloud.firestore.Client, for exercising the
+uploader without network access or credentials.
+
+    client = FakeFirestoreClient(commit_latency=0.05)
+    writer = FirestoreDatabaseWriter(db_name, client_factory=lambda: client)
+"""
+import threading
+import time
+import uuid
+from google.api_core.exceptions import InvalidArgument, ServiceUnavailable
+
+MAX_BATCH_WRITES = 500
+
+def deep_merge(existing, update):
+    """Merges nested maps the way set(..., merge=True) does."""
+    merged = dict(existing)
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = deep_merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+class FakeDocumentReference:
+    def __init__(self, client, collection, doc_id):
+        self.client = client
+        self.collection = collection
+        self.id = doc_id
+
+    def get(self):
+        return self.client.documents.get((self.collection, self.id))
+
+class FakeCollectionReference:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self.client, self.name, doc_id or uuid.uuid4().hex)
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self.client = client
+        self.writes = []
+
+    def set(self, doc_ref, data, merge=False):
+        self.writes.append((doc_ref, dict(data), merge))
+
+    def delete(self, doc_ref):
+        self.writes.append((doc_ref, None, False))
+
+    def commit(self):
+        self.client.commit_writes(self.writes)
+
+class FakeFirestoreClient:
+    """
+    Stores documents in a dict keyed by (collection, id).
+
+    Args:
+        commit_latency: Seconds each commit takes, plus `per_write_latency` per document.
+        fail_commits: Number of upcoming commits that raise ServiceUnavailable.
+    """
+
+    def __init__(self, commit_latency=0.0, per_write_latency=0.0, fail_commits=0):
+        self.commit_latency = commit_latency
+        self.per_write_latency = per_write_latency
+        self.fail_commits = fail_commits
+        self.documents = {}
+        self.commits = 0
+        self.writes = 0
+        self.commit_sizes = []
+        self.committed_at = {}  # (collection, id) -> time.time() of the latest write
+        self.lock = threading.Lock()
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def commit_writes(self, writes):
+        if len(writes) > MAX_BATCH_WRITES:
+            raise InvalidArgument(f"maximum {MAX_BATCH_WRITES} writes allowed per request")
+
+        with self.lock:
+            if self.fail_commits > 0:
+                self.fail_commits -= 1
+                raise ServiceUnavailable("fake outage")
+
+        time.sleep(self.commit_latency + self.per_write_latency * len(writes))
+
+        with self.lock:
+            now = time.time()
+            for doc_ref, data, merge in writes:
+                key = (doc_ref.collection, doc_ref.id)
+                if data is None:
+                    self.documents.pop(key, None)
+                    self.committed_at.pop(key, None)
+                    continue
+                self.committed_at[key] = now
+                if merge and key in self.documents:
+                    self.documents[key] = deep_merge(self.documents[key], data)
+                else:
+                    self.documents[key] = data
+            self.commits += 1
+            self.writes += len(writes)
+            self.commit_sizes.append(len(writes))
+
+    def collection_documents(self, name):
+        with self.lock:
+            return {doc_id: data for (coll, doc_id), data in self.documents.items() if coll == name}
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Local stand-in for gpsd that speaks the JSON WATCH protocol.
+
+After a client sends ?WATCH it gets VERSION, DEVICES and WATCH replies,
+then one TPV report per track point at the configured rate.
+
+    python tools/fake_gpsd.py --port 2947 --rate 10
+"""
+import argparse
+import json
+import math
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+
+# Circles off Shilshole, roughly 1 km across
+CENTER_LAT, CENTER_LON = 47.68, -122.42
+GEOID_SEPARATION_METERS = -23.0  # altHAE minus altMSL around Puget Sound
+
+def circle_track(num_points, radius_deg=0.005):
+    """Returns (lat, lon, alt) points around a circle."""
+    return [
+        (CENTER_LAT + radius_deg * math.sin(2 * math.pi * i / num_points),
+         CENTER_LON + radius_deg * math.cos(2 * math.pi * i / num_points),
+         1.0)
+        for i in range(num_points)
+    ]
+
+def tpv_report(lat, lon, alt, epoch, mode=3):
+    stamp = datetime.fromtimestamp(epoch, tz=timezone.utc).isoformat(timespec="milliseconds")
+    return {"class": "TPV", "device": "/dev/fake", "mode": mode, "time": stamp.replace("+00:00", "Z"),
+            "lat": lat, "lon": lon, "altMSL": alt, "altHAE": alt + GEOID_SEPARATION_METERS, "speed": 2.5, "track": 90.0}
+
+class FakeGpsdServer(threading.Thread):
+    """
+    Serves `track` to every client that sends ?WATCH, `rate_hz` reports per
+    second (0 sends as fast as the socket accepts). Loops the track when
+    `repeat` is set. Port 0 picks a free port; read it from `.port`.
+    """
+
+    def __init__(self, track, rate_hz=1.0, host="127.0.0.1", port=0, repeat=True, start_time=None):
+        super().__init__(daemon=True)
+        self.track = track
+        self.rate_hz = rate_hz
+        self.repeat = repeat
+        self.start_time = start_time
+        self.server = socket.create_server((host, port))
+        self.host, self.port = self.server.getsockname()[:2]
+        self.running = True
+        self.sent = 0
+        self.done = threading.Event()
+
+    def run(self):
+        self.server.settimeout(0.5)
+        while self.running:
+            try:
+                client, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self.serve, args=(client,), daemon=True).start()
+
+    def serve(self, client):
+        with client:
+            try:
+                client.settimeout(5)
+                if b"?WATCH" not in client.recv(1024):
+                    return
+                client.settimeout(None)
+                for reply in ({"class": "VERSION", "release": "3.22", "proto_major": 3, "proto_minor": 14},
+                              {"class": "DEVICES", "devices": [{"path": "/dev/fake"}]},
+                              {"class": "WATCH", "enable": True, "json": True}):
+                    client.sendall(json.dumps(reply).encode() + b"\n")
+                self.stream(client)
+            except OSError:
+                pass
+
+    def stream(self, client):
+        interval = 1.0 / self.rate_hz if self.rate_hz else 0.0
+        epoch = self.start_time or time.time()
+        next_send = time.monotonic()
+        while self.running:
+            for lat, lon, alt in self.track:
+                if not self.running:
+                    return
+                client.sendall(json.dumps(tpv_report(lat, lon, alt, epoch)).encode() + b"\n")
+                self.sent += 1
+                epoch += interval or 1.0
+                if interval:
+                    next_send += interval
+                    time.sleep(max(0.0, next_send - time.monotonic()))
+            if not self.repeat:
+                self.done.set()
+                return
+
+    def stop(self):
+        self.running = False
+        self.server.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2947)
+    parser.add_argument("--rate", type=float, default=1.0, help="TPV reports per second")
+    parser.add_argument("--points", type=int, default=360, help="points per lap of the circle")
+    args = parser.parse_args()
+
+    server = FakeGpsdServer(circle_track(args.points), args.rate, args.host, args.port)
+    server.start()
+    print(f"Fake gpsd listening on {server.host}:{server.port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
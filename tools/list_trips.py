@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Lists trips with their totals from the trips table, plus a grand total.
+
+--rebuild recomputes the table from every stored row, archived ones
+included, e.g. after changing the thresholds in trips.py.
+
+    tools/list_trips.py boat_tracker.db [--start 2025-06-01] [--end 2025-07-01] [--rebuild]
+"""
+import os
+import sys
+import sqlite3
+import argparse
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared_data import migrate_sqlite, QUEUE_REMOTE_DELETE_QUERY, UNQUEUE_REMOTE_DELETE_QUERY
+from trips import TripTracker, save_trips, trip_key, TRIP_JOB, TRIP_ROW_COLUMNS, TRIP_COLLECTION
+from canbus_history import SET_JOB_STATE_QUERY
+from export_track import iter_rows, parse_time
+
+def rebuild(conn):
+    """
+    Replaces every trip with ones folded from the full history, queueing
+    the Firestore documents of trips that no longer exist for deletion.
+    Returns the trip count.
+    """
+    tracker = TripTracker()
+    last_id = 0
+    for row in iter_rows(conn, TRIP_ROW_COLUMNS):
+        tracker.add({name: row[name] for name in TRIP_ROW_COLUMNS})
+        last_id = max(last_id, row["id"])
+    conn.row_factory = None
+    old_keys = {trip_key(first_id) for (first_id,) in conn.execute("SELECT first_id FROM trips")}
+    new_keys = {trip_key(trip["first_id"]) for trip in tracker.changed}
+    with conn:
+        conn.execute("DELETE FROM trips")
+        save_trips(conn, tracker.changed)
+        conn.executemany(QUEUE_REMOTE_DELETE_QUERY, [(TRIP_COLLECTION, key) for key in sorted(old_keys - new_keys)])
+        conn.executemany(UNQUEUE_REMOTE_DELETE_QUERY, [(TRIP_COLLECTION, key) for key in sorted(new_keys)])
+        conn.execute(SET_JOB_STATE_QUERY, (TRIP_JOB, last_id))
+    return len(tracker.changed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("db_file")
+    parser.add_argument("--start", type=parse_time, help="local date/time, e.g. 2025-06-01")
+    parser.add_argument("--end", type=parse_time, help="exclusive, same form as --start")
+    parser.add_argument("--rebuild", action="store_true", help="recompute all trips from gps_data and the archive")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_file)
+    migrate_sqlite(conn)
+    if args.rebuild:
+        print(f"Rebuilt {rebuild(conn)} trips.")
+
+    rows = conn.execute(
+        "SELECT start_tstamp, end_tstamp, distance_miles, start_engine_hours, end_engine_hours, "
+        "max_coolant_temp, min_alternator_voltage, closed FROM trips "
+        "WHERE start_tstamp >= ? AND start_tstamp < ? ORDER BY start_tstamp",
+        (args.start if args.start is not None else float("-inf"),
+         args.end if args.end is not None else float("inf"))).fetchall()
+    conn.close()
+
+    print("Start\t\t\tHours\tMiles\tEngine h\tMax coolant\tMin volts")
+    total_secs = total_miles = total_engine = 0.0
+    for start, end, miles, start_hours, end_hours, coolant, volts, closed in rows:
+        engine = end_hours - start_hours if start_hours is not None else None
+        print(f"{datetime.fromtimestamp(start, timezone.utc):%Y-%m-%d %H:%M}{'' if closed else '*'}\t"
+              f"{(end - start) / 3600:.1f}\t{miles:.1f}\t{'-' if engine is None else f'{engine:.1f}'}\t\t"
+              f"{'-' if coolant is None else f'{coolant:.1f}'}\t\t{'-' if volts is None else f'{volts:.2f}'}")
+        total_secs += end - start
+        total_miles += miles
+        total_engine += engine or 0.0
+    print(f"{len(rows)} trips:\t\t{total_secs / 3600:.1f}\t{total_miles:.1f}\t{total_engine:.1f}")
+    print("(* still open)")
+
+if __name__ == "__main__":
+    main()
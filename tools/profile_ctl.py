@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+"""
+Sends a command to a running boat_tracker's control socket and prints the answer.
+
+    tools/profile_ctl.py profile         # start a profile, or stop it and write the reports
+    tools/profile_ctl.py profile stop
+    tools/profile_ctl.py stacks          # every thread's current stack
+"""
+import os
+import sys
+import socket
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from profiler import CONTROL_SOCKET
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", nargs="+", help="profile [start|stop] or stacks")
+    parser.add_argument("--socket", default=CONTROL_SOCKET, help="path of the control socket")
+    args = parser.parse_args()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(60)  # Stopping a profile waits for its reports
+        client.connect(args.socket)
+        client.sendall((" ".join(args.command) + "\n").encode())
+        client.shutdown(socket.SHUT_WR)
+        answer = b"".join(iter(lambda: client.recv(65536), b""))
+    print(answer.decode(), end="")
+
+if __name__ == "__main__":
+    main()
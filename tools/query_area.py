@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Answers area questions from the H3 cell indexes instead of a table scan.
+
+    radius LAT LON METERS       visits within METERS of a point
+    polygon LAT,LON LAT,LON ... visits inside a polygon
+    dwell                       time spent per cell, e.g. to find anchorages
+
+Candidate rows come from the h3_r* indexes (and, for archived rows, the
+chunks listed in gps_archive_cells); only those are tested exactly. A visit
+ends at a gap of more than VISIT_GAP_SECS between matching fixes.
+
+    tools/query_area.py boat_tracker.db radius 47.6815 -122.4070 300 --start 2025-06-01
+    tools/query_area.py boat_tracker.db dwell --resolution 11 --top 10 --geojson anchorages.geojson
+"""
+import os
+import sys
+import json
+import heapq
+import sqlite3
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import h3.api.basic_int as h3
+from shared_data import migrate_sqlite
+from geo_index import radius_cells, polygon_cells, contains, archive_cells, H3_RESOLUTIONS
+from gps_archive import iter_archived_rows
+from export_track import iter_trips, parse_time, ShiftedTimeFormatter
+
+VISIT_GAP_SECS = 30 * 60
+DWELL_MAX_GAP_SECS = 10 * 60  # Longer gaps between fixes in one cell are not counted as dwell
+ROW_COLUMNS = ["id", "utc_shifted_tstamp", "latitude", "longitude"]
+
+def cell_rows(conn, column, cells, start, end):
+    """Rows whose `column` cell is in `cells`, live and archived, in time order."""
+    conn.row_factory = sqlite3.Row
+    live = conn.execute(
+        f"SELECT {', '.join(ROW_COLUMNS)} FROM gps_data INDEXED BY idx_gps_data_{column} "
+        f"WHERE {column} IN (SELECT value FROM json_each(?)) AND utc_shifted_tstamp >= ? AND utc_shifted_tstamp < ? "
+        "ORDER BY utc_shifted_tstamp",
+        (json.dumps(sorted(cells)), start, end)).fetchall()
+    archived = iter_archived_rows(conn, ROW_COLUMNS, start, end, archive_cells(cells))
+    return heapq.merge(archived, live, key=lambda row: (row["utc_shifted_tstamp"], row["id"]))
+
+def print_visits(rows, distance=None):
+    """One line per visit: start, end, duration and fixes, plus the closest approach for radius queries."""
+    format_time = ShiftedTimeFormatter()
+    visits = 0
+    for visit in iter_trips(rows, VISIT_GAP_SECS):
+        visit = list(visit)
+        first, last = visit[0]["utc_shifted_tstamp"], visit[-1]["utc_shifted_tstamp"]
+        line = f"{format_time(first)}\t{format_time(last)}\t{(last - first) / 3600:.1f} h\t{len(visit)} fixes"
+        if distance is not None:
+            line += f"\t{min(map(distance, visit)):.0f} m closest"
+        print(line)
+        visits += 1
+    print(f"{visits} visits")
+
+def radius(conn, args):
+    column, cells = radius_cells(args.lat, args.lon, args.meters)
+    distance = lambda row: h3.great_circle_distance((args.lat, args.lon), (row["latitude"], row["longitude"]), "m")
+    rows = (row for row in cell_rows(conn, column, cells, args.start, args.end) if distance(row) <= args.meters)
+    print_visits(rows, distance)
+
+def polygon(conn, args):
+    points = [tuple(map(float, point.split(","))) for point in args.points]
+    column, cells = polygon_cells(points)
+    rows = (row for row in cell_rows(conn, column, cells, args.start, args.end)
+            if contains(points, row["latitude"], row["longitude"]))
+    print_visits(rows)
+
+def dwell_totals(conn, resolution, start, end, max_gap):
+    """
+    {cell: [seconds, fixes]}. Dwell is the sum of gaps of at most `max_gap`
+    between consecutive fixes in the same cell. Live rows are read in
+    (cell, time) order straight from the cell index; archived rows are decoded.
+    """
+    column = f"h3_r{resolution}"
+    totals = {}
+    for cell, seconds, fixes in conn.execute(
+            f"SELECT cell, SUM(CASE WHEN gap <= ? THEN gap ELSE 0 END), COUNT(*) FROM ("
+            f"SELECT {column} AS cell, utc_shifted_tstamp - LAG(utc_shifted_tstamp) "
+            f"OVER (PARTITION BY {column} ORDER BY utc_shifted_tstamp) AS gap "
+            f"FROM gps_data INDEXED BY idx_gps_data_{column} "
+            f"WHERE {column} IS NOT NULL AND utc_shifted_tstamp >= ? AND utc_shifted_tstamp < ?) GROUP BY cell",
+            (max_gap, start, end)):
+        totals[cell] = [seconds or 0.0, fixes]
+
+    previous = {}
+    for row in iter_archived_rows(conn, ["id", "utc_shifted_tstamp", column], start, end):
+        cell, tstamp = row[column], row["utc_shifted_tstamp"]
+        if cell is None:
+            continue
+        total = totals.setdefault(cell, [0.0, 0])
+        gap = tstamp - previous.get(cell, tstamp)
+        total[0] += gap if gap <= max_gap else 0.0
+        total[1] += 1
+        previous[cell] = tstamp
+    return totals
+
+def dwell(conn, args):
+    totals = dwell_totals(conn, args.resolution, args.start, args.end, args.max_gap)
+    top = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+    print("Cell\t\t\tLatitude\tLongitude\tHours\tFixes")
+    for cell, (seconds, fixes) in top:
+        lat, lon = h3.cell_to_latlng(cell)
+        print(f"{h3.int_to_str(cell)}\t{lat:.5f}\t{lon:.5f}\t{seconds / 3600:.1f}\t{fixes}")
+    if args.geojson:
+        features = [cell_feature(cell, seconds, fixes) for cell, (seconds, fixes) in top]
+        with open(args.geojson, "w") as out:
+            json.dump({"type": "FeatureCollection", "features": features}, out)
+
+def cell_feature(cell, seconds, fixes):
+    """A GeoJSON polygon of the cell's hexagon, with its dwell as properties."""
+    boundary = h3.cell_to_boundary(cell)
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Polygon", "coordinates": [[[lon, lat] for lat, lon in boundary + boundary[:1]]]},
+        "properties": {"cell": h3.int_to_str(cell), "hours": seconds / 3600, "fixes": fixes},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("db_file")
+    parser.add_argument("--start", type=parse_time, default=float("-inf"), help="local date/time, e.g. 2025-06-01")
+    parser.add_argument("--end", type=parse_time, default=float("inf"), help="exclusive, same form as --start")
+    commands = parser.add_subparsers(dest="command", required=True)
+    radius_parser = commands.add_parser("radius")
+    radius_parser.add_argument("lat", type=float)
+    radius_parser.add_argument("lon", type=float)
+    radius_parser.add_argument("meters", type=float)
+    polygon_parser = commands.add_parser("polygon")
+    polygon_parser.add_argument("points", nargs="+", help="LAT,LON vertices")
+    dwell_parser = commands.add_parser("dwell")
+    dwell_parser.add_argument("--resolution", type=int, choices=H3_RESOLUTIONS, default=H3_RESOLUTIONS[1])
+    dwell_parser.add_argument("--top", type=int, default=20)
+    dwell_parser.add_argument("--max-gap", type=float, default=DWELL_MAX_GAP_SECS)
+    dwell_parser.add_argument("--geojson", help="also write the top cells as GeoJSON polygons")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_file)
+    migrate_sqlite(conn)  # Backfills the cell columns of an older database once
+    try:
+        {"radius": radius, "polygon": polygon, "dwell": dwell}[args.command](conn, args)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+import os
+import sys
+import math
+import bisect
+import random
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from local_db_writer import LocalDatabaseWriter, GpsRecord, MIN_MILES_DELTA, SIMPLIFY_ENGINE_OFF_HEARTBEAT_SECS
+from track_simplifier import TrackSimplifier, cross_track_meters, METERS_PER_DEGREE, SIMPLIFY_TOLERANCE_METERS
+from firestore_writer import live_interval_secs
+from shared_data import initialize_sqlite
+
+START_LAT, START_LON = 47.68, -122.41
+START_TSTAMP = 1.75e9
+GPS_NOISE_METERS = 2.0
+MIN_COMPRESSION = 5.0  # Threshold-rule rows per simplified row
+
+def synthetic_trip(seed=3):
+    """
+    One trip at 1 Hz: maneuvering out of a marina, a long straight run,
+    a sweeping turn, then an hour at anchor. Returns (GpsRecord, rpm) pairs.
+    """
+    rng = random.Random(seed)
+    lat, lon, heading = START_LAT, START_LON, 270.0
+    legs = []
+    legs += [(20, 1.0, 90.0 if i % 2 else -90.0, 1200) for i in range(8)]  # Zig-zag out of the slips
+    legs += [(1800, 8.0, 0.0, 3000)]                                      # Straight run
+    legs += [(600, 6.0, 0.3, 2500)]                                        # Sweeping turn
+    legs += [(3600, 0.0, 0.0, 0)]                                          # At anchor
+
+    fixes = []
+    tstamp = START_TSTAMP
+    for secs, speed, turn, rpm in legs:
+        heading += turn if secs <= 20 else 0.0
+        for _ in range(secs):
+            if secs > 20:
+                heading += turn
+            meters = speed
+            lat += meters * math.cos(math.radians(heading)) / METERS_PER_DEGREE
+            lon += meters * math.sin(math.radians(heading)) / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+            noisy_lat = lat + rng.gauss(0, GPS_NOISE_METERS) / METERS_PER_DEGREE
+            noisy_lon = lon + rng.gauss(0, GPS_NOISE_METERS) / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+            fixes.append((GpsRecord("UTC-07:00", tstamp, noisy_lat, noisy_lon, 0.0, rpm, None, None, None), rpm))
+            tstamp += 1.0
+    return fixes
+
+def replay_threshold(writer, fixes):
+    """Runs fixes through LocalDatabaseWriter.get_updateable, the fixed distance/heartbeat rule."""
+    stored = []
+    writer.last_fix, writer.last_fix_loaded = None, True
+    for record, rpm in fixes:
+        updateable = writer.get_updateable(
+            _Fix(record.latitude, record.longitude, record.altitude), record.utc_shifted_tstamp, rpm)
+        if updateable is not None:
+            point = record._replace(latitude=updateable.lat, longitude=updateable.lon)
+            stored.append(point)
+            writer.last_fix = (point.latitude, point.longitude, point.altitude, point.utc_shifted_tstamp)
+    return stored
+
+def replay_simplifier(fixes, tolerance, heartbeat_secs):
+    """Runs fixes through the TrackSimplifier the writer uses, with the writer's storage heartbeat for each rpm."""
+    simplifier = TrackSimplifier(tolerance)
+    stored = []
+    for record, rpm in fixes:
+        stored += simplifier.add(record, heartbeat_secs(rpm))
+    return stored + simplifier.flush()
+
+def replay_live(fixes):
+    """Fixes the uploader writes to the live position document, if it is always online."""
+    sent = []
+    for record, _ in fixes:
+        if not sent or record.utc_shifted_tstamp - sent[-1].utc_shifted_tstamp >= live_interval_secs(record):
+            sent.append(record)
+    return sent
+
+def max_lag(fixes, stored):
+    """Longest time in seconds between a fix arriving and the newest stored point before it."""
+    times = [p.utc_shifted_tstamp for p in stored]
+    worst = 0.0
+    for record, _ in fixes:
+        idx = bisect.bisect_right(times, record.utc_shifted_tstamp)
+        if idx:
+            worst = max(worst, record.utc_shifted_tstamp - times[idx - 1])
+    return worst
+
+def max_deviation(fixes, stored):
+    """Largest distance in meters from any fix to the stored track at the same time."""
+    times = [p.utc_shifted_tstamp for p in stored]
+    worst = 0.0
+    for record, _ in fixes:
+        idx = bisect.bisect_right(times, record.utc_shifted_tstamp)
+        start = stored[max(idx - 1, 0)]
+        end = stored[min(idx, len(stored) - 1)]
+        worst = max(worst, cross_track_meters(record, start, end))
+    return worst
+
+class _Fix:
+    def __init__(self, lat, lon, alt):
+        self.lat, self.lon, self.alt = lat, lon, alt
+
+def main():
+    tolerance = float(sys.argv[1]) if len(sys.argv) > 1 else SIMPLIFY_TOLERANCE_METERS
+    logging.getLogger().setLevel(logging.WARNING)
+    fixes = synthetic_trip()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "replay.db")
+        initialize_sqlite(db_name)
+        writer = LocalDatabaseWriter(db_name)
+
+        threshold = replay_threshold(writer, fixes)
+        simplified = replay_simplifier(fixes, tolerance, writer.simplify_heartbeat_secs)
+    live = replay_live(fixes)
+
+    print(f"Fixes replayed:\t{len(fixes)}")
+    for label, stored in ((f"threshold ({MIN_MILES_DELTA} mi)", threshold),
+                          (f"simplify ({tolerance} m)", simplified)):
+        print(f"{label:<22}\t{len(stored):6d} rows\t{len(fixes) / len(stored):6.1f}x\t"
+              f"max deviation {max_deviation(fixes, stored):7.1f} m\tmax lag {max_lag(fixes, stored):5.0f} s")
+    print(f"{'live position':<22}\t{len(live):6d} writes\tmax lag {max_lag(fixes, live):5.0f} s")
+    print(f"Firestore writes:\t{len(threshold)} threshold, {len(simplified) + len(live)} simplified with live position")
+
+    if max_deviation(fixes, simplified) > tolerance:
+        print("FAIL: simplified track is outside tolerance")
+        sys.exit(1)
+    if len(threshold) < MIN_COMPRESSION * len(simplified):
+        print(f"FAIL: simplified track is not {MIN_COMPRESSION:.0f}x smaller than the threshold rule's")
+        sys.exit(1)
+    if max_lag(fixes, simplified) > SIMPLIFY_ENGINE_OFF_HEARTBEAT_SECS + 1:
+        print(f"FAIL: stored track lagged more than the {SIMPLIFY_ENGINE_OFF_HEARTBEAT_SECS} s heartbeat")
+        sys.exit(1)
+    if len(simplified) + len(live) >= len(threshold):
+        print("FAIL: stored rows and live position writes outnumber the threshold rule's rows")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
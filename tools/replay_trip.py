@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+"""
+Replays a trip through the real LocalDatabaseWriter, CanbusPipeReader and
+FirestoreDatabaseWriter: TPV reports come from a fake gpsd socket, CAN
+samples are written into a FIFO, and uploads go to the fake Firestore.
+
+Time is virtualized with mytime.set_clock(), so a day at 1 Hz replays in
+under two minutes; the real-time intervals of the pipeline (rollups, upload
+polling) are scaled down to match. Reports throughput, per-stage latency,
+database growth and upload write counts.
+
+Exits 1 if rows are left unuploaded or more fixes than --max-dropped
+(default 0) are not processed. A dropped fix means the writer stalled
+long enough for gpsd_stream's fix queue to overflow. The default SPEED
+replays cleanly here; at much higher speeds, drops measure the harness
+as much as the pipeline, so raise --max-dropped with --speed.
+
+    tools/replay_trip.py                       # synthetic day on the water
+    tools/replay_trip.py --track boat_tracker.db --speed 1000
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import sqlite3
+import logging
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mytime
+import canbus_pipe_reader
+import firestore_writer
+from shared_data import initialize_sqlite, get_connection_manager, upload_notifier
+from canbus_pipe_reader import CanbusPipeReader
+from firestore_writer import FirestoreDatabaseWriter
+from canbus_history import rollup_canbus_samples
+from connectivity import ConnectivityScheduler
+from track_simplifier import METERS_PER_DEGREE, SIMPLIFY_TOLERANCE_METERS
+from fake_gpsd import FakeGpsdServer
+from fake_firestore import FakeFirestoreClient
+from bench_handoff import TimedWriter, percentile
+
+SPEED = 1000  # Virtual seconds per real second; 2000 drops a few fixes to scheduling jitter
+START_TSTAMP = 1.75e9  # 2025-06-15, Pacific daylight time
+START_LAT, START_LON = 47.68, -122.41
+GPS_NOISE_METERS = 2.0
+MAX_GAP_SECS = 3600  # Longest gap in a recorded track that is filled in
+CAN_WRITE_SECS = 0.01  # Real seconds between FIFO writes
+ROLLUP_SECS = 1  # Real seconds between rollup runs, in place of one a minute
+UPLOAD_INTERVAL = 1
+COMMIT_LATENCY = 0.02
+DRAIN_TIMEOUT_SECS = 60
+
+class ScaledClock:
+    """Virtual clock running `speed` times faster than real time from `start`."""
+
+    def __init__(self, start, speed):
+        self.start = start
+        self.speed = speed
+        self.origin = time.monotonic()
+
+    def __call__(self):
+        return self.start + (time.monotonic() - self.origin) * self.speed
+
+def synthetic_day(seed=7):
+    """
+    A day at 1 Hz: a night at the dock, out to an anchorage, lunch at
+    anchor, a sail back and an evening at the dock. Returns one
+    (lat, lon, alt, rpm, coolant_temp, alternator_voltage) point per second.
+    """
+    rng = random.Random(seed)
+    lat, lon, heading = START_LAT, START_LON, 270.0
+    legs = [  # (seconds, meters per second, degrees of turn per second, rpm)
+        (8 * 3600, 0.0, 0.0, 0),
+        (600, 2.0, 0.2, 1200),
+        (2 * 3600, 8.0, 0.01, 3000),
+        (3 * 3600, 0.0, 0.0, 0),
+        (3 * 3600, 3.0, -0.01, 0),     # Under sail
+        (3600, 7.0, 0.05, 2800),
+        (600, 2.0, -0.2, 1200),
+        (7 * 3600 - 1200, 0.0, 0.0, 0),
+    ]
+    points = []
+    coolant = 15.0
+    for secs, speed, turn, rpm in legs:
+        for _ in range(secs):
+            heading += turn
+            lat += speed * math.cos(math.radians(heading)) / METERS_PER_DEGREE
+            lon += speed * math.sin(math.radians(heading)) / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+            coolant += (82.0 - coolant) / 300 if rpm else (15.0 - coolant) / 1800
+            points.append((
+                lat + rng.gauss(0, GPS_NOISE_METERS) / METERS_PER_DEGREE,
+                lon + rng.gauss(0, GPS_NOISE_METERS) / (METERS_PER_DEGREE * math.cos(math.radians(lat))),
+                1.0, rpm + rng.randint(-20, 20) if rpm else 0, coolant, 14.2 if rpm else 12.6,
+            ))
+    return points
+
+def recorded_track(db_name):
+    """Resamples a boat_tracker database's gps_data to 1 Hz by linear interpolation."""
+    conn = sqlite3.connect(db_name)
+    rows = conn.execute(
+        "SELECT utc_shifted_tstamp, latitude, longitude, altitude, rpm, coolant_temp, alternator_voltage "
+        "FROM gps_data ORDER BY utc_shifted_tstamp").fetchall()
+    conn.close()
+    points = []
+    for (t0, *p0), (t1, *p1) in zip(rows, rows[1:]):
+        steps = max(1, min(MAX_GAP_SECS, int(t1 - t0)))
+        for i in range(steps):
+            f = i / steps
+            lat, lon, alt = (a + (b - a) * f if a is not None and b is not None else a
+                             for a, b in zip(p0[:3], p1[:3]))
+            points.append((lat, lon, alt or 0.0, p0[3] or 0, p0[4], p0[5]))
+    return points
+
+class FifoWriter(threading.Thread):
+    """Writes the CAN values of the point at the virtual time into the FIFO, once per virtual second."""
+
+    def __init__(self, pipe_path, points, clock):
+        super().__init__(daemon=True)
+        self.pipe_path = pipe_path
+        self.points = points
+        self.clock = clock
+        self.running = True
+        self.lines = 0
+
+    def run(self):
+        fd = os.open(self.pipe_path, os.O_WRONLY)
+        engine_hours = 1000.0
+        second = 0
+        try:
+            while self.running and second < len(self.points):
+                now = self.clock()
+                lines = []
+                while second < len(self.points) and self.clock.start + second <= now:
+                    _, _, _, rpm, coolant, volts = self.points[second]
+                    tstamp = self.clock.start + second
+                    if rpm:
+                        engine_hours += 1 / 3600
+                    for name, value in (("Engine RPM", rpm), ("Engine Hours", engine_hours),
+                                        ("Coolant Temperature", coolant), ("Alternator Voltage", volts)):
+                        if value is not None:
+                            lines.append(json.dumps({"PGNname": name, "timestamp": tstamp, "value": value}))
+                    second += 1
+                if lines:
+                    os.write(fd, ("\n".join(lines) + "\n").encode())
+                    self.lines += len(lines)
+                time.sleep(CAN_WRITE_SECS)
+        finally:
+            os.close(fd)
+
+class ReplayWriter(TimedWriter):
+    """TimedWriter that also times each process() call and each group commit."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queue_waits = []
+        self.process_secs = []
+        self.flush_secs = []
+        self.committed = []  # Real time each stored row reached SQLite
+        flush = self.write_buffer.flush
+
+        def timed_flush():
+            start = time.monotonic()
+            flushed = flush()
+            if flushed:
+                self.flush_secs.append(time.monotonic() - start)
+                self.committed.extend([time.time()] * flushed)
+            return flushed
+        self.write_buffer.flush = timed_flush
+
+    def process(self, gps_data):
+        start = time.monotonic()
+        self.queue_waits.append(time.time() - gps_data.received)
+        super().process(gps_data)
+        self.process_secs.append(time.monotonic() - start)
+
+def db_bytes(db_name):
+    return sum(os.path.getsize(path) for path in (db_name, db_name + "-wal") if os.path.exists(path))
+
+def summary(values):
+    if not values:
+        return "n/a"
+    return (f"p50 {percentile(values, 0.5) * 1000:.2f} ms, p95 {percentile(values, 0.95) * 1000:.2f} ms, "
+            f"max {max(values) * 1000:.2f} ms")
+
+def replay(points, speed, simplify=True, max_dropped=0):
+    """
+    Runs the pipeline over `points` and prints the report. Returns False on
+    a failed check, including more than `max_dropped` fixes not processed.
+    """
+    canbus_pipe_reader.ROLLUP_SECS = ROLLUP_SECS
+    firestore_writer.UPLOAD_INTERVAL = UPLOAD_INTERVAL
+    client = FakeFirestoreClient(COMMIT_LATENCY)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "replay.db")
+        pipe_path = os.path.join(tmp, "canbus_pipe")
+        initialize_sqlite(db_name)
+        os.mkfifo(pipe_path)
+        empty_bytes = db_bytes(db_name)
+
+        # Its one-time load (~0.3 s) would stall the first fix for hundreds of replayed fixes
+        mytime.get_finder()
+        clock = ScaledClock(START_TSTAMP, speed)
+        mytime.set_clock(clock)
+        mytime.tz_cache.clear()
+        server = FakeGpsdServer([p[:3] for p in points], rate_hz=speed, repeat=False, start_time=START_TSTAMP)
+        canbus = CanbusPipeReader(pipe_path, db_name)
+        fifo = FifoWriter(pipe_path, points, clock)
+        local = ReplayWriter(db_name, server.host, server.port, process_interval=0,
+                             simplify_tolerance=SIMPLIFY_TOLERANCE_METERS if simplify else None)
+        uploader = FirestoreDatabaseWriter(db_name, client_factory=lambda: client,
+                                           scheduler=ConnectivityScheduler(probe=lambda: True))
+
+        started = time.monotonic()
+        canbus.start()
+        fifo.start()
+        uploader.start()
+        local.start()
+        server.start()
+        server.done.wait()
+        deadline = time.monotonic() + 10
+        while (local.gps_reader.reports < len(points) or len(local.fixes)) and time.monotonic() < deadline:
+            time.sleep(0.05)  # Let the writer catch up
+        replay_secs = time.monotonic() - started
+
+        local.stop()
+        local.join()
+        fifo.running = False
+        fifo.join()
+        canbus.stop()
+        canbus.join()
+        rollup_canbus_samples(get_connection_manager(db_name).connection())
+        upload_notifier.wake()
+        while uploader.has_pending_work() and time.monotonic() - started < replay_secs + DRAIN_TIMEOUT_SECS:
+            time.sleep(0.05)
+        drain_secs = time.monotonic() - started - replay_secs
+        uploader.stop()
+        uploader.join()
+        server.stop()
+        mytime.set_clock(None)
+
+        conn = get_connection_manager(db_name).connection()
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ("gps_data", "canbus_samples", "canbus_rollups")}
+        trips = conn.execute("SELECT start_tstamp, end_tstamp, distance_miles, start_engine_hours, end_engine_hours "
+                             "FROM trips ORDER BY start_tstamp").fetchall()
+        pending = conn.execute("SELECT COUNT(*) FROM gps_data WHERE uploaded = 0").fetchone()[0]
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        grown = db_bytes(db_name) - empty_bytes
+
+    rows = counts["gps_data"]
+    processed = len(local.process_secs)
+    uploaded = client.collection_documents("gps_data")
+    latencies = [client.committed_at[("gps_data", doc_id)] - local.received[int(doc_id.split("-")[-2]) - 1]
+                 for doc_id in uploaded]
+    to_sqlite = [committed - received for committed, received in zip(local.committed, local.received)]
+
+    print(f"Replayed:\t{len(points) / 3600:.1f} h of fixes in {replay_secs:.1f} s "
+          f"({len(points) / replay_secs:.0f} fixes/s), upload drained {drain_secs:.1f} s later")
+    print(f"Fixes:\t\t{local.gps_reader.reports} sent, {processed} processed, {local.fixes.dropped} dropped")
+    print(f"CAN:\t\t{fifo.lines} lines, {canbus.messages} parsed, {canbus.malformed} malformed")
+    print(f"gpsd -> writer:\t{summary(local.queue_waits)}")
+    print(f"process():\t{summary(local.process_secs)}")
+    print(f"Group commit:\t{summary(local.flush_secs)} over {len(local.flush_secs)} commits")
+    print(f"Fix -> SQLite:\t{summary(to_sqlite)}")
+    print(f"Fix -> cloud:\t{summary(latencies)}")
+    print(f"Rows:\t\t{rows} gps_data, {counts['canbus_samples']} canbus_samples, "
+          f"{counts['canbus_rollups']} canbus_rollups")
+    print(f"DB growth:\t{grown / 1024:.0f} KiB ({grown / max(rows, 1):.0f} bytes per gps_data row, "
+          f"including CAN history)")
+    print(f"Firestore:\t{client.commits} commits, {client.writes} writes, {len(uploaded)} gps_data documents, "
+          f"{len(client.collection_documents(firestore_writer.ROLLUP_COLLECTION))} rollup documents, "
+          f"{len(client.collection_documents(firestore_writer.TRIP_COLLECTION))} trip documents")
+    for start, end, miles, start_hours, end_hours in trips:
+        hours = f", {end_hours - start_hours:.2f} engine hours" if start_hours is not None else ""
+        print(f"Trip:		{datetime.fromtimestamp(start, timezone.utc):%H:%M}-"
+              f"{datetime.fromtimestamp(end, timezone.utc):%H:%M}, {miles:.1f} miles{hours}")
+
+    ok = True
+    if pending or len(uploaded) != rows:
+        print(f"FAIL: {pending} rows pending, {len(uploaded)} of {rows} uploaded")
+        ok = False
+    if len(points) - processed > max_dropped:
+        print(f"FAIL: {len(points) - processed} of {len(points)} fixes not processed, "
+              f"over --max-dropped {max_dropped}; lower --speed")
+        ok = False
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--track", help="boat_tracker database to replay instead of the synthetic day")
+    parser.add_argument("--speed", type=float, default=SPEED, help="virtual seconds per real second")
+    parser.add_argument("--threshold", action="store_true", help="use the distance/heartbeat rule, not the simplifier")
+    parser.add_argument("--max-dropped", type=int, default=0, help="fixes that may go unprocessed (default 0)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    points = recorded_track(args.track) if args.track else synthetic_day()
+    if not replay(points, args.speed, simplify=not args.threshold, max_dropped=args.max_dropped):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+"""
+Recomputes tz_offset and utc_shifted_tstamp for stored fixes, e.g. after a
+fix to the time zone lookup, and re-derives distance travelled.
+
+Rows are read in keyset chunks, archive chunks included, and spread over a
+process pool. Within a chunk, time zone lookups are shared by every fix in
+the same GRID_DEGREES grid cell; only cells where a 3x3 grid of probes
+(corners, edge midpoints, center) disagrees fall back to one lookup per
+distinct position. UTC times, DST offsets and distances are computed with
+NumPy. Changed rows are written back one transaction per chunk, and trips
+are rebuilt afterwards.
+
+Changed gps_data rows go back into the upload queue. Their old Firestore
+documents are queued in remote_deletes when the document ID, which holds
+the timestamp, changes, and the uploader deletes them before re-sending.
+Limits: archived rows are corrected locally only and their documents keep
+the old values; with UPLOAD_MODE "segments", windows that rows moved out
+of are not rewritten. --local-only leaves Firestore stale for every row.
+
+    tools/reprocess_gps.py boat_tracker.db --dry-run [--diff-limit 50] [--daily]
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import functools
+from collections import deque
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+from mytime import get_finder, get_timezone, format_utc_offset
+from shared_data import (migrate_sqlite, track_distances, document_key, QUEUE_REMOTE_DELETE_QUERY,
+                         UNQUEUE_REMOTE_DELETE_QUERY)
+from gps_archive import decode_chunk, encode_chunk, tz_ids, SELECT_TZ_QUERY, ARCHIVE_VERSION
+from export_track import ShiftedTimeFormatter
+from list_trips import rebuild
+
+CHUNK_ROWS = 20000
+GRID_DEGREES = 0.1  # ~11 km; a cell is looked up once unless a zone boundary crosses it
+DIFF_LIMIT = 20
+
+SELECT_ROWS_QUERY = (
+    "SELECT id, tz_offset, utc_shifted_tstamp, latitude, longitude, uploaded FROM gps_data "
+    "WHERE id > ? ORDER BY id LIMIT ?"
+)
+UPDATE_ROW_QUERY = "UPDATE gps_data SET tz_offset = ?, utc_shifted_tstamp = ? WHERE id = ?"
+REQUEUE_ROW_QUERY = "UPDATE gps_data SET tz_offset = ?, utc_shifted_tstamp = ?, uploaded = 0 WHERE id = ?"
+# A committed journal entry would mark the row uploaded again on the uploader's next recovery
+JOURNAL_DELETE_QUERY = "DELETE FROM upload_journal WHERE row_id = ?"
+SELECT_ARCHIVE_CHUNK_QUERY = "SELECT id, count, version, data FROM gps_archive WHERE id > ? ORDER BY id LIMIT 1"
+UPDATE_ARCHIVE_CHUNK_QUERY = (
+    "UPDATE gps_archive SET start_tstamp = ?, end_tstamp = ?, version = ?, data = ? WHERE id = ?"
+)
+
+@functools.lru_cache(maxsize=None)
+def offset_seconds(tz_offset):
+    """Seconds east of UTC for a stored 'UTC±HH:MM'; 'Unknown' rows were never shifted."""
+    try:
+        return get_timezone(tz_offset).utcoffset(None).total_seconds()
+    except (TypeError, ValueError):
+        return 0.0
+
+@functools.lru_cache(maxsize=None)
+def zone_transitions(zone_name):
+    """(UTC epochs at which the zone's offset changes, offset seconds from each), for np.searchsorted."""
+    import pytz
+    tz = pytz.timezone(zone_name)
+    transitions = getattr(tz, "_utc_transition_times", None)
+    if not transitions:
+        return np.array([-np.inf]), np.array([tz.utcoffset(None).total_seconds()])
+    starts = [-np.inf] + [moment.replace(tzinfo=timezone.utc).timestamp() for moment in transitions[1:]]
+    return np.array(starts), np.array([info[0].total_seconds() for info in tz._transition_info])
+
+def zone_offsets(zone_name, utc):
+    """Offset seconds of a zone at each UTC epoch in `utc`."""
+    starts, offsets = zone_transitions(zone_name)
+    return offsets[np.searchsorted(starts, utc, side="right") - 1]
+
+def zone_names(latitudes, longitudes):
+    """
+    Time zone name of each fix (None where unknown), with lookups shared per
+    grid cell. Returns (names, finder lookups, grid cells).
+    """
+    finder = get_finder()
+    lookup = lambda lat, lon: finder.timezone_at(lat=lat, lng=lon)
+    rows_y = np.floor(latitudes / GRID_DEGREES).astype(np.int64)
+    rows_x = np.floor(longitudes / GRID_DEGREES).astype(np.int64)
+    cells, inverse = np.unique(np.stack([rows_y, rows_x], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[order], np.arange(len(cells) + 1))
+
+    names = np.empty(len(latitudes), dtype=object)
+    lookups = 0
+    inset = GRID_DEGREES * 1e-6  # Keeps corner probes inside the cell
+    for (cell_y, cell_x), begin, end in zip(cells, bounds[:-1], bounds[1:]):
+        rows = order[begin:end]
+        south, west = cell_y * GRID_DEGREES + inset, cell_x * GRID_DEGREES + inset
+        north, east = (cell_y + 1) * GRID_DEGREES - inset, (cell_x + 1) * GRID_DEGREES - inset
+        middle, center = (south + north) / 2, (west + east) / 2
+        probes = [(south, west), (south, center), (south, east), (middle, west), (middle, center),
+                  (middle, east), (north, west), (north, center), (north, east)]
+        zones = {lookup(max(-90.0, min(90.0, lat)), lon) for lat, lon in probes}
+        lookups += len(probes)
+        if len(zones) == 1 and None not in zones:
+            names[rows] = zones.pop()
+            continue
+        # A zone boundary crosses the cell: look up each distinct position
+        positions, position_index = np.unique(np.stack([latitudes[rows], longitudes[rows]], axis=1),
+                                              axis=0, return_inverse=True)
+        position_names = [lookup(lat, lon) for lat, lon in positions]
+        lookups += len(positions)
+        names[rows] = [position_names[i] for i in position_index.reshape(-1)]
+    return names, lookups, len(cells)
+
+def reprocess(job):
+    """
+    Worker: new offsets and shifted times for one chunk. `job` holds the
+    chunk's tz_offset strings and tstamp, latitude and longitude arrays, and
+    the position before the chunk (or None) so distances join up.
+    """
+    offsets, tstamps, latitudes, longitudes, previous = job
+    unique_offsets, offset_index = np.unique(np.array(offsets, dtype=object).astype(str), return_inverse=True)
+    old_seconds = np.array([offset_seconds(offset) for offset in unique_offsets])[offset_index]
+    utc = tstamps - old_seconds
+
+    names, lookups, cells = zone_names(latitudes, longitudes)
+    new_seconds = old_seconds.copy()
+    known = names != None  # noqa: E711, element-wise
+    for name in set(names[known]):
+        rows = names == name
+        new_seconds[rows] = zone_offsets(name, utc[rows])
+    new_tstamps = np.where(known, utc + new_seconds, tstamps)
+    new_offsets = [format_utc_offset(seconds) if is_known else offset
+                   for seconds, is_known, offset in zip(new_seconds, known, offsets)]
+    changed = [i for i, (old, new) in enumerate(zip(offsets, new_offsets))
+               if old != new or tstamps[i] != new_tstamps[i]]
+
+    # Miles per shifted (local) day, each leg counted on the day it ends
+    if previous is not None:
+        latitudes, longitudes = np.append(previous[0], latitudes), np.append(previous[1], longitudes)
+        days = np.floor(new_tstamps / 86400)
+    else:
+        days = np.floor(new_tstamps[1:] / 86400)
+    legs = track_distances(latitudes, longitudes)
+    unique_days, day_index = np.unique(days, return_inverse=True)
+    miles = dict(zip(unique_days.astype(int).tolist(), np.bincount(day_index, weights=legs).tolist()))
+    return new_offsets, new_tstamps, changed, lookups, cells, miles
+
+def bounded_map(pool, fn, items, window):
+    """
+    Runs fn(job) for each (key, job) in `items` and yields ((key, job), result)
+    in order, like pool.map() but with at most `window` jobs in flight so
+    memory stays flat however many chunks there are.
+    """
+    pending = deque()
+    for item in items:
+        pending.append((item, pool.submit(fn, item[1])))
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+def live_jobs(conn, chunk_rows, previous):
+    """
+    (chunk ids and uploaded flags, worker job) for gps_data in id order;
+    `previous` is a one-item list carried across chunks.
+    """
+    last_id = 0
+    while True:
+        rows = conn.execute(SELECT_ROWS_QUERY, (last_id, chunk_rows)).fetchall()
+        if not rows:
+            return
+        ids, offsets, tstamps, latitudes, longitudes, uploaded = zip(*rows)
+        latitudes, longitudes = np.array(latitudes, dtype=np.float64), np.array(longitudes, dtype=np.float64)
+        yield ("live", ids, uploaded), (list(offsets), np.array(tstamps, dtype=np.float64), latitudes, longitudes,
+                                        previous[0])
+        previous[0] = (latitudes[-1], longitudes[-1])
+        last_id = ids[-1]
+
+def archive_jobs(conn, previous):
+    """(chunk, worker job) for each archive chunk, decoded in this process."""
+    offsets_by_id = dict(conn.execute(SELECT_TZ_QUERY))
+    chunk_id = 0
+    while True:
+        chunk = conn.execute(SELECT_ARCHIVE_CHUNK_QUERY, (chunk_id,)).fetchone()
+        if chunk is None:
+            return
+        chunk_id, count, version, data = chunk
+        columns = decode_chunk(data, count, version)
+        offsets = [offsets_by_id.get(tz_id) for tz_id in columns["tz_id"]]
+        latitudes = np.array(columns["latitude"], dtype=np.float64)
+        longitudes = np.array(columns["longitude"], dtype=np.float64)
+        yield ("archive", chunk_id, columns), (offsets, np.array(columns["utc_shifted_tstamp"], dtype=np.float64),
+                                               latitudes, longitudes, previous[0])
+        previous[0] = (latitudes[-1], longitudes[-1])
+
+def write_back(conn, key, job, result, requeue=True):
+    """
+    Stores one chunk's changed rows in a single transaction. With `requeue`,
+    changed live rows are uploaded again and the documents of ones already
+    sent under another ID are queued for deletion.
+    """
+    new_offsets, new_tstamps, changed = result[:3]
+    with conn:
+        if key[0] == "live" and not requeue:
+            ids = key[1]
+            conn.executemany(UPDATE_ROW_QUERY, [(new_offsets[i], float(new_tstamps[i]), ids[i]) for i in changed])
+        elif key[0] == "live":
+            _, ids, uploaded = key
+            old_tstamps = job[1]
+            # Rows still in the journal may have reached Firestore without being marked uploaded
+            journaled = {row_id for (row_id,) in conn.execute("SELECT row_id FROM upload_journal")}
+            conn.executemany(REQUEUE_ROW_QUERY, [(new_offsets[i], float(new_tstamps[i]), ids[i]) for i in changed])
+            conn.executemany(JOURNAL_DELETE_QUERY, [(ids[i],) for i in changed])
+            old_keys = {document_key(ids[i], old_tstamps[i]) for i in changed if uploaded[i] or ids[i] in journaled}
+            new_keys = {document_key(ids[i], new_tstamps[i]) for i in changed}
+            conn.executemany(QUEUE_REMOTE_DELETE_QUERY, [("gps_data", doc_key) for doc_key in sorted(old_keys - new_keys)])
+            conn.executemany(UNQUEUE_REMOTE_DELETE_QUERY, [("gps_data", doc_key) for doc_key in sorted(new_keys)])
+        else:
+            _, chunk_id, columns = key
+            ids = tz_ids(conn, new_offsets)
+            records = [dict(zip(columns, values)) for values in zip(*columns.values())]
+            for record, offset, tstamp in zip(records, new_offsets, new_tstamps):
+                record["tz_id"] = ids[offset]
+                record["utc_shifted_tstamp"] = float(tstamp)
+            conn.execute(UPDATE_ARCHIVE_CHUNK_QUERY, (float(new_tstamps.min()), float(new_tstamps.max()),
+                                                      ARCHIVE_VERSION, encode_chunk(records), chunk_id))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("db_file")
+    parser.add_argument("--dry-run", action="store_true", help="show what would change without writing")
+    parser.add_argument("--diff-limit", type=int, default=DIFF_LIMIT, help="changed rows to show")
+    parser.add_argument("--daily", action="store_true", help="print miles per day")
+    parser.add_argument("--local-only", action="store_true",
+                        help="do not re-upload changed rows; Firestore keeps the old values")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_file)
+    migrate_sqlite(conn)
+    format_time = ShiftedTimeFormatter()
+    started = time.monotonic()
+    rows = changed_rows = archived_changed = lookups = cells = shown = 0
+    miles = {}
+    previous = [None]
+    jobs = [archive_jobs(conn, previous), live_jobs(conn, args.chunk_rows, previous)]
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for source in jobs:
+            # Archive chunks hold the older fixes, so distances join up across the two sources
+            for (key, job), result in bounded_map(pool, reprocess, source, args.workers * 2):
+                offsets, tstamps = job[0], job[1]
+                new_offsets, new_tstamps, changed, chunk_lookups, chunk_cells, chunk_miles = result
+                rows += len(offsets)
+                changed_rows += len(changed)
+                if key[0] == "archive":
+                    archived_changed += len(changed)
+                lookups += chunk_lookups
+                cells += chunk_cells
+                for day, day_miles in chunk_miles.items():
+                    miles[day] = miles.get(day, 0.0) + day_miles
+                for i in changed[:max(0, args.diff_limit - shown)]:
+                    row_id = key[1][i] if key[0] == "live" else key[2]["id"][i]
+                    print(f"{row_id}\t{offsets[i]} {format_time(tstamps[i])} -> "
+                          f"{new_offsets[i]} {format_time(new_tstamps[i])}")
+                    shown += 1
+                if changed and not args.dry_run:
+                    write_back(conn, key, job, result, requeue=not args.local_only)
+
+    if changed_rows and not args.dry_run:
+        rebuild(conn)
+    conn.close()
+    elapsed = time.monotonic() - started
+
+    if args.daily:
+        for day, day_miles in sorted(miles.items()):
+            print(f"{datetime.fromtimestamp(day * 86400, timezone.utc):%Y-%m-%d}\t{day_miles:.1f} miles")
+    print(f"Rows:\t\t{rows} in {elapsed:.1f} s ({rows / max(elapsed, 1e-9):.0f} rows/s)")
+    print(f"Changed:\t{changed_rows}{' (dry run, nothing written)' if args.dry_run else ''}")
+    if changed_rows and not args.dry_run:
+        requeued = 0 if args.local_only else changed_rows - archived_changed
+        print(f"Re-upload:\t{requeued} rows queued; Firestore keeps the old values of {changed_rows - requeued}")
+    print(f"Zone lookups:\t{lookups} for {cells} grid cells")
+    print(f"Distance:\t{sum(miles.values()):.1f} miles")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 #!/usr/bin/env python
-import sqlite3
+import os
 import sys
+import json
+import sqlite3
 from datetime import datetime
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics import STATS_FILE
+
 def get_upload_info(db_file: str):
     """ Prints last upload time, number of records to upload, and time of the last unuploaded record. """
     try:
@@ -25,7 +30,7 @@ def get_upload_info(db_file: str):
 
         # Get the time of the last unuploaded record (uploaded = 0)
         cursor.execute(
-            "SELECT utc_shifted_tstamp FROM gps_data WHERE uploaded = 0 ORDER BY utc_shifted_tstamp DESC LIMIT 1;"
+            "SELECT utc_shifted_tstamp FROM gps_data WHERE uploaded = 0 ORDER BY id DESC LIMIT 1;"
         )
         last_unuploaded = cursor.fetchone()
         last_unuploaded_time = (
@@ -37,16 +42,62 @@ def get_upload_info(db_file: str):
         print(f"Number of records to upload:\t{records_to_upload}")
         print(f"Time of last record:\t\t{last_unuploaded_time}")
 
+        # Uploader progress, written once per upload cycle
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'upload_progress';")
+        if cursor.fetchone():
+            cursor.execute("SELECT name, value FROM upload_progress;")
+            progress = dict(cursor.fetchall())
+            if progress:
+                phase = progress.get("phase", "unknown")
+                remaining = progress.get("remaining", 0)
+                backlog_start = progress.get("backlog_start", 0)
+                done = backlog_start - remaining
+                percent = f" ({100 * done / backlog_start:.0f}% done)" if backlog_start else ""
+                updated = datetime.fromtimestamp(progress.get("updated", 0)).strftime('%Y-%m-%d %H:%M:%S')
+                print(f"Upload phase:\t\t\t{phase}, {remaining} of {backlog_start} remaining{percent}")
+                print(f"Upload cursor id:\t\t{progress.get('cursor_id')}")
+                print(f"Progress updated:\t\t{updated}")
+
         conn.close()
     except sqlite3.Error as e:
         print(f"SQLite error: {e}")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
+def format_seconds(value):
+    if value is None:
+        return "-"
+    if value == float("inf"):
+        return ">10s"
+    return f"{value * 1000:.2f}ms" if value < 1 else f"{value:.1f}s"
+
+def print_stats_file(stats_file: str):
+    """ Prints the metrics snapshot boat_tracker.py writes every few seconds. """
+    try:
+        with open(stats_file) as f:
+            stats = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"No metrics in {stats_file}: {e}")
+        return
+
+    updated = datetime.fromtimestamp(stats["updated"]).strftime('%Y-%m-%d %H:%M:%S')
+    print(f"\nMetrics updated:\t\t{updated}")
+    for name, value in sorted(stats["metrics"].items()):
+        label = name.removeprefix("boat_")
+        if isinstance(value, dict):
+            # Histogram: quantiles are bucket upper bounds
+            print(f"  {label:<32}{value['count']:>10} calls  p50 <= {format_seconds(value['p50']):>8}  "
+                  f"p95 <= {format_seconds(value['p95']):>8}  p99 <= {format_seconds(value['p99']):>8}")
+        else:
+            print(f"  {label:<32}{value:>10}")
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
+    if len(sys.argv) not in (2, 3):
         script = sys.argv[0]
-        print(f"Usage: {script} <db_file>")
+        print(f"Usage: {script} <db_file> [stats_file]")
         sys.exit(1)
 
     get_upload_info(sys.argv[1])
+    stats_file = sys.argv[2] if len(sys.argv) == 3 else STATS_FILE
+    if stats_file and os.path.exists(stats_file):
+        print_stats_file(stats_file)
@@ -0,0 +1,89 @@
+import math
+
+SIMPLIFY_TOLERANCE_METERS = 15.0  # Max distance of any dropped fix from the stored track
+MAX_PENDING_FIXES = 600  # Longest run of fixes held back before one is written anyway; bounds the work per fix
+METERS_PER_DEGREE = 111_319.49  # Mean-radius meters per degree of latitude
+
+def cross_track_meters(point, start, end):
+    """
+    Distance in meters from `point` to the segment start->end, using an
+    equirectangular projection around `start` (accurate to well under a
+    meter at the few-kilometer spans a pending window covers).
+    """
+    scale_x = METERS_PER_DEGREE * math.cos(math.radians(start.latitude))
+    px = (point.longitude - start.longitude) * scale_x
+    py = (point.latitude - start.latitude) * METERS_PER_DEGREE
+    ex = (end.longitude - start.longitude) * scale_x
+    ey = (end.latitude - start.latitude) * METERS_PER_DEGREE
+
+    length_sq = ex * ex + ey * ey
+    if length_sq == 0:
+        return math.hypot(px, py)
+    t = max(0.0, min(1.0, (px * ex + py * ey) / length_sq))
+    return math.hypot(px - t * ex, py - t * ey)
+
+class TrackSimplifier:
+    """
+    Streaming line simplification (an opening-window Douglas-Peucker).
+
+    Fixes are held back while every one of them stays within `tolerance`
+    meters of the straight line from the last stored point (the anchor) to
+    the newest fix. When a fix would break that bound, the fix before it is
+    stored and becomes the new anchor. A heartbeat stores the newest fix
+    when nothing has been stored for a while, so a stationary boat still
+    leaves a point now and then and the stored track is never more than a
+    heartbeat behind. The live position is published separately, so the
+    heartbeat can be long.
+
+    Points only need latitude, longitude and utc_shifted_tstamp attributes;
+    whatever is passed in is what gets returned for storing.
+    """
+
+    def __init__(self, tolerance=SIMPLIFY_TOLERANCE_METERS, max_pending=MAX_PENDING_FIXES, anchor=None):
+        self.tolerance = tolerance
+        self.max_pending = max_pending
+        self.anchor = anchor
+        self.pending = []
+        self.fixes = 0
+        self.stored = 0
+
+    def add(self, point, heartbeat_secs):
+        """
+        Feeds one fix; returns the list of points that should be stored now.
+        A fix more than `heartbeat_secs` after the anchor is stored, which
+        bounds how far the stored track can lag behind the newest fix.
+        """
+        self.fixes += 1
+        if self.anchor is None:
+            return self.store(point)
+
+        emitted = []
+        if self.pending and self.deviates(point):
+            emitted += self.store(self.pending[-1])
+
+        if point.utc_shifted_tstamp - self.anchor.utc_shifted_tstamp > heartbeat_secs \
+                or len(self.pending) >= self.max_pending:
+            emitted += self.store(point)
+        else:
+            self.pending.append(point)
+        return emitted
+
+    def deviates(self, point):
+        """True if any pending fix is off the anchor->point line by more than the tolerance."""
+        return any(cross_track_meters(p, self.anchor, point) > self.tolerance for p in self.pending)
+
+    def store(self, point):
+        """Makes `point` the new anchor; every pending fix precedes it and is dropped."""
+        self.anchor = point
+        self.pending = []
+        self.stored += 1
+        return [point]
+
+    def flush(self):
+        """Stores the newest pending fix, e.g. at shutdown, so the track's end is kept."""
+        if not self.pending:
+            return []
+        return self.store(self.pending[-1])
+
+    def compression_ratio(self):
+        return self.fixes / self.stored if self.stored else 0.0
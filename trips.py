@@ -0,0 +1,212 @@
+"""
+Incremental trip detection over gps_data.
+
+A trip is a run of rows where the boat is active: the engine is running
+(rpm above zero or engine_hours advancing) or it is moving faster than
+TRIP_MIN_SPEED_KNOTS. A trip closes after TRIP_IDLE_SECS without activity
+or at a gap of more than TRIP_GAP_SECS between rows. update_trips() folds
+rows added since its last run into the trips table, so totals are never
+recomputed from the whole track.
+"""
+import logging
+from shared_data import haversine_distance
+from canbus_history import get_job_state, SET_JOB_STATE_QUERY
+
+TRIP_GAP_SECS = 30 * 60  # A longer gap between rows always ends a trip
+TRIP_IDLE_SECS = 15 * 60  # Inactive this long (moored, engine off) ends a trip
+TRIP_MIN_SPEED_KNOTS = 1.5  # Slower movement is treated as drift at anchor or GPS noise
+TRIP_CHUNK_ROWS = 5000
+TRIP_JOB = "trips"
+TRIP_COLLECTION = "trips"  # Firestore collection of trip summary documents
+MILES_PER_NAUTICAL_MILE = 1.150779
+
+# gps_data columns a TripTracker reads, in SELECT order
+TRIP_ROW_COLUMNS = ("id", "tz_offset", "utc_shifted_tstamp", "latitude", "longitude", "rpm", "engine_hours",
+                    "coolant_temp", "alternator_voltage")
+# trips columns, in SELECT_OPEN_TRIP_QUERY and trip_document() order
+TRIP_FIELDS = ("id", "start_tstamp", "end_tstamp", "tz_offset", "first_id", "last_id", "start_latitude",
+               "start_longitude", "end_latitude", "end_longitude", "distance_miles", "points",
+               "start_engine_hours", "end_engine_hours", "max_coolant_temp", "min_alternator_voltage", "closed")
+SELECT_NEW_ROWS_QUERY = f"SELECT {', '.join(TRIP_ROW_COLUMNS)} FROM gps_data WHERE id > ? ORDER BY id LIMIT ?"
+SELECT_ROW_QUERY = f"SELECT {', '.join(TRIP_ROW_COLUMNS)} FROM gps_data WHERE id = ?"
+SELECT_OPEN_TRIP_QUERY = f"SELECT {', '.join(TRIP_FIELDS)} FROM trips WHERE closed = 0 ORDER BY id DESC LIMIT 1"
+INSERT_TRIP_QUERY = f"""
+    INSERT INTO trips ({', '.join(TRIP_FIELDS[1:])}, uploaded)
+    VALUES ({', '.join('?' * len(TRIP_FIELDS[1:]))}, 0)
+"""
+UPDATE_TRIP_QUERY = f"""
+    UPDATE trips SET {', '.join(f'{field} = ?' for field in TRIP_FIELDS[1:])}, uploaded = 0
+    WHERE id = ?
+"""
+
+class TripTracker:
+    """
+    Splits a time-ordered row stream (dicts keyed by TRIP_ROW_COLUMNS) into
+    trips. Trips it opens, extends or closes collect in `changed` until
+    saved. `previous` and `trip` carry the state of an earlier run.
+    """
+
+    def __init__(self, previous=None, trip=None, gap_secs=TRIP_GAP_SECS, idle_secs=TRIP_IDLE_SECS,
+                 min_speed_knots=TRIP_MIN_SPEED_KNOTS):
+        self.previous = previous
+        self.trip = trip
+        self.gap_secs = gap_secs
+        self.idle_secs = idle_secs
+        self.min_speed_mph = min_speed_knots * MILES_PER_NAUTICAL_MILE
+        self.changed = []
+        self.changed_ids = set()  # id() of each trip in `changed`
+
+    def add(self, row):
+        previous = self.previous
+        tstamp = row["utc_shifted_tstamp"]
+        gap = previous is None or tstamp - previous["utc_shifted_tstamp"] > self.gap_secs
+        active = self.is_active(row, None if gap else previous)
+        if self.trip is not None and (gap or (not active and tstamp - self.trip["end_tstamp"] > self.idle_secs)):
+            self.close()
+        if active:
+            if self.trip is None:
+                # Movement began at the previous row, unless the data has a gap
+                self.open(row if gap else previous)
+            self.extend(row)
+        self.previous = row
+
+    def is_active(self, row, previous):
+        """Engine running, engine hours advancing, or moving since `previous`."""
+        if row["rpm"] is not None and row["rpm"] > 0:
+            return True
+        if previous is None:
+            return False
+        if row["engine_hours"] is not None and previous["engine_hours"] is not None \
+                and row["engine_hours"] > previous["engine_hours"]:
+            return True
+        elapsed = row["utc_shifted_tstamp"] - previous["utc_shifted_tstamp"]
+        if elapsed <= 0:
+            return False
+        miles = haversine_distance(previous["latitude"], previous["longitude"], row["latitude"], row["longitude"])
+        return miles / elapsed * 3600 >= self.min_speed_mph
+
+    def open(self, row):
+        self.trip = {
+            "id": None,
+            "start_tstamp": row["utc_shifted_tstamp"],
+            "end_tstamp": row["utc_shifted_tstamp"],
+            "tz_offset": row["tz_offset"],
+            "first_id": row["id"],
+            "last_id": row["id"],
+            "start_latitude": row["latitude"],
+            "start_longitude": row["longitude"],
+            "end_latitude": row["latitude"],
+            "end_longitude": row["longitude"],
+            "distance_miles": 0.0,
+            "points": 1,
+            "start_engine_hours": row["engine_hours"],
+            "end_engine_hours": row["engine_hours"],
+            "max_coolant_temp": row["coolant_temp"],
+            "min_alternator_voltage": row["alternator_voltage"],
+            "closed": 0,
+        }
+        self.mark_changed()
+
+    def extend(self, row):
+        """Adds `row` to the open trip; distance runs from the trip's last active point."""
+        trip = self.trip
+        if row["id"] == trip["last_id"]:
+            return
+        trip["distance_miles"] += haversine_distance(trip["end_latitude"], trip["end_longitude"],
+                                                     row["latitude"], row["longitude"])
+        trip["end_tstamp"] = row["utc_shifted_tstamp"]
+        trip["last_id"] = row["id"]
+        trip["end_latitude"] = row["latitude"]
+        trip["end_longitude"] = row["longitude"]
+        trip["points"] += 1
+        if row["engine_hours"] is not None:
+            if trip["start_engine_hours"] is None:
+                trip["start_engine_hours"] = row["engine_hours"]
+            trip["end_engine_hours"] = row["engine_hours"]
+        coolant, voltage = row["coolant_temp"], row["alternator_voltage"]
+        if coolant is not None and (trip["max_coolant_temp"] is None or coolant > trip["max_coolant_temp"]):
+            trip["max_coolant_temp"] = coolant
+        if voltage is not None and (trip["min_alternator_voltage"] is None or voltage < trip["min_alternator_voltage"]):
+            trip["min_alternator_voltage"] = voltage
+        self.mark_changed()
+
+    def close(self):
+        self.trip["closed"] = 1
+        self.mark_changed()
+        self.trip = None
+
+    def mark_changed(self):
+        if id(self.trip) not in self.changed_ids:
+            self.changed_ids.add(id(self.trip))
+            self.changed.append(self.trip)
+
+def save_trips(conn, trips):
+    """Inserts new trips and updates known ones, marking them for upload."""
+    for trip in trips:
+        values = [trip[field] for field in TRIP_FIELDS[1:]]
+        if trip["id"] is None:
+            trip["id"] = conn.execute(INSERT_TRIP_QUERY, values).lastrowid
+        else:
+            conn.execute(UPDATE_TRIP_QUERY, (*values, trip["id"]))
+
+def update_trips(conn):
+    """
+    Folds gps_data rows added since the last run into trips and advances
+    the job's high-water mark, inside the caller's transaction. The mark
+    makes a failed run harmless: its rows are folded by the next one.
+    LocalDatabaseWriter runs it once at startup, which folds the whole
+    table of a database that predates trips, then after each group commit.
+    Returns the number of rows folded.
+    """
+    last_id = get_job_state(conn, TRIP_JOB)
+    previous = conn.execute(SELECT_ROW_QUERY, (last_id,)).fetchone()
+    trip = conn.execute(SELECT_OPEN_TRIP_QUERY).fetchone()
+    tracker = TripTracker(dict(zip(TRIP_ROW_COLUMNS, previous)) if previous else None,
+                          dict(zip(TRIP_FIELDS, trip)) if trip else None)
+
+    folded = 0
+    while True:
+        rows = conn.execute(SELECT_NEW_ROWS_QUERY, (last_id, TRIP_CHUNK_ROWS)).fetchall()
+        for values in rows:
+            tracker.add(dict(zip(TRIP_ROW_COLUMNS, values)))
+        if rows:
+            last_id = rows[-1][0]
+            folded += len(rows)
+        if len(rows) < TRIP_CHUNK_ROWS:
+            break
+
+    if folded:
+        save_trips(conn, tracker.changed)
+        conn.execute(SET_JOB_STATE_QUERY, (TRIP_JOB, last_id))
+    if folded > TRIP_CHUNK_ROWS:
+        logging.info(f"Folded {folded} gps_data rows into trips.")
+    return folded
+
+def trip_key(first_id):
+    """
+    Document key of a trip, without the DEVICE_ID prefix. Its first row id
+    stays the same when reprocessing rewrites timestamps and when a
+    rebuild keeps the trip's start.
+    """
+    return f"trip-{first_id}"
+
+def trip_document(trip):
+    """Firestore summary document for one trips row selected with TRIP_FIELDS."""
+    trip = dict(zip(TRIP_FIELDS, trip))
+    engine_hours = None
+    if trip["start_engine_hours"] is not None:
+        engine_hours = trip["end_engine_hours"] - trip["start_engine_hours"]
+    return {
+        "tz_offset": trip["tz_offset"],
+        "start_tstamp": trip["start_tstamp"],
+        "end_tstamp": trip["end_tstamp"],
+        "duration_secs": trip["end_tstamp"] - trip["start_tstamp"],
+        "distance_miles": trip["distance_miles"],
+        "engine_hours": engine_hours,
+        "max_coolant_temp": trip["max_coolant_temp"],
+        "min_alternator_voltage": trip["min_alternator_voltage"],
+        "points": trip["points"],
+        "start": {"latitude": trip["start_latitude"], "longitude": trip["start_longitude"]},
+        "end": {"latitude": trip["end_latitude"], "longitude": trip["end_longitude"]},
+        "closed": bool(trip["closed"]),
+    }